@@ -0,0 +1,260 @@
+"""Benchmark each stage of dnabc and the full pipeline.
+
+Run from the top of the repository:
+
+    python -m benchmarks.run_benchmarks --output results.json
+
+Each benchmark runs in a fresh process, so that its peak resident set
+size can be measured.  Results are written as JSON.  Given a previous
+results file with --compare, the run fails if any benchmark became
+slower than the allowed tolerance.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.main import main as dnabc_main
+from dnabclib.sample import Sample
+from dnabclib.seqfile import NoIndexFastqSequenceFile, fastq_parsers
+from dnabclib.twobit import numpy
+from dnabclib.version import __version__
+from dnabclib.writer import PairedFastqWriter
+
+from .synthetic import write_dataset
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss / 1024.0
+    return rss / 1024.0
+
+
+def _load_samples(paths):
+    with open(paths["barcodes"]) as f:
+        return Sample.load(f)
+
+
+def _read_barcodes(paths):
+    if "index" in paths:
+        with open(paths["index"], "rb") as f:
+            return [r.seq for r in fastq_parsers["block"](f)], True
+    with open(paths["forward"], "rb") as f:
+        return [
+            NoIndexFastqSequenceFile._parse_barcode(r.desc)
+            for r in fastq_parsers["block"](f)], False
+
+
+def bench_parse(paths, parser):
+    with open(paths["forward"], "rb") as f:
+        t0 = time.perf_counter()
+        reads = sum(1 for _ in fastq_parsers[parser](f))
+        seconds = time.perf_counter() - t0
+    return reads, os.path.getsize(paths["forward"]), seconds, {}
+
+
+def bench_assign(paths, mismatches):
+    barcodes, revcomp = _read_barcodes(paths)
+    t0 = time.perf_counter()
+    assigner = BarcodeAssigner(
+        _load_samples(paths), mismatches=mismatches, revcomp=revcomp)
+    build_seconds = time.perf_counter() - t0
+
+    assign = assigner.assign
+    t0 = time.perf_counter()
+    for seq in barcodes:
+        assign(seq)
+    seconds = time.perf_counter() - t0
+    nbytes = sum(len(seq) for seq in barcodes)
+    extra = {
+        "build_seconds": build_seconds,
+        "assigned_fraction": 1 - (
+            assigner.read_counts["unassigned"] / float(len(barcodes))),
+        }
+    return len(barcodes), nbytes, seconds, extra
+
+
+def bench_write(paths, compression):
+    barcodes, revcomp = _read_barcodes(paths)
+    assigner = BarcodeAssigner(_load_samples(paths), revcomp=revcomp)
+    with open(paths["forward"], "rb") as f1, open(paths["reverse"], "rb") as f2:
+        readpairs = list(zip(
+            fastq_parsers["block"](f1), fastq_parsers["block"](f2)))
+    samples = [assigner.assign(seq) for seq in barcodes]
+
+    output_dir = tempfile.mkdtemp()
+    try:
+        writer = PairedFastqWriter(output_dir, compression=compression)
+        t0 = time.perf_counter()
+        for readpair, sample in zip(readpairs, samples):
+            writer.write(readpair, sample)
+        writer.close()
+        seconds = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(output_dir)
+    nbytes = os.path.getsize(paths["forward"]) + os.path.getsize(
+        paths["reverse"])
+    return len(readpairs), nbytes, seconds, {}
+
+
+def bench_pipeline(paths, config):
+    work_dir = tempfile.mkdtemp()
+    try:
+        config_fp = os.path.join(work_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump(config, f)
+        args = [
+            "--forward-reads", paths["forward"],
+            "--reverse-reads", paths["reverse"],
+            "--barcode-file", paths["barcodes"],
+            "--output-dir", os.path.join(work_dir, "output"),
+            "--summary-file", os.path.join(work_dir, "summary.json"),
+            "--config-file", config_fp,
+            ]
+        if "index" in paths:
+            args.extend(["--index-reads", paths["index"]])
+        t0 = time.perf_counter()
+        dnabc_main(args)
+        seconds = time.perf_counter() - t0
+        with open(os.path.join(work_dir, "summary.json")) as f:
+            reads = sum(json.load(f)["data"].values())
+    finally:
+        shutil.rmtree(work_dir)
+    nbytes = sum(
+        os.path.getsize(paths[k]) for k in ["forward", "reverse", "index"]
+        if k in paths)
+    return reads, nbytes, seconds, {}
+
+
+def _run(func, args):
+    reads, nbytes, seconds, extra = func(*args)
+    result = {
+        "reads": reads,
+        "seconds": seconds,
+        "reads_per_sec": reads / seconds,
+        "mb_per_sec": nbytes / 1e6 / seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        }
+    result.update(extra)
+    return result
+
+
+def run_benchmarks(paths, repeats=3):
+    """Run every benchmark, keeping the fastest of several repeats."""
+    benchmarks = [
+        ("parse", "line", bench_parse, (paths, "line")),
+        ("parse", "block", bench_parse, (paths, "block")),
+        ("parse", "raw", bench_parse, (paths, "raw")),
+        ("assign", "0 mismatches", bench_assign, (paths, 0)),
+        ("assign", "1 mismatch", bench_assign, (paths, 1)),
+        ("write", "plain", bench_write, (paths, None)),
+        ("write", "gzip", bench_write, (paths, "gzip")),
+        ("pipeline", "default", bench_pipeline, (paths, {})),
+        ("pipeline", "passthrough", bench_pipeline,
+         (paths, {"passthrough": True})),
+        ]
+    if numpy is not None:
+        benchmarks.append(
+            ("pipeline", "read stats", bench_pipeline,
+             (paths, {"read_stats": True})))
+    results = []
+    for stage, variant, func, args in benchmarks:
+        best = None
+        for _ in range(repeats):
+            # A fresh process for each run gives a meaningful peak RSS
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                result = executor.submit(_run, func, args).result()
+            if best is None or result["seconds"] < best["seconds"]:
+                best = result
+        best["stage"] = stage
+        best["variant"] = variant
+        results.append(best)
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    """Return the benchmarks that are slower than the baseline."""
+    baseline_rates = dict(
+        ((r["stage"], r["variant"]), r["reads_per_sec"])
+        for r in baseline["results"])
+    regressions = []
+    for r in results:
+        base = baseline_rates.get((r["stage"], r["variant"]))
+        if base is not None and r["reads_per_sec"] < base * (1 - tolerance):
+            regressions.append((r["stage"], r["variant"], base,
+                                r["reads_per_sec"]))
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--reads", type=int, default=200000)
+    p.add_argument("--samples", type=int, default=96)
+    p.add_argument("--barcode-length", type=int, default=8)
+    p.add_argument("--read-length", type=int, default=150)
+    p.add_argument("--error-rate", type=float, default=0.01)
+    p.add_argument(
+        "--no-index-reads", action="store_true",
+        help="Put barcodes in the description lines instead of I1")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument(
+        "--output", type=argparse.FileType("w"), default=sys.stdout,
+        help="Results file (JSON format)")
+    p.add_argument(
+        "--compare", type=argparse.FileType("r"),
+        help="Previous results file to check for regressions")
+    p.add_argument(
+        "--tolerance", type=float, default=0.15,
+        help="Allowed fractional slowdown relative to --compare")
+    args = p.parse_args(argv)
+
+    params = {
+        "n_reads": args.reads,
+        "n_samples": args.samples,
+        "barcode_length": args.barcode_length,
+        "read_length": args.read_length,
+        "error_rate": args.error_rate,
+        "index_reads": not args.no_index_reads,
+        "seed": args.seed,
+        }
+    data_dir = tempfile.mkdtemp()
+    try:
+        paths = write_dataset(data_dir, **params)
+        results = run_benchmarks(paths, args.repeats)
+    finally:
+        shutil.rmtree(data_dir)
+
+    report = {
+        "program": "dnabc-benchmarks",
+        "version": __version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params,
+        "results": results,
+        }
+    json.dump(report, args.output, indent=2)
+    args.output.write("\n")
+
+    if args.compare is not None:
+        regressions = compare_results(
+            results, json.load(args.compare), args.tolerance)
+        for stage, variant, base, rate in regressions:
+            sys.stderr.write(
+                "Regression in %s (%s): %.0f -> %.0f reads/sec\n" % (
+                    stage, variant, base, rate))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
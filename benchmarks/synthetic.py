@@ -0,0 +1,127 @@
+"""Synthetic paired-end FASTQ data for benchmarks.
+
+Datasets are fully determined by their parameters and random seed, so
+benchmark runs on different machines or versions see the same reads.
+"""
+import gzip
+import os
+import random
+
+from dnabclib.assigner import error_barcodes, reverse_complement
+
+BASES = "ACGT"
+
+# Quality characters used for generated reads
+QUALITIES = "#+5<?ABCDEFGHI"
+
+
+def make_barcodes(n, length, rng, min_distance=3):
+    """Random barcodes that are at least min_distance apart."""
+    # Every sequence closer than min_distance to an accepted barcode
+    too_close = set()
+    barcodes = []
+    attempts = 0
+    while len(barcodes) < n:
+        attempts += 1
+        if attempts > 1000 * n:
+            raise ValueError(
+                "Could not find %s barcodes of length %s at distance %s" % (
+                    n, length, min_distance))
+        bc = "".join(rng.choice(BASES) for _ in range(length))
+        if bc not in too_close:
+            barcodes.append(bc)
+            too_close.add(bc)
+            too_close.update(error_barcodes(bc, min_distance - 1))
+    return barcodes
+
+
+class ReadGenerator(object):
+    def __init__(self, read_length, seed):
+        self.rng = random.Random(seed)
+        self.read_length = read_length
+        # Reads are cut from a pool of random sequence, which is much
+        # faster than drawing every base separately
+        pool_size = 1 << 16
+        self._seqs = "".join(self.rng.choice(BASES) for _ in range(pool_size))
+        self._quals = "".join(
+            self.rng.choice(QUALITIES) for _ in range(pool_size))
+
+    def _cut(self, pool, length):
+        start = self.rng.randrange(len(pool) - length)
+        return pool[start:start + length]
+
+    def seq(self):
+        return self._cut(self._seqs, self.read_length)
+
+    def qual(self, length=None):
+        return self._cut(self._quals, length or self.read_length)
+
+    def add_errors(self, seq, error_rate):
+        if not error_rate:
+            return seq
+        bases = list(seq)
+        for i, base in enumerate(bases):
+            if self.rng.random() < error_rate:
+                bases[i] = self.rng.choice(
+                    [b for b in BASES + "N" if b != base])
+        return "".join(bases)
+
+
+def write_dataset(output_dir, n_reads=100000, n_samples=96,
+                  barcode_length=8, read_length=150, error_rate=0.01,
+                  unassigned_fraction=0.05, index_reads=True,
+                  compress=False, seed=0):
+    """Write a synthetic dataset and barcode file to output_dir.
+
+    With index_reads, barcodes are written to a separate index file as
+    the reverse complement, as on the MiSeq.  Otherwise, barcodes are
+    placed at the end of the description lines.  Each index base is
+    replaced by a different base (or N) with probability error_rate.
+    Returns a dict of file paths.
+    """
+    rng = random.Random(seed)
+    barcodes = make_barcodes(n_samples, barcode_length, rng)
+    gen = ReadGenerator(read_length, seed + 1)
+
+    ext = ".fastq.gz" if compress else ".fastq"
+    opener = gzip.open if compress else open
+    paths = {
+        "forward": os.path.join(output_dir, "R1" + ext),
+        "reverse": os.path.join(output_dir, "R2" + ext),
+        "barcodes": os.path.join(output_dir, "barcodes.txt"),
+        }
+    if index_reads:
+        paths["index"] = os.path.join(output_dir, "I1" + ext)
+
+    with open(paths["barcodes"], "w") as f:
+        for n, bc in enumerate(barcodes):
+            f.write("Sample%s\t%s\n" % (n + 1, bc))
+
+    files = dict(
+        (key, opener(paths[key], "wt"))
+        for key in ["forward", "reverse", "index"] if key in paths)
+    try:
+        for n in range(n_reads):
+            if rng.random() < unassigned_fraction:
+                bc = "".join(rng.choice(BASES) for _ in range(barcode_length))
+            else:
+                bc = rng.choice(barcodes)
+            if index_reads:
+                bc = reverse_complement(bc)
+            bc = gen.add_errors(bc, error_rate)
+
+            desc = "SYN:1:FC:1:1101:%s:%s" % (n // 1000, n % 1000)
+            if index_reads:
+                files["index"].write("@%s 1:N:0:1\n%s\n+\n%s\n" % (
+                    desc, bc, gen.qual(barcode_length)))
+                tag = "1"
+            else:
+                tag = bc
+            files["forward"].write("@%s 1:N:0:%s\n%s\n+\n%s\n" % (
+                desc, tag, gen.seq(), gen.qual()))
+            files["reverse"].write("@%s 2:N:0:%s\n%s\n+\n%s\n" % (
+                desc, tag, gen.seq(), gen.qual()))
+    finally:
+        for f in files.values():
+            f.close()
+    return paths
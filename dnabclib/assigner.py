@@ -1,72 +1,381 @@
 import itertools
+import os
+
+from .heavyhitters import SpaceSaving
+from .tablecache import (
+    BarcodeTable, cache_fp, cache_key, load_table, save_table,
+    )
+from .twobit import numpy
+
+
+# Largest number of entries allowed in the barcode lookup table.  Each
+# entry costs roughly 100-150 bytes, so the default is about 2-3 GB.
+MAX_TABLE_SIZE = 20000000
 
 
 class BarcodeAssigner(object):
-    def __init__(self, samples, mismatches=0, revcomp=True):
+    """Assign reads to samples by barcode sequence.
+
+    If unassigned_capacity is given, the most frequent barcode sequences
+    among unassigned reads are tracked in a Space-Saving summary of that
+    size.
+
+    If table_cache_dir is given, lookup tables are saved there and
+    loaded instead of being built again for the same barcodes.
+    """
+    def __init__(self, samples, mismatches=0, revcomp=True,
+                 max_table_size=MAX_TABLE_SIZE, unassigned_capacity=0,
+                 table_cache_dir=None):
         self.samples = samples
-        if mismatches not in [0]:
-            raise ValueError(
-                "Only 0 mismatches allowed (got %s)" % mismatches)
+        self._check_mismatches(mismatches)
         self.mismatches = mismatches
         self.revcomp = revcomp
+        self.max_table_size = max_table_size
+        self.table_cache_dir = table_cache_dir
         # Sample names assumed to be unique after validating input data
         self.read_counts = dict((s.name, 0) for s in self.samples)
         self.read_counts['unassigned'] = 0
+        self.unassigned_capacity = unassigned_capacity
+        self.unassigned_barcodes = self._new_unassigned_barcodes()
         self._init_hash()
 
+    @staticmethod
+    def _check_mismatches(mismatches):
+        check_mismatches(mismatches)
+
+    def _new_unassigned_barcodes(self):
+        if self.unassigned_capacity:
+            return SpaceSaving(self.unassigned_capacity)
+        return None
+
     def _init_hash(self):
-        self._barcodes = {}
+        items = []
         for s in self.samples:
             # Barcodes assumed to be present after validating input data
             if self.revcomp:
                 bc = reverse_complement(s.barcode)
             else:
                 bc = s.barcode
-
-            # Barcodes assumed to be unique after validating input data
-            self._barcodes[bc] = s
-
-            for error_bc in self._error_barcodes(bc):
-                # Barcodes not guaranteed to be unique after
-                # accounting for errors
-                if error_bc in self._barcodes:
-                    raise ValueError(
-                        "Barcode %s for sample %s matches barcode for "
-                        "sample %s with %s mismatches" % (
-                            error_bc, self._barcodes[error_bc], s,
-                            self.mismatches))
-                else:
-                    self._barcodes[error_bc] = s
+            items.append((bc, s, "sample %s" % s.name))
+        self._barcodes = build_barcode_table(
+            items, self.mismatches, self.max_table_size,
+            self.table_cache_dir)
+        # Built on the first call to assign_batch()
+        self._encoded = None
+        self._sample_array = None
 
     def _error_barcodes(self, barcode):
-        # If the number of mismatches is set to 0, there will be no
-        # error barcodes. Immediately stop the iteration.
-        if self.mismatches == 0:
-            raise StopIteration
-        # Each item in idx_sets is a set of indices where mismatches
-        # should occur.
-        idx_sets = itertools.combinations(range(len(barcode)), self.mismatches)
-        for idx_set in idx_sets:
-            # Change to list because strings are immutable
-            bc = list(barcode)
-            # Replace the base at each mismatch position with an
-            # ambiguous base specifying all possibilities BUT the one
-            # we see.
-            for idx in idx_set:
-                bc[idx] = AMBIGUOUS_BASES_COMPLEMENT[bc[idx]]
-            # Expand to all possibilities for mismatching at this
-            # particular set of positions
-            for error_bc in deambiguate(bc):
-                yield error_bc
-        
+        return error_barcodes(barcode, self.mismatches)
+
+    def assign(self, seq):
+        sample = self._barcodes[seq]
+        if sample is not None:
+            self.read_counts[sample.name] += 1
+        else:
+            self.read_counts['unassigned'] += 1
+            if self.unassigned_barcodes is not None:
+                self.unassigned_barcodes.add(seq)
+        return sample
+
+    def assign_batch(self, seqs):
+        """Assign a list of barcode sequences, returning their samples.
+
+        With NumPy, the sequences are looked up all at once and the
+        read counts are updated with one bincount, so there is little
+        work per read in Python.  Without NumPy, each sequence is
+        assigned in turn.
+        """
+        if numpy is None:
+            return [self.assign(seq) for seq in seqs]
+        idxs = self.assign_indexes(seqs)
+        if self._sample_array is None:
+            self._sample_array = _object_array(list(self.samples) + [None])
+        return self._sample_array[idxs].tolist()
+
+    def assign_indexes(self, seqs):
+        """Assign a list of barcode sequences, returning an array with
+        the position of each sample in self.samples.
+
+        Unassigned sequences get len(self.samples).  Needs NumPy.
+        """
+        if self._encoded is None:
+            self._encoded = self._barcodes.encoded(self.samples)
+        idxs = self._encoded.lookup(seqs)
+        self._add_batch_counts(seqs, idxs)
+        return idxs
+
+    def _add_batch_counts(self, seqs, idxs):
+        n = len(self.samples)
+        counts = numpy.bincount(idxs, minlength=n + 1)
+        for s, count in zip(self.samples, counts.tolist()):
+            self.read_counts[s.name] += count
+        self.read_counts['unassigned'] += int(counts[n])
+        if self.unassigned_barcodes is not None and counts[n]:
+            for i in numpy.flatnonzero(idxs == n).tolist():
+                self.unassigned_barcodes.add(seqs[i])
+
+    def top_unassigned(self, n):
+        """Most frequent unassigned barcodes, for the summary file."""
+        if self.unassigned_barcodes is None:
+            return []
+        return [
+            {"barcode": bc, "count": count, "max_error": error}
+            for bc, count, error in self.unassigned_barcodes.top(n)]
+
+    def reset_counts(self):
+        """Set all counts to zero, returning the previous counts."""
+        counts = {
+            "read_counts": self.read_counts,
+            "unassigned_barcodes": self.unassigned_barcodes,
+            }
+        self.read_counts = dict.fromkeys(self.read_counts, 0)
+        self.unassigned_barcodes = self._new_unassigned_barcodes()
+        return counts
+
+    def add_counts(self, counts):
+        """Add counts returned by reset_counts() of another assigner."""
+        for name, n in counts["read_counts"].items():
+            self.read_counts[name] += n
+        if self.unassigned_barcodes is not None:
+            self.unassigned_barcodes.merge(counts["unassigned_barcodes"])
+
+    def get_state(self):
+        """Counts in a form that can be saved as JSON."""
+        state = {"read_counts": dict(self.read_counts)}
+        if self.unassigned_barcodes is not None:
+            state["unassigned_barcodes"] = self.unassigned_barcodes.top()
+        return state
+
+    def set_state(self, state):
+        """Restore counts saved by get_state()."""
+        if set(state["read_counts"]) != set(self.read_counts):
+            raise ValueError(
+                "Saved counts are for different samples: %s" %
+                sorted(state["read_counts"]))
+        self.read_counts = dict(state["read_counts"])
+        if self.unassigned_barcodes is not None:
+            self.unassigned_barcodes = SpaceSaving.from_top(
+                self.unassigned_capacity,
+                state.get("unassigned_barcodes", []))
+
+
+class DualBarcodeAssigner(BarcodeAssigner):
+    """Assign reads using separate i7 and i5 index sequences.
+
+    The barcode sequence of each read is the i7 index followed by the
+    i5 index.  Each index is looked up in its own table, with its own
+    number of allowed mismatches, and the pair of matching indexes
+    gives the sample.  Reads where both indexes are valid, but do not
+    belong to the same sample, are counted as index hopping.
+
+    The number of mismatches and whether to reverse complement may be
+    given for each index as a pair.
+    """
+    def __init__(self, samples, mismatches=0, revcomp=True,
+                 max_table_size=MAX_TABLE_SIZE, unassigned_capacity=0,
+                 table_cache_dir=None):
+        # A single number of mismatches applies to both indexes
+        if isinstance(mismatches, int):
+            mismatches = (mismatches, mismatches)
+        if isinstance(revcomp, bool):
+            revcomp = (revcomp, revcomp)
+        self.index_hopping = {}
+        super(DualBarcodeAssigner, self).__init__(
+            samples, tuple(mismatches), tuple(revcomp), max_table_size,
+            unassigned_capacity, table_cache_dir)
+
+    @staticmethod
+    def _check_mismatches(mismatches):
+        for m in mismatches:
+            check_mismatches(m)
+
+    def _init_hash(self):
+        i7s = set()
+        i5s = set()
+        self._barcodes = {}
+        for s in self.samples:
+            # Both indexes assumed to be present after validating input
+            bc1 = s.barcode
+            bc2 = s.barcode2
+            if self.revcomp[0]:
+                bc1 = reverse_complement(bc1)
+            if self.revcomp[1]:
+                bc2 = reverse_complement(bc2)
+            i7s.add(bc1)
+            i5s.add(bc2)
+            self._barcodes[(bc1, bc2)] = s
+
+        i7_lengths = set(len(bc) for bc in i7s)
+        if len(i7_lengths) > 1:
+            raise ValueError(
+                "All i7 indexes must have the same length (got %s)" %
+                sorted(i7_lengths))
+        self._i7_len = i7_lengths.pop() if i7_lengths else 0
+
+        m7, m5 = self.mismatches
+        self._i7_barcodes = build_barcode_table(
+            [(bc, bc, "i7 index %s" % bc) for bc in sorted(i7s)],
+            m7, self.max_table_size, self.table_cache_dir)
+        self._i5_barcodes = build_barcode_table(
+            [(bc, bc, "i5 index %s" % bc) for bc in sorted(i5s)],
+            m5, self.max_table_size, self.table_cache_dir)
+        self._i7_list = sorted(i7s)
+        self._i5_list = sorted(i5s)
+        self._encoded = None
+        self._sample_array = None
+
     def assign(self, seq):
-        sample = self._barcodes.get(seq)
+        i7 = self._i7_barcodes[seq[:self._i7_len]]
+        i5 = self._i5_barcodes[seq[self._i7_len:]]
+        sample = self._barcodes.get((i7, i5))
         if sample is not None:
             self.read_counts[sample.name] += 1
         else:
             self.read_counts['unassigned'] += 1
+            if self.unassigned_barcodes is not None:
+                self.unassigned_barcodes.add(seq)
+            if i7 is not None and i5 is not None:
+                pair = "%s+%s" % (i7, i5)
+                self.index_hopping[pair] = (
+                    self.index_hopping.get(pair, 0) + 1)
         return sample
 
+    def assign_indexes(self, seqs):
+        n7 = len(self._i7_list)
+        n5 = len(self._i5_list)
+        if self._encoded is None:
+            self._encoded = (
+                self._i7_barcodes.encoded(self._i7_list),
+                self._i5_barcodes.encoded(self._i5_list))
+            # Sample index for each pair of i7 and i5 indexes, with
+            # one more row and column for a missing index
+            n = len(self.samples)
+            self._pair_samples = numpy.full((n7 + 1, n5 + 1), n, numpy.intp)
+            i7_index = dict((bc, k) for k, bc in enumerate(self._i7_list))
+            i5_index = dict((bc, k) for k, bc in enumerate(self._i5_list))
+            sample_index = dict(
+                (id(s), k) for k, s in enumerate(self.samples))
+            for (i7, i5), s in self._barcodes.items():
+                self._pair_samples[i7_index[i7], i5_index[i5]] = (
+                    sample_index[id(s)])
+        i7_encoded, i5_encoded = self._encoded
+        i7s = i7_encoded.lookup([seq[:self._i7_len] for seq in seqs])
+        i5s = i5_encoded.lookup([seq[self._i7_len:] for seq in seqs])
+        idxs = self._pair_samples[i7s, i5s]
+        self._add_batch_counts(seqs, idxs)
+        hopped = (idxs == len(self.samples)) & (i7s < n7) & (i5s < n5)
+        for i in numpy.flatnonzero(hopped).tolist():
+            pair = "%s+%s" % (self._i7_list[i7s[i]], self._i5_list[i5s[i]])
+            self.index_hopping[pair] = self.index_hopping.get(pair, 0) + 1
+        return idxs
+
+    def reset_counts(self):
+        counts = super(DualBarcodeAssigner, self).reset_counts()
+        counts["index_hopping"] = self.index_hopping
+        self.index_hopping = {}
+        return counts
+
+    def add_counts(self, counts):
+        super(DualBarcodeAssigner, self).add_counts(counts)
+        for pair, n in counts["index_hopping"].items():
+            self.index_hopping[pair] = self.index_hopping.get(pair, 0) + n
+
+    def get_state(self):
+        state = super(DualBarcodeAssigner, self).get_state()
+        state["index_hopping"] = dict(self.index_hopping)
+        return state
+
+    def set_state(self, state):
+        super(DualBarcodeAssigner, self).set_state(state)
+        self.index_hopping = dict(state["index_hopping"])
+
+
+def _object_array(values):
+    a = numpy.empty(len(values), dtype=object)
+    for k, v in enumerate(values):
+        a[k] = v
+    return a
+
+
+def check_mismatches(mismatches):
+    if mismatches not in [0, 1, 2]:
+        raise ValueError(
+            "Only 0, 1, or 2 mismatches allowed (got %s)" % mismatches)
+
+
+def build_barcode_table(items, mismatches, max_table_size=MAX_TABLE_SIZE,
+                        cache_dir=None):
+    """Build a lookup table of barcodes and their error barcodes.
+
+    Items are (barcode, value, label) tuples.  Every sequence within
+    the given number of mismatches of a barcode is mapped to its value.
+    A sequence that can be reached from two barcodes is an error.
+
+    If cache_dir is given, a table saved there for the same barcodes,
+    labels and mismatches is loaded instead, and a newly built table
+    is saved.  Tables are only cached if NumPy is installed.
+    """
+    table_size = sum(
+        neighborhood_size(len(bc), mismatches) for bc, _, _ in items)
+    if table_size > max_table_size:
+        raise ValueError(
+            "Barcode lookup table with %s mismatches would have %s "
+            "entries (limit %s)" % (mismatches, table_size, max_table_size))
+
+    if numpy is None:
+        cache_dir = None
+    if cache_dir is not None:
+        key = cache_key(items, mismatches)
+        fp = cache_fp(cache_dir, key)
+        table = load_table(fp, key, items)
+        if table is not None:
+            return table
+
+    table = _build_table(items, mismatches)
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        save_table(fp, key, table, items)
+    return table
+
+
+def _build_table(items, mismatches):
+    table = BarcodeTable()
+    labels = {}
+    for bc, value, label in items:
+        labels[value] = label
+        # Barcodes are unique after validating input data, but may
+        # match another barcode with errors
+        for error_bc in itertools.chain([bc], error_barcodes(bc, mismatches)):
+            other = table.setdefault(error_bc, value)
+            if other is not value:
+                raise ValueError(
+                    "Barcode %s for %s matches barcode for %s with %s "
+                    "mismatches" % (
+                        error_bc, labels[other], label, mismatches))
+    return table
+
+
+def error_barcodes(barcode, mismatches):
+    """Generate all sequences with 1 up to the given number of mismatches.
+
+    Each sequence is produced exactly once: at each step, substitutions
+    are made only to the right of the previous one.  If the number of
+    mismatches is 0, there are no error barcodes.
+    """
+    frontier = [(barcode, 0)]
+    for _ in range(mismatches):
+        next_frontier = []
+        for bc, start in frontier:
+            for idx in range(start, len(bc)):
+                prefix = bc[:idx]
+                suffix = bc[idx + 1:]
+                for base in MISMATCH_BASES[barcode[idx]]:
+                    error_bc = prefix + base + suffix
+                    next_frontier.append((error_bc, idx + 1))
+                    yield error_bc
+        frontier = next_frontier
+
 
 AMBIGUOUS_BASES = {
     "T": "T",
@@ -87,13 +396,24 @@ AMBIGUOUS_BASES = {
     }
 
 
-# Ambiguous base codes for all bases EXCEPT the key
-AMBIGUOUS_BASES_COMPLEMENT = {
-    "T": "V",
-    "C": "D",
-    "A": "B",
-    "G": "H",
-    }
+# Bases that count as a mismatch for each base
+MISMATCH_BASES = dict(
+    (b, "".join(x for x in "ACGT" if x != b)) for b in "ACGTN")
+
+
+def neighborhood_size(length, mismatches):
+    """Number of sequences within a given number of mismatches."""
+    return sum(
+        comb(length, k) * 3 ** k for k in range(mismatches + 1))
+
+
+def comb(n, k):
+    if k > n:
+        return 0
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
 
 
 def deambiguate(seq):
@@ -0,0 +1,177 @@
+"""Demultiplex every lane of a run from one Illumina sample sheet.
+
+The sample sheet is read once, and the lanes are demultiplexed
+concurrently by a pool of worker processes.  Each lane is written to
+its own output directory, and one summary covers all the lanes.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+
+from .assigner import BarcodeAssigner, DualBarcodeAssigner
+from .orientation import choose_orientation
+from .main import (
+    assigner_summary, barcode_error, get_config, get_writer_cls,
+    input_options, make_assigner, make_writer, save_summary,
+    )
+from .sample import load_sample_sheet
+from .seqfile import IndexFastqSequenceFile, NoIndexFastqSequenceFile
+
+
+def find_lane_files(input_dir, lane):
+    """Find the R1, R2 and (optional) I1 files for a lane.
+
+    Files are found by the lane and read parts of the bcl2fastq file
+    names, e.g. Undetermined_S0_L001_R1_001.fastq.gz.
+    """
+    fps = []
+    for read in ["R1", "R2", "I1"]:
+        pattern = os.path.join(
+            input_dir, "*_L%03d_%s_*.fastq*" % (int(lane), read))
+        matches = sorted(glob.glob(pattern))
+        if len(matches) > 1:
+            raise ValueError(
+                "More than one %s file for lane %s: %s" % (
+                    read, lane, matches))
+        if not matches:
+            if read == "I1":
+                fps.append(None)
+                continue
+            raise ValueError("No %s file for lane %s" % (read, lane))
+        fps.append(matches[0])
+    return fps
+
+
+def run_lane(lane, samples, fps, output_dir, config):
+    """Demultiplex one lane, returning the read counts and summary."""
+    fwd_fp, rev_fp, idx_fp = fps
+    writer_cls, parser = get_writer_cls(config)
+    if samples[0].is_dual_indexed:
+        assigner_cls = DualBarcodeAssigner
+    else:
+        assigner_cls = BarcodeAssigner
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    writer = make_writer(writer_cls, output_dir, config)
+
+    with open(fwd_fp, "rb") as fwd, open(rev_fp, "rb") as rev:
+        if idx_fp is None:
+            revcomp, orientation = choose_orientation(
+                config, samples, fwd, True, False)
+            seq_file = NoIndexFastqSequenceFile(
+                fwd, rev, parser=parser, **input_options(config))
+            assigner = lane_assigner(
+                lane, assigner_cls, samples, config, revcomp)
+            data = seq_file.demultiplex(assigner, writer)
+        else:
+            with open(idx_fp, "rb") as idx:
+                revcomp, orientation = choose_orientation(
+                    config, samples, idx, False, True)
+                seq_file = IndexFastqSequenceFile(
+                    fwd, rev, idx, parser=parser, **input_options(config))
+                assigner = lane_assigner(
+                    lane, assigner_cls, samples, config, revcomp)
+                data = seq_file.demultiplex(assigner, writer)
+    writer.close()
+
+    extra = assigner_summary(assigner, config)
+    extra["barcode_orientation"] = orientation
+    extra["flush_stats"] = writer.flush_stats
+    extra["handle_stats"] = writer.handle_stats
+    if writer.read_stats is not None:
+        extra["read_stats"] = writer.read_stats_summary()
+    extra["input_files"] = fps
+    return lane, data, extra
+
+
+def lane_assigner(lane, assigner_cls, samples, config, revcomp):
+    """Make the assigner for a lane, naming the lane in any error."""
+    try:
+        return make_assigner(assigner_cls, samples, config, revcomp)
+    except ValueError as e:
+        raise ValueError("Lane %s: %s" % (lane, barcode_error(e)))
+
+
+def _run_lane(task):
+    return run_lane(*task)
+
+
+def demultiplex_lanes(lanes, input_dir, output_dir, config, processes=None):
+    """Demultiplex all lanes, with at most processes lanes at once.
+
+    Lanes is a dict of sample lists, keyed by lane.  Returns dicts of
+    read counts and of other summary data, both keyed by lane.
+    """
+    tasks = [
+        (lane, samples, find_lane_files(input_dir, lane),
+         os.path.join(output_dir, "L%03d" % int(lane)), config)
+        for lane, samples in lanes.items()]
+    if processes is None:
+        processes = min(len(tasks), multiprocessing.cpu_count())
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_lane, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_run_lane(task) for task in tasks]
+
+    data = {}
+    lane_summaries = {}
+    for lane, lane_data, extra in results:
+        data[lane] = lane_data
+        lane_summaries[lane] = extra
+    return data, lane_summaries
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Demultiplex all lanes in an Illumina sample sheet")
+    p.add_argument(
+        "--sample-sheet", required=True,
+        type=argparse.FileType("r"),
+        help="Illumina sample sheet (CSV format)")
+    p.add_argument(
+        "--input-dir", required=True,
+        help=(
+            "Directory of FASTQ files for each lane, named as by bcl2fastq "
+            "(e.g. Undetermined_S0_L001_R1_001.fastq.gz)"))
+    p.add_argument(
+        "--output-dir", required=True,
+        help="Output directory, with one subdirectory per lane")
+    p.add_argument(
+        "--summary-file", required=True,
+        type=argparse.FileType("w"),
+        help="Summary filepath")
+    p.add_argument(
+        "--lanes", nargs="+",
+        help="Only demultiplex these lanes")
+    p.add_argument("--config-file",
+        type=argparse.FileType("r"),
+        help="Configuration file (JSON format)")
+    args = p.parse_args(argv)
+
+    config = get_config(args.config_file)
+    try:
+        get_writer_cls(config)
+        lanes = load_sample_sheet(args.sample_sheet)
+    except ValueError as e:
+        p.error(str(e))
+    if args.lanes:
+        missing = [lane for lane in args.lanes if lane not in lanes]
+        if missing:
+            p.error("Lanes not in sample sheet: %s" % ", ".join(missing))
+        lanes = dict((lane, lanes[lane]) for lane in args.lanes)
+    if not lanes:
+        p.error("No samples found in sample sheet")
+
+    try:
+        data, lane_summaries = demultiplex_lanes(
+            lanes, args.input_dir, args.output_dir, config,
+            config["lane_processes"])
+    except ValueError as e:
+        p.error(str(e))
+    save_summary(args.summary_file, config, data, lanes=lane_summaries)
@@ -0,0 +1,80 @@
+"""Checkpoints for resuming an interrupted demultiplexing run.
+
+A checkpoint records the number of reads processed, the read counts
+of the assigner, and the size of every output file at that point, with
+the read statistics of the writer if it keeps them.  To resume, the
+output files are truncated back to those sizes, the counts are
+restored, and the reads already processed are skipped.
+"""
+import itertools
+import json
+import os
+
+# Number of reads between checkpoints
+CHECKPOINT_READS = 1000000
+
+CHECKPOINT_FILENAME = ".dnabc_checkpoint.json"
+
+
+class Checkpointer(object):
+    """Saves a checkpoint every interval reads.
+
+    Reads are counted from start_reads, the number of reads processed
+    before the run was resumed.
+    """
+    def __init__(self, fp, interval=CHECKPOINT_READS, start_reads=0):
+        self.fp = fp
+        self.interval = interval
+        self.start_reads = start_reads
+        self._next = start_reads + interval
+
+    def update(self, reads, assigner, writer):
+        reads += self.start_reads
+        if reads >= self._next:
+            self.save(reads, assigner, writer)
+            self._next = reads + self.interval
+
+    def save(self, reads, assigner, writer):
+        state = {
+            "reads": reads,
+            "counts": assigner.get_state(),
+            "output_sizes": writer.checkpoint(),
+            }
+        if writer.read_stats is not None:
+            state["read_stats"] = writer.read_stats_summary()
+        # Replace the old checkpoint only once the new one is complete
+        tmp_fp = self.fp + ".tmp"
+        with open(tmp_fp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, self.fp)
+
+    def remove(self):
+        if os.path.exists(self.fp):
+            os.remove(self.fp)
+
+
+def load_checkpoint(fp):
+    """Load a saved checkpoint, or return None if there is none."""
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as f:
+        return json.load(f)
+
+
+def restore_checkpoint(state, assigner, writer):
+    """Restore counts and truncate output files to a checkpoint."""
+    assigner.set_state(state["counts"])
+    writer.restore(state["output_sizes"], assigner.samples)
+    if writer.read_stats is not None:
+        writer.restore_read_stats(state.get("read_stats", {}))
+
+
+def skip_records(f, n):
+    """Skip the first n records of a FASTQ file."""
+    n_lines = 4 * n
+    skipped = sum(1 for _ in itertools.islice(f, n_lines))
+    if skipped < n_lines:
+        raise ValueError(
+            "Input file has fewer records than the checkpoint (%s)" % n)
@@ -0,0 +1,157 @@
+"""Pairwise Hamming distances between the barcodes of a sample sheet.
+
+With a given number of mismatches, two barcodes collide in the lookup
+table if they are at most twice that many bases apart.  For large
+sample sheets, all pairs are compared in blocks with NumPy: barcodes
+of A, C, G and T are packed into 64-bit integers, and the distance of
+two barcodes is a popcount of their XOR.  Without NumPy, pairs are
+compared one at a time.
+"""
+import itertools
+
+from .assigner import check_mismatches
+from .twobit import MAX_LENGTH, encode, numpy
+
+# Largest number of distances computed at once for a block of barcodes
+BLOCK_ELEMENTS = 1 << 22
+
+# Largest number of mismatches supported by the assigners
+MAX_MISMATCHES = 2
+
+if numpy is not None:
+    # Low bit of each 2-bit base
+    _LOW_BITS = numpy.uint64(0x5555555555555555)
+    _POPCOUNT = numpy.array(
+        [bin(n).count("1") for n in range(256)], dtype=numpy.uint8)
+
+
+def close_pairs(barcodes, max_distance):
+    """Find the pairs of barcodes at most max_distance apart.
+
+    Barcodes must all have the same length.  Returns the smallest
+    distance between two barcodes (None if there are less than two),
+    and a list of (i, j, distance) tuples with i < j.
+    """
+    if len(set(len(bc) for bc in barcodes)) > 1:
+        raise ValueError("Barcodes must all have the same length")
+    if len(barcodes) < 2:
+        return None, []
+    if numpy is None:
+        return _close_pairs_python(barcodes, max_distance)
+    if len(barcodes[0]) <= MAX_LENGTH:
+        keys = encode(barcodes)
+        if keys.all():
+            return _close_pairs_blocks(keys, max_distance, _packed_distances)
+    codes = numpy.frombuffer(
+        "".join(barcodes).encode("ascii", "replace"), dtype=numpy.uint8)
+    codes = codes.reshape(len(barcodes), -1)
+    return _close_pairs_blocks(codes, max_distance, _base_distances)
+
+
+def _close_pairs_python(barcodes, max_distance):
+    min_distance = None
+    pairs = []
+    for (i, bc1), (j, bc2) in itertools.combinations(enumerate(barcodes), 2):
+        d = sum(1 for a, b in zip(bc1, bc2) if a != b)
+        if min_distance is None or d < min_distance:
+            min_distance = d
+        if d <= max_distance:
+            pairs.append((i, j, d))
+    return min_distance, pairs
+
+
+def _close_pairs_blocks(data, max_distance, distances):
+    # Each block of rows is compared with every later row
+    n = len(data)
+    min_distance = None
+    pairs = []
+    start = 0
+    while start < n - 1:
+        rows = max(1, min(n - 1 - start, BLOCK_ELEMENTS // (n - start)))
+        d = distances(data[start:start + rows], data[start:])
+        # Only compare each row with the rows after it
+        later = (
+            numpy.arange(n - start)[None, :] >
+            numpy.arange(rows)[:, None])
+        d = numpy.where(later, d, 255)
+        block_min = int(d.min())
+        if min_distance is None or block_min < min_distance:
+            min_distance = block_min
+        for i, j in zip(*numpy.nonzero(d <= max_distance)):
+            pairs.append((start + int(i), start + int(j), int(d[i, j])))
+        start += rows
+    return min_distance, pairs
+
+
+def _packed_distances(keys1, keys2):
+    x = keys1[:, None] ^ keys2[None, :]
+    # One bit for each base that differs
+    x = (x | (x >> numpy.uint64(1))) & _LOW_BITS
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(x)
+    counts = _POPCOUNT[x.view(numpy.uint8)]
+    return counts.reshape(x.shape + (8,)).sum(axis=2, dtype=numpy.uint8)
+
+
+def _base_distances(codes1, codes2):
+    d = numpy.zeros((len(codes1), len(codes2)), dtype=numpy.uint8)
+    for k in range(codes1.shape[1]):
+        d += codes1[:, k, None] != codes2[None, :, k]
+    return d
+
+
+def safe_mismatches(min_distance):
+    """Largest number of mismatches that does not make barcodes collide."""
+    if min_distance is None:
+        return MAX_MISMATCHES
+    return max(0, min(MAX_MISMATCHES, (min_distance - 1) // 2))
+
+
+def analyze_barcodes(samples, mismatches=MAX_MISMATCHES):
+    """Check the barcodes of a list of samples for close pairs.
+
+    Each index of dual-indexed samples is checked on its own, as it is
+    looked up in its own table.  Barcodes of different lengths never
+    collide.  Returns a dict for each index, with the number of
+    distinct barcodes, the smallest distance between two of them, the
+    largest safe number of mismatches, and the pairs that would
+    collide with the given number of mismatches.
+    """
+    check_mismatches(mismatches)
+    if samples and samples[0].is_dual_indexed:
+        attrs = ["barcode", "barcode2"]
+    else:
+        attrs = ["barcode"]
+    results = []
+    for attr in attrs:
+        # Samples may share one index in a combinatorial design
+        by_barcode = {}
+        for s in samples:
+            by_barcode.setdefault(getattr(s, attr), []).append(s.name)
+        by_length = {}
+        for bc in sorted(by_barcode):
+            by_length.setdefault(len(bc), []).append(bc)
+
+        min_distance = None
+        conflicts = []
+        for barcodes in by_length.values():
+            d, pairs = close_pairs(barcodes, 2 * mismatches)
+            if d is not None and (min_distance is None or d < min_distance):
+                min_distance = d
+            for i, j, distance in pairs:
+                conflicts.append({
+                    "barcodes": [barcodes[i], barcodes[j]],
+                    "samples": [by_barcode[barcodes[i]],
+                                by_barcode[barcodes[j]]],
+                    "distance": distance,
+                    })
+        conflicts.sort(key=lambda x: (x["distance"], x["barcodes"]))
+        results.append({
+            "index": attr,
+            "barcodes": len(by_barcode),
+            "min_distance": min_distance,
+            "safe_mismatches": safe_mismatches(min_distance),
+            "mismatches": mismatches,
+            "conflicts": conflicts,
+            })
+    return results
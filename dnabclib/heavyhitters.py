@@ -0,0 +1,109 @@
+class SpaceSaving(object):
+    """Approximate counts of the most frequent items in a stream.
+
+    Implements the Space-Saving algorithm of Metwally et al. (2005).
+    At most `capacity` items are tracked.  When a new item arrives and
+    the summary is full, the item with the lowest count is replaced,
+    and the new item inherits that count as its possible error.  Any
+    item that occurs more than N / capacity times in a stream of N
+    items is guaranteed to be tracked.
+
+    Items are kept in buckets by count, so that every update takes
+    constant time.
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1 (got %s)" % capacity)
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._buckets = {}
+        self._min_count = 0
+
+    def add(self, item):
+        count = self.counts.get(item)
+        if count is not None:
+            self._move(item, count, count + 1)
+        elif len(self.counts) < self.capacity:
+            self.errors[item] = 0
+            self._insert(item, 1)
+            self._min_count = 1
+        else:
+            # Replace an item with the lowest count
+            min_count = self._min_count
+            bucket = self._buckets[min_count]
+            evicted = bucket.pop()
+            if not bucket:
+                del self._buckets[min_count]
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.errors[item] = min_count
+            self._insert(item, min_count + 1)
+            if min_count not in self._buckets:
+                self._min_count = min_count + 1
+
+    def _insert(self, item, count):
+        self.counts[item] = count
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            self._buckets[count] = set([item])
+        else:
+            bucket.add(item)
+
+    def _move(self, item, old_count, new_count):
+        bucket = self._buckets[old_count]
+        bucket.remove(item)
+        if not bucket:
+            del self._buckets[old_count]
+            if old_count == self._min_count:
+                self._min_count = new_count
+        self._insert(item, new_count)
+
+    def top(self, n=None):
+        """Most frequent items as (item, count, error) tuples.
+
+        The true count of each item is between count - error and count.
+        """
+        items = sorted(
+            self.counts.items(), key=lambda x: (-x[1], x[0]))[:n]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    @classmethod
+    def from_top(cls, capacity, top):
+        """Rebuild a summary from the output of top()."""
+        s = cls(capacity)
+        for item, count, error in top:
+            s.errors[item] = error
+            s._insert(item, count)
+        s._min_count = min(s._buckets) if s._buckets else 0
+        return s
+
+    def merge(self, other):
+        """Add the counts from another summary to this one.
+
+        An item missing from a full summary may have occurred up to that
+        summary's lowest count, which is added to the item's count and
+        error.  The items with the highest combined counts are kept.
+        """
+        min1 = self._full_min_count()
+        min2 = other._full_min_count()
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = (
+                self.counts.get(item, min1) + other.counts.get(item, min2))
+            errors[item] = (
+                self.errors.get(item, min1) + other.errors.get(item, min2))
+        kept = sorted(counts, key=lambda x: (-counts[x], x))[:self.capacity]
+        self.counts = {}
+        self.errors = {}
+        self._buckets = {}
+        for item in kept:
+            self.errors[item] = errors[item]
+            self._insert(item, counts[item])
+        self._min_count = min(self._buckets) if self._buckets else 0
+
+    def _full_min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return self._min_count
@@ -0,0 +1,85 @@
+"""Make an index reads file from the barcodes in FASTQ descriptions.
+
+Newer Illumina machines put the barcode of each read at the end of the
+description line, instead of in a separate index reads file.  This
+module writes those barcodes out as an index FASTQ file, reverse
+complemented to match the index reads of older machines.
+"""
+import argparse
+import concurrent.futures
+
+from .seqfile import fastq_line_blocks, fastq_descs, open_input
+from .writer import ParallelGzipFile
+
+# Complement of each base; spaces are removed
+INDEX_COMPLEMENT = str.maketrans("ACGTN", "TGCAN", " ")
+
+# Quality score given to every base of the index reads
+INDEX_QUALITY = "E"
+
+
+def reverse_complement_index(seq):
+    return seq.translate(INDEX_COMPLEMENT)[::-1]
+
+
+def format_index_reads(descs):
+    """Format index reads for a list of description lines."""
+    out = []
+    for desc in descs:
+        barcode = desc.rpartition(":")[2]
+        out.append("@%s\n%s\n+\n%s\n" % (
+            desc, reverse_complement_index(barcode),
+            INDEX_QUALITY * len(barcode)))
+    return "".join(out)
+
+
+def write_index(reads, out):
+    """Write an index read for each read in the input.
+
+    The input may be gzipped, and is read in large blocks.  Output for
+    a whole block is written in one call.  Returns the number of reads.
+    """
+    n = 0
+    for lines in fastq_line_blocks(open_input(reads)):
+        out.write(format_index_reads(fastq_descs(lines)))
+        n += len(lines) // 4
+    return n
+
+
+def open_output(fp, compression_level=6, threads=None):
+    """Open the output file, compressed if it ends with .gz."""
+    if fp.endswith(".gz"):
+        pool = concurrent.futures.ThreadPoolExecutor(threads)
+        return _PooledGzipFile(fp, pool, compression_level)
+    return open(fp, "w")
+
+
+class _PooledGzipFile(ParallelGzipFile):
+    # Shuts down its own compression pool when closed
+
+    def close(self):
+        super(_PooledGzipFile, self).close()
+        self._pool.shutdown()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="creates index file for de-multiplexing.")
+    p.add_argument(
+        "--reads", required=True,
+        type=argparse.FileType("rb"),
+        help="Raw fastq file (optionally gzipped)")
+    p.add_argument(
+        "--output", required=True,
+        help="output file (gzipped if the name ends with .gz)")
+    p.add_argument(
+        "--compression-level", type=int, default=6,
+        help="Level of gzip compression (default: %(default)s)")
+    args = p.parse_args(argv)
+
+    out = open_output(args.output, args.compression_level)
+    try:
+        write_index(args.reads, out)
+    finally:
+        out.close()
+        args.reads.close()
@@ -1,12 +1,24 @@
 import argparse
 import json
 import os
+import sys
+import time
 
-from .writer import FastaWriter, PairedFastqWriter
+from .writer import (
+    FastaWriter, PairedFastqWriter, PassthroughPairedFastqWriter,
+    )
 from .sample import Sample
 from .seqfile import IndexFastqSequenceFile
-from .seqfile import NoIndexFastqSequenceFile
-from .assigner import BarcodeAssigner
+from .seqfile import NoIndexFastqSequenceFile, open_shard
+from .seqfile import InlineBarcodeFastqSequenceFile
+from .assigner import BarcodeAssigner, DualBarcodeAssigner
+from .distance import analyze_barcodes
+from .checkpoint import (
+    CHECKPOINT_FILENAME, CHECKPOINT_READS, Checkpointer, load_checkpoint,
+    restore_checkpoint,
+    )
+from .orientation import choose_orientation
+from .profiling import ProgressReporter, StageProfiler
 from .version import __version__
 
 writers = {
@@ -14,6 +26,11 @@ writers = {
     "fasta": FastaWriter,
 }
 
+# Writers that copy the original bytes of each record
+passthrough_writers = {
+    "fastq": PassthroughPairedFastqWriter,
+}
+
 
 def get_sample_names_main(argv=None):
     p = argparse.ArgumentParser()
@@ -33,9 +50,73 @@ def get_sample_names_main(argv=None):
         args.output_file.write("%s\n" % s.name)
 
 
+def check_barcodes_main(argv=None):
+    p = argparse.ArgumentParser(
+        description=(
+            "Find pairs of barcodes that are too close to demultiplex with "
+            "a given number of mismatches"))
+    p.add_argument(
+        "--barcode-file", required=True,
+        type=argparse.FileType("r"),
+        help="Barcode information file")
+    p.add_argument(
+        "--mismatches", type=int, default=2,
+        help="Number of mismatches to check for (default: %(default)s)")
+    p.add_argument(
+        "--output-file",
+        type=argparse.FileType("w"), default=sys.stdout,
+        help="Output file for the report (default: standard output)")
+    args = p.parse_args(argv)
+
+    try:
+        samples = Sample.load(args.barcode_file)
+        results = analyze_barcodes(samples, args.mismatches)
+    except ValueError as e:
+        p.error(str(e))
+    out = args.output_file
+    for res in results:
+        out.write("Index: %s\n" % res["index"])
+        out.write("Distinct barcodes: %s\n" % res["barcodes"])
+        out.write("Minimum distance: %s\n" % res["min_distance"])
+        out.write("Largest safe mismatches: %s\n" % res["safe_mismatches"])
+        out.write("Pairs colliding with %s mismatches: %s\n" % (
+            res["mismatches"], len(res["conflicts"])))
+        for c in res["conflicts"]:
+            out.write("%s\t%s\t%s\t%s\t%s\n" % (
+                c["barcodes"][0], c["barcodes"][1], c["distance"],
+                ",".join(c["samples"][0]), ",".join(c["samples"][1])))
+
+
 def get_config(user_config_file):
     config = {
-        "output_format": "fastq"
+        "output_format": "fastq",
+        "fastq_parser": "block",
+        "output_compression": None,
+        "compression_level": 6,
+        "compression_threads": None,
+        "processes": 1,
+        "chunk_size": 10000,
+        "barcode_mismatches": 0,
+        "buffer_size": 65536,
+        "max_buffer_memory": 268435456,
+        "max_open_files": 512,
+        "write_unassigned": False,
+        "unassigned_capacity": 1000,
+        "unassigned_reported": 20,
+        "profile": False,
+        "progress_interval": None,
+        "passthrough": False,
+        "lane_processes": None,
+        "checkpoint_interval": None,
+        "pipeline": False,
+        "readahead_blocks": 4,
+        "write_threads": 2,
+        "write_queue_size": 8,
+        "barcode_orientation": "auto",
+        "orientation_scan_reads": 10000,
+        "orientation_min_match_rate": 0.1,
+        "table_cache_dir": None,
+        "read_stats": False,
     }
 
     if user_config_file is None:
@@ -54,64 +135,316 @@ def main(argv=None):
     # Input
     p.add_argument(
         "--forward-reads", required=True,
-        type=argparse.FileType("r"),
-        help="Forward reads file (FASTQ format)")
+        type=argparse.FileType("rb"),
+        help="Forward reads file (FASTQ format, optionally gzipped)")
     p.add_argument(
-        "--reverse-reads", required=True,
-        type=argparse.FileType("r"),
-        help="Reverse reads file (FASTQ format)")
+        "--reverse-reads",
+        type=argparse.FileType("rb"),
+        help=(
+            "Reverse reads file (FASTQ format, optionally gzipped). "
+            "Required unless --count-only is given."))
     p.add_argument(
         "--index-reads",
-        type=argparse.FileType("r"), help=(
-            "Index reads file (FASTQ format). If this file is not provided, "
-            "the index reads will be taken from the description lines in the "
-            "forward reads file."))
+        type=argparse.FileType("rb"), help=(
+            "Index reads file (FASTQ format, optionally gzipped). If this "
+            "file is not provided, the index reads will be taken from the "
+            "description lines in the forward reads file."))
+    p.add_argument(
+        "--inline-barcode-length", type=int, metavar="N",
+        help=(
+            "Take the barcode from the first N bases of each forward read, "
+            "and write the forward reads without them."))
     p.add_argument(
         "--barcode-file", required=True,
         help="Barcode information file",
         type=argparse.FileType("r"))
     # Output
     p.add_argument(
-        "--output-dir", required=True,
-        help="Output sequence data directory")
+        "--output-dir",
+        help=(
+            "Output sequence data directory. Required unless --count-only "
+            "is given."))
     p.add_argument(
         "--summary-file", required=True,
         type=argparse.FileType("w"),
         help="Summary filepath")
+    p.add_argument(
+        "--resume", action="store_true",
+        help=(
+            "Resume an interrupted run from the last checkpoint in the "
+            "output directory. Output files are truncated back to the "
+            "checkpoint."))
+    p.add_argument(
+        "--count-only", action="store_true",
+        help=(
+            "Only count the reads for each sample. Just the index reads "
+            "(or the description lines of the forward reads) are read, and "
+            "no sequence data is written."))
+    p.add_argument(
+        "--shard", type=shard_arg, metavar="K/N",
+        help=(
+            "Only demultiplex shard K of N (counting from 1). Input files "
+            "are split by byte range at record boundaries, and must be "
+            "uncompressed. Use dnabc_merge.py to combine the shards."))
     # Config
     p.add_argument("--config-file",
         type=argparse.FileType("r"),
         help="Configuration file (JSON format)")
     args = p.parse_args(argv)
+    if not args.count_only:
+        if args.reverse_reads is None:
+            p.error("--reverse-reads is required unless --count-only is given")
+        if args.output_dir is None:
+            p.error("--output-dir is required unless --count-only is given")
+    if args.inline_barcode_length is not None:
+        if args.index_reads is not None:
+            p.error("--inline-barcode-length can not be used with index reads")
+        if args.inline_barcode_length < 1:
+            p.error("--inline-barcode-length must be at least 1")
 
     config = get_config(args.config_file)
 
-    samples = list(Sample.load(args.barcode_file))
+    if args.shard is not None:
+        k, n = args.shard
+        try:
+            args.forward_reads, args.reverse_reads, args.index_reads = (
+                open_shard(
+                    [args.forward_reads, args.reverse_reads,
+                     args.index_reads], k - 1, n))
+        except ValueError as e:
+            p.error(str(e))
+
+    try:
+        samples = list(Sample.load(args.barcode_file))
+    except ValueError as e:
+        p.error(str(e))
+
+    if samples[0].is_dual_indexed:
+        assigner_cls = DualBarcodeAssigner
+    else:
+        assigner_cls = BarcodeAssigner
+
+    # Index reads are the reverse complement of the barcodes on older
+    # instruments, but description lines and inline barcodes are not
+    if args.index_reads is None:
+        default_revcomp = False
+        barcode_file = args.forward_reads
+    else:
+        default_revcomp = True
+        barcode_file = args.index_reads
+    from_description = (
+        args.index_reads is None and args.inline_barcode_length is None)
+    try:
+        revcomp, orientation = choose_orientation(
+            config, samples, barcode_file, from_description,
+            default_revcomp, args.inline_barcode_length)
+    except ValueError as e:
+        p.error(str(e))
 
-    writer_cls = writers[config["output_format"]]
+    try:
+        assigner = make_assigner(assigner_cls, samples, config, revcomp)
+    except ValueError as e:
+        p.error(barcode_error(e))
+
+    if args.count_only:
+        return count_main(args, config, assigner, orientation)
+
+    try:
+        writer_cls, parser = get_writer_cls(config)
+    except ValueError as e:
+        p.error(str(e))
+    if args.inline_barcode_length is not None and parser == "raw":
+        p.error("Pass-through mode can not be used with inline barcodes")
     if not os.path.exists(args.output_dir):
        #p.error("Output directory already exists")
        os.mkdir(args.output_dir)
-    writer = writer_cls(args.output_dir)
+    try:
+        writer = make_writer(writer_cls, args.output_dir, config)
+    except ValueError as e:
+        p.error(str(e))
 
-    if args.index_reads is None:
+    if args.inline_barcode_length is not None:
+        seq_file = InlineBarcodeFastqSequenceFile(
+            args.forward_reads, args.reverse_reads,
+            args.inline_barcode_length, parser=parser,
+            **input_options(config))
+    elif args.index_reads is None:
         seq_file = NoIndexFastqSequenceFile(
-            args.forward_reads, args.reverse_reads)
-        assigner = BarcodeAssigner(samples, revcomp=False)
+            args.forward_reads, args.reverse_reads,
+            parser=parser, **input_options(config))
     else:
         seq_file = IndexFastqSequenceFile(
-            args.forward_reads, args.reverse_reads, args.index_reads)
-        assigner = BarcodeAssigner(samples, revcomp=True)
+            args.forward_reads, args.reverse_reads, args.index_reads,
+            parser=parser, **input_options(config))
 
-    summary_data = seq_file.demultiplex(assigner, writer)
-    save_summary(args.summary_file, config, summary_data)
+    checkpoint = None
+    if config["checkpoint_interval"] or args.resume:
+        checkpoint_fp = os.path.join(args.output_dir, CHECKPOINT_FILENAME)
+        start_reads = 0
+        if args.resume:
+            state = load_checkpoint(checkpoint_fp)
+            if state is None:
+                p.error("No checkpoint found in %s" % args.output_dir)
+            try:
+                restore_checkpoint(state, assigner, writer)
+            except (ValueError, KeyError) as e:
+                p.error("Can not resume from checkpoint: %s" % e)
+            start_reads = state["reads"]
+        checkpoint = Checkpointer(
+            checkpoint_fp, config["checkpoint_interval"] or CHECKPOINT_READS,
+            start_reads)
+
+    profiler = StageProfiler() if config["profile"] else None
+    if config["progress_interval"]:
+        progress = ProgressReporter(
+            args.forward_reads, config["progress_interval"])
+    else:
+        progress = None
+
+    summary_data = seq_file.demultiplex(
+        assigner, writer, processes=config["processes"],
+        chunk_size=config["chunk_size"], profiler=profiler,
+        progress=progress, checkpoint=checkpoint)
+    t0 = time.perf_counter()
+    writer.close()
+    if profiler is not None:
+        profiler.add_total("close", time.perf_counter() - t0)
+    if checkpoint is not None:
+        # The output is complete, so there is nothing left to resume
+        checkpoint.remove()
+
+    extra = assigner_summary(assigner, config)
+    extra["barcode_orientation"] = orientation
+    extra["flush_stats"] = writer.flush_stats
+    extra["handle_stats"] = writer.handle_stats
+    if writer.read_stats is not None:
+        extra["read_stats"] = writer.read_stats_summary()
+    if profiler is not None:
+        extra["timing"] = profiler.summary()
+    if args.shard is not None:
+        extra["shard"] = shard_summary(args.shard)
+    save_summary(args.summary_file, config, summary_data, **extra)
+
+
+def count_main(args, config, assigner, orientation):
+    """Count reads for each sample, without writing any sequence data."""
+    if args.inline_barcode_length is not None:
+        seq_file = InlineBarcodeFastqSequenceFile(
+            args.forward_reads, None, args.inline_barcode_length)
+        counted_file = args.forward_reads
+    elif args.index_reads is None:
+        seq_file = NoIndexFastqSequenceFile(args.forward_reads, None)
+        counted_file = args.forward_reads
+    else:
+        seq_file = IndexFastqSequenceFile(None, None, args.index_reads)
+        counted_file = args.index_reads
+
+    if config["progress_interval"]:
+        progress = ProgressReporter(
+            counted_file, config["progress_interval"])
+    else:
+        progress = None
+
+    t0 = time.perf_counter()
+    summary_data = seq_file.count(assigner, progress=progress)
+    extra = assigner_summary(assigner, config)
+    extra["barcode_orientation"] = orientation
+    if config["profile"]:
+        profiler = StageProfiler()
+        profiler.reads = sum(summary_data.values())
+        profiler.add_total("count", time.perf_counter() - t0)
+        extra["timing"] = profiler.summary()
+    if args.shard is not None:
+        extra["shard"] = shard_summary(args.shard)
+    save_summary(args.summary_file, config, summary_data, **extra)
+
+
+def shard_arg(value):
+    """Parse a shard given as K/N on the command line."""
+    try:
+        k, n = [int(x) for x in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Shard must be given as K/N (got %s)" % value)
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(
+            "Shard K/N must have 1 <= K <= N (got %s)" % value)
+    return k, n
+
+
+def shard_summary(shard):
+    k, n = shard
+    return {"shard": k, "shards": n}
+
+
+def get_writer_cls(config):
+    """Writer class and FASTQ parser for the configured output."""
+    if config["passthrough"]:
+        if config["output_format"] not in passthrough_writers:
+            raise ValueError(
+                "Pass-through mode is not available for output format %s" %
+                config["output_format"])
+        # Records must be kept as views into the input buffers
+        return passthrough_writers[config["output_format"]], "raw"
+    return writers[config["output_format"]], config["fastq_parser"]
+
+
+def make_writer(writer_cls, output_dir, config):
+    return writer_cls(
+        output_dir,
+        compression=config["output_compression"],
+        compression_level=config["compression_level"],
+        compression_threads=config["compression_threads"],
+        buffer_size=config["buffer_size"],
+        max_buffer_memory=config["max_buffer_memory"],
+        max_open_files=config["max_open_files"],
+        write_unassigned=config["write_unassigned"],
+        write_threads=config["write_threads"] if config["pipeline"] else 0,
+        write_queue_size=config["write_queue_size"],
+        read_stats=config["read_stats"])
+
+
+def input_options(config):
+    """Options for reading input in the pipeline mode.
+
+    In the pipeline mode, every input file is read ahead in its own
+    thread, and output is written by a pool of writer threads, while
+    the main thread assigns reads.
+    """
+    return {
+        "prefetch": config["pipeline"],
+        "readahead_blocks": config["readahead_blocks"],
+        }
+
+
+def make_assigner(assigner_cls, samples, config, revcomp):
+    return assigner_cls(
+        samples, mismatches=config["barcode_mismatches"], revcomp=revcomp,
+        unassigned_capacity=config["unassigned_capacity"],
+        table_cache_dir=config["table_cache_dir"])
+
+
+def barcode_error(e):
+    """Message for barcodes that can not be used to assign reads."""
+    return "%s (check the barcodes with check_barcodes.py)" % e
+
+
+def assigner_summary(assigner, config):
+    extra = {
+        "top_unassigned_barcodes": assigner.top_unassigned(
+            config["unassigned_reported"]),
+        }
+    if isinstance(assigner, DualBarcodeAssigner):
+        extra["index_hopping"] = assigner.index_hopping
+    return extra
 
 
-def save_summary(f, config, data):
+def save_summary(f, config, data, **extra):
     result = {
         "program": "dnabc",
         "version": __version__,
         "config": config,
         "data": data,
         }
+    result.update(extra)
     json.dump(result, f)
@@ -0,0 +1,176 @@
+"""Combine the results of a run split into shards.
+
+Each shard of the input (see the --shard option of dnabc.py) is
+demultiplexed into its own output directory, with its own summary.
+The output files of the shards are concatenated in shard order, so
+every sample file holds its reads in the same order as a single run.
+Gzip files made of several members are still valid gzip files.
+"""
+import argparse
+import json
+import os
+import shutil
+
+from . import readstats
+from .main import save_summary
+
+# Summary values that are sums of the values for each shard
+SUMMED_STATS = ["flush_stats", "handle_stats", "index_hopping"]
+
+
+def order_shards(summaries):
+    """Sort shard summaries by shard number.
+
+    Raises ValueError unless there is exactly one summary for each
+    shard of the run.
+    """
+    for summary in summaries:
+        if "shard" not in summary:
+            raise ValueError("Summary is not for a shard of a run")
+    n_shards = set(s["shard"]["shards"] for s in summaries)
+    if len(n_shards) != 1:
+        raise ValueError(
+            "Summaries are for different numbers of shards: %s" %
+            sorted(n_shards))
+    n_shards = n_shards.pop()
+    shards = sorted(s["shard"]["shard"] for s in summaries)
+    if shards != list(range(1, n_shards + 1)):
+        raise ValueError(
+            "Expected one summary for each of %s shards (got shards %s)" % (
+                n_shards, ", ".join(str(k) for k in shards)))
+    return sorted(summaries, key=lambda s: s["shard"]["shard"])
+
+
+def merge_summaries(summaries):
+    """Combine the summaries of all shards of a run.
+
+    Read counts and other statistics are added up.  Unassigned
+    barcodes are ranked by their total count over the shards, so a
+    barcode left out of the list for one shard is not counted there.
+    Returns the read counts and the other summary values.
+    """
+    summaries = order_shards(summaries)
+    first = summaries[0]
+    data = _add_counts(s["data"] for s in summaries)
+    if any(set(s["data"]) != set(data) for s in summaries):
+        raise ValueError("Summaries are for different samples")
+
+    orientations = set(
+        s["barcode_orientation"]["orientation"] for s in summaries
+        if "barcode_orientation" in s)
+    if len(orientations) > 1:
+        raise ValueError(
+            "Shards were demultiplexed with different barcode orientations: "
+            "%s" % ", ".join(sorted(orientations)))
+
+    extra = {}
+    for key in SUMMED_STATS:
+        if key in first:
+            extra[key] = _add_counts(s[key] for s in summaries)
+    if "top_unassigned_barcodes" in first:
+        extra["top_unassigned_barcodes"] = _merge_top_barcodes(
+            [s["top_unassigned_barcodes"] for s in summaries],
+            first["config"]["unassigned_reported"])
+    if "barcode_orientation" in first:
+        extra["barcode_orientation"] = first["barcode_orientation"]
+    if "read_stats" in first:
+        extra["read_stats"] = _merge_read_stats(
+            [s["read_stats"] for s in summaries])
+    extra["shards"] = [s["shard"] for s in summaries]
+    return data, extra
+
+
+def _add_counts(dicts):
+    total = {}
+    for d in dicts:
+        for key, n in d.items():
+            total[key] = total.get(key, 0) + n
+    return total
+
+
+def _merge_read_stats(shard_stats):
+    by_sample = {}
+    for stats in shard_stats:
+        for name, file_stats in stats.items():
+            by_sample.setdefault(name, []).append(file_stats)
+    return dict(
+        (name, [readstats.merge_summaries(x) for x in zip(*file_stats)])
+        for name, file_stats in by_sample.items())
+
+
+def _merge_top_barcodes(tops, n):
+    counts = {}
+    errors = {}
+    for top in tops:
+        for x in top:
+            bc = x["barcode"]
+            counts[bc] = counts.get(bc, 0) + x["count"]
+            errors[bc] = errors.get(bc, 0) + x["max_error"]
+    barcodes = sorted(counts, key=lambda x: (-counts[x], x))[:n]
+    return [
+        {"barcode": bc, "count": counts[bc], "max_error": errors[bc]}
+        for bc in barcodes]
+
+
+def merge_outputs(shard_dirs, output_dir):
+    """Concatenate the output files of each shard, in shard order.
+
+    Hidden files, such as checkpoints, are skipped.  Returns the file
+    names written.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    filenames = set()
+    for shard_dir in shard_dirs:
+        filenames.update(
+            fn for fn in os.listdir(shard_dir) if not fn.startswith("."))
+    filenames = sorted(filenames)
+    for fn in filenames:
+        with open(os.path.join(output_dir, fn), "wb") as out:
+            for shard_dir in shard_dirs:
+                fp = os.path.join(shard_dir, fn)
+                if os.path.exists(fp):
+                    with open(fp, "rb") as f:
+                        shutil.copyfileobj(f, out)
+    return filenames
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Combine the output of a run split into shards")
+    p.add_argument(
+        "--shard-summaries", required=True, nargs="+",
+        type=argparse.FileType("r"),
+        help="Summary file of each shard")
+    p.add_argument(
+        "--shard-dirs", nargs="+",
+        help=(
+            "Output directory of each shard, in the same order as the "
+            "summary files"))
+    p.add_argument(
+        "--output-dir",
+        help="Output directory for the combined sequence data")
+    p.add_argument(
+        "--summary-file", required=True,
+        type=argparse.FileType("w"),
+        help="Combined summary filepath")
+    args = p.parse_args(argv)
+    if (args.shard_dirs is None) != (args.output_dir is None):
+        p.error("--shard-dirs and --output-dir must be given together")
+    if args.shard_dirs and (
+            len(args.shard_dirs) != len(args.shard_summaries)):
+        p.error("Expected one output directory for each summary file")
+
+    summaries = [json.load(f) for f in args.shard_summaries]
+    try:
+        data, extra = merge_summaries(summaries)
+    except ValueError as e:
+        p.error(str(e))
+
+    if args.shard_dirs:
+        shard_dirs = dict(
+            (s["shard"]["shard"], d)
+            for s, d in zip(summaries, args.shard_dirs))
+        merge_outputs(
+            [shard_dirs[k] for k in sorted(shard_dirs)], args.output_dir)
+    save_summary(args.summary_file, summaries[0]["config"], data, **extra)
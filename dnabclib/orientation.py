@@ -0,0 +1,154 @@
+"""Detect the orientation of barcodes from the first reads of a run.
+
+Depending on the instrument and chemistry, index reads may match the
+barcodes in the sample sheet or their reverse complements.  Before a
+run, the first reads are matched exactly against the barcodes in each
+orientation, and the one that matches the most reads is used.  The
+lookup table, with mismatches, is then built once for that orientation.
+"""
+import gzip
+import itertools
+
+from .assigner import reverse_complement
+from .seqfile import GZIP_MAGIC, NoIndexFastqSequenceFile
+
+# Number of reads scanned to detect the orientation
+SCAN_READS = 10000
+
+# Fraction of scanned reads that must match a sample barcode
+MIN_MATCH_RATE = 0.1
+
+ORIENTATIONS = {
+    "forward": False,
+    "reverse_complement": True,
+    }
+
+
+def read_barcode_sample(f, n=SCAN_READS, from_description=False,
+                        barcode_length=None):
+    """Read the barcodes of the first n reads, then rewind the file.
+
+    Barcodes are taken from the sequences of index reads, or from the
+    description lines if from_description is set.  If barcode_length
+    is given, barcodes are the first bases of each sequence.  Returns
+    None if the file can not be rewound.
+    """
+    if not f.seekable():
+        return None
+    pos = f.tell()
+    try:
+        if f.read(2) == GZIP_MAGIC:
+            f.seek(pos)
+            lines = gzip.GzipFile(fileobj=f, mode="rb")
+        else:
+            f.seek(pos)
+            lines = f
+        lines = [
+            _as_text(line).rstrip("\r\n")
+            for line in itertools.islice(lines, 4 * n)]
+    finally:
+        f.seek(pos)
+    if from_description:
+        parse_barcode = NoIndexFastqSequenceFile._parse_barcode
+        return [parse_barcode(desc[1:]) for desc in lines[0::4]]
+    if barcode_length is not None:
+        return [seq[:barcode_length] for seq in lines[1::4]]
+    return lines[1::4]
+
+
+def _as_text(line):
+    if isinstance(line, bytes):
+        return line.decode("ascii")
+    return line
+
+
+def orientation_name(revcomp):
+    names = dict((v, k) for k, v in ORIENTATIONS.items())
+    if isinstance(revcomp, tuple):
+        return "+".join(names[x] for x in revcomp)
+    return names[revcomp]
+
+
+def detect_orientation(barcodes, samples, default,
+                       min_match_rate=MIN_MATCH_RATE):
+    """Choose the orientation that matches the most barcodes.
+
+    Barcodes are matched exactly, which is enough to tell the
+    orientations apart without building a lookup table for each.  For
+    dual-indexed samples, each combination of orientations for the
+    two indexes is tried.  On a tie, the default orientation is used.
+    Raises ValueError if no orientation matches at least
+    min_match_rate of the barcodes.
+    """
+    if samples[0].is_dual_indexed:
+        candidates = list(itertools.product([False, True], repeat=2))
+        default = (default, default)
+    else:
+        candidates = [False, True]
+    # The default is tried first, so it wins a tie
+    candidates.remove(default)
+    candidates.insert(0, default)
+
+    match_rates = {}
+    best = None
+    for revcomp in candidates:
+        expected = set(_oriented_barcode(s, revcomp) for s in samples)
+        matched = sum(1 for bc in barcodes if bc in expected)
+        rate = matched / float(len(barcodes)) if barcodes else 0.0
+        match_rates[orientation_name(revcomp)] = rate
+        if best is None or rate > match_rates[orientation_name(best)]:
+            best = revcomp
+
+    info = {
+        "orientation": orientation_name(best),
+        "detected": True,
+        "reads_scanned": len(barcodes),
+        "match_rates": match_rates,
+        }
+    if match_rates[info["orientation"]] < min_match_rate:
+        raise ValueError(
+            "No barcode orientation matches at least %s of the first %s "
+            "reads (match rates: %s)" % (
+                min_match_rate, len(barcodes), ", ".join(
+                    "%s %.3f" % x for x in sorted(match_rates.items()))))
+    return best, info
+
+
+def _oriented_barcode(sample, revcomp):
+    # The barcode of a sample as it appears in the reads
+    if isinstance(revcomp, tuple):
+        bcs = [sample.barcode, sample.barcode2]
+    else:
+        bcs = [sample.barcode]
+        revcomp = (revcomp,)
+    return "".join(
+        reverse_complement(bc) if rc else bc for bc, rc in zip(bcs, revcomp))
+
+
+def choose_orientation(config, samples, barcode_file,
+                       from_description, default, barcode_length=None):
+    """Orientation of the barcodes for a run, and a summary of how it
+    was chosen.
+
+    The "barcode_orientation" config value is "auto", "forward" or
+    "reverse_complement".  With "auto", the orientation is detected
+    from the first reads in barcode_file, unless that file is empty or
+    can not be rewound, in which case the default is used.  For inline
+    barcodes, barcode_length is the length of the barcode at the start
+    of each read.
+    """
+    orientation = config["barcode_orientation"]
+    if orientation != "auto":
+        if orientation not in ORIENTATIONS:
+            raise ValueError("Unknown barcode orientation: %s" % orientation)
+        revcomp = ORIENTATIONS[orientation]
+        return revcomp, {"orientation": orientation, "detected": False}
+
+    barcodes = read_barcode_sample(
+        barcode_file, config["orientation_scan_reads"], from_description,
+        barcode_length)
+    if not barcodes:
+        return default, {
+            "orientation": orientation_name(default), "detected": False}
+    return detect_orientation(
+        barcodes, samples, default, config["orientation_min_match_rate"])
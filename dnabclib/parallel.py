@@ -0,0 +1,160 @@
+"""Demultiplexing with a pool of worker processes.
+
+The main process cuts the input streams into chunks holding the same
+number of records, and worker processes parse the chunks, assign the
+reads, and format the output of each sample with the writer's
+format_batch.  Only the formatted data and the counts are sent back,
+and the main process adds the data to the writer in the order of the
+chunks.  Reads therefore reach each sample file in the same order as
+in a serial run.
+"""
+import collections
+import io
+import itertools
+import multiprocessing
+import time
+
+# Number of reads per chunk handed to a worker process
+CHUNK_SIZE = 10000
+
+# Per-process state, set by _init_worker
+_worker = {}
+
+
+def read_chunks(files, chunk_size=CHUNK_SIZE):
+    """Cut the input files into aligned chunks of raw FASTQ data.
+
+    Each chunk is a tuple with the unparsed text of chunk_size records
+    from each file.  The files are cut on line boundaries only, so no
+    parsing is done in the calling process.
+    """
+    n_lines = 4 * chunk_size
+    while True:
+        chunk = tuple(_join(itertools.islice(f, n_lines)) for f in files)
+        if not any(chunk):
+            return
+        yield chunk
+
+
+def _join(lines):
+    lines = list(lines)
+    if lines and isinstance(lines[0], bytes):
+        return b"".join(lines)
+    return "".join(lines)
+
+
+def _init_worker(assigner, parse, get_barcode, format_batch,
+                 write_unassigned):
+    _worker["assigner"] = assigner
+    _worker["parse"] = parse
+    _worker["get_barcode"] = get_barcode
+    _worker["format_batch"] = format_batch
+    _worker["write_unassigned"] = write_unassigned
+
+
+def _assign_chunk(chunk):
+    assigner = _worker["assigner"]
+    parse = _worker["parse"]
+    get_barcode = _worker["get_barcode"]
+    format_batch = _worker["format_batch"]
+
+    # Counts are collected for this chunk only and summed in the
+    # main process
+    assigner.reset_counts()
+    reads = list(zip(*[parse(_as_file(data)) for data in chunk]))
+    samples = assigner.assign_batch(
+        [get_barcode(*records) for records in reads])
+    groups = collections.OrderedDict()
+    for records, sample in zip(reads, samples):
+        name = None if sample is None else sample.name
+        groups.setdefault(name, []).append(records[:2])
+    if not _worker["write_unassigned"]:
+        groups.pop(None, None)
+    data = [
+        (name, format_batch(readpairs)) for name, readpairs in groups.items()]
+    return assigner.reset_counts(), len(reads), data
+
+
+def _as_file(data):
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    return io.StringIO(data)
+
+
+def demultiplex_parallel(files, get_barcode, parse, assigner, writer,
+                         processes, chunk_size=CHUNK_SIZE, profiler=None,
+                         progress=None, checkpoint=None):
+    """Demultiplex reads using a pool of worker processes.
+
+    The first two files are the forward and reverse reads, and any
+    remaining file holds index reads.  For each set of records,
+    get_barcode returns the barcode sequence to assign.  It must be
+    a module-level function or static method, so that it can be sent
+    to the workers.  The writer must have a format_batch class method
+    and a write_formatted method.  The number of chunks in flight is
+    limited to twice the number of processes to keep memory use
+    bounded.
+
+    If a profiler is given, time spent cutting chunks, waiting for
+    workers, and writing results is recorded for every chunk.  A
+    checkpoint is updated after the results of each chunk are written.
+    """
+    samples = dict((s.name, s) for s in assigner.samples)
+    pool = multiprocessing.Pool(
+        processes, _init_worker, (
+            assigner, parse, get_barcode, type(writer).format_batch,
+            writer.write_unassigned))
+    pending = collections.deque()
+    state = {"reads": 0}
+    chunks = read_chunks(files, chunk_size)
+    try:
+        while True:
+            t0 = time.perf_counter()
+            chunk = next(chunks, None)
+            if profiler is not None:
+                profiler.add_total("read_chunks", time.perf_counter() - t0)
+            if chunk is None:
+                break
+            pending.append(pool.apply_async(_assign_chunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                _finish_chunk(
+                    pending.popleft(), samples, assigner, writer, state,
+                    profiler, progress, checkpoint)
+        while pending:
+            _finish_chunk(
+                pending.popleft(), samples, assigner, writer, state,
+                profiler, progress, checkpoint)
+    except:
+        # Let chunks already sent finish first, since terminating the
+        # pool while a large chunk is being sent can deadlock
+        for async_result in pending:
+            async_result.wait()
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    if profiler is not None:
+        profiler.reads += state["reads"]
+    return assigner.read_counts
+
+
+def _finish_chunk(async_result, samples, assigner, writer, state,
+                  profiler, progress, checkpoint):
+    t0 = time.perf_counter()
+    counts, reads, data = async_result.get()
+    t1 = time.perf_counter()
+    for name, sample_data in data:
+        # Use the samples from this process, since writers keep track
+        # of their output files by sample
+        sample = None if name is None else samples[name]
+        writer.write_formatted(sample_data, sample)
+    state["reads"] += reads
+    assigner.add_counts(counts)
+    if profiler is not None:
+        profiler.add_total("wait_workers", t1 - t0)
+        profiler.add_total("write", time.perf_counter() - t1)
+    if progress is not None:
+        progress.update(state["reads"])
+    if checkpoint is not None:
+        checkpoint.update(state["reads"], assigner, writer)
@@ -0,0 +1,173 @@
+"""Stage timing and progress reports for the demultiplexing loop."""
+import collections
+import datetime
+import os
+import random
+import sys
+import time
+
+# Every this many reads, one read is timed stage by stage
+SAMPLE_EVERY = 64
+
+# Number of reads between checks of the progress clock
+PROGRESS_CHECK_READS = 4096
+
+
+class StageProfiler(object):
+    """Sampled timers for each stage of the demultiplexing loop.
+
+    Timing every stage of every read would cost more than the stages
+    themselves, so only one read in sample_every is timed: the first
+    read, and then one at a random position in each later run of
+    sample_every reads.  Totals for the whole run are estimated from
+    the sampled reads.  Stages that are timed in
+    bulk, such as whole chunks, can be added with add_total.
+
+    In a short run, a few slow samples can make the estimates larger
+    than the time that is left after the stages timed in bulk, so the
+    estimates are then scaled down to fit in that time.
+    """
+    def __init__(self, sample_every=SAMPLE_EVERY):
+        self.sample_every = sample_every
+        self.reads = 0
+        self.sampled_reads = 0
+        self._sampled_seconds = collections.OrderedDict()
+        self._total_seconds = collections.OrderedDict()
+        self._start = time.perf_counter()
+
+    def add_sample(self, stage_times):
+        self.sampled_reads += 1
+        for stage, seconds in stage_times:
+            self._sampled_seconds[stage] = (
+                self._sampled_seconds.get(stage, 0.0) + seconds)
+
+    def add_total(self, stage, seconds):
+        self._total_seconds[stage] = (
+            self._total_seconds.get(stage, 0.0) + seconds)
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self._start
+        stage_seconds = collections.OrderedDict()
+        if self.sampled_reads:
+            scale = self.reads / float(self.sampled_reads)
+            estimated = sum(self._sampled_seconds.values()) * scale
+            untimed = max(
+                wall_seconds - sum(self._total_seconds.values()), 0.0)
+            if estimated > untimed:
+                scale *= untimed / estimated
+            for stage, seconds in self._sampled_seconds.items():
+                stage_seconds[stage] = seconds * scale
+        stage_seconds.update(self._total_seconds)
+        return {
+            "reads": self.reads,
+            "sampled_reads": self.sampled_reads,
+            "wall_seconds": wall_seconds,
+            "stage_seconds": stage_seconds,
+            }
+
+
+class ProgressReporter(object):
+    """Periodic progress messages for a demultiplexing run.
+
+    The ETA is based on the byte offset in the input file f, which is
+    read from the operating system.  For compressed input this is the
+    offset in the compressed file.  If f is not a real file, progress
+    is reported without an ETA.
+    """
+    def __init__(self, f, interval=60.0, out=sys.stderr):
+        self.interval = interval
+        self.out = out
+        try:
+            self._fd = f.fileno()
+            self._size = os.fstat(self._fd).st_size
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+            self._size = None
+        self._start = time.time()
+        self._last_report = self._start
+
+    def _fraction_done(self):
+        if not self._size:
+            return None
+        try:
+            offset = os.lseek(self._fd, 0, os.SEEK_CUR)
+        except OSError:
+            return None
+        return min(offset / float(self._size), 1.0)
+
+    def update(self, reads):
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.out.write(self.message(reads, now) + "\n")
+            self.out.flush()
+
+    def message(self, reads, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = now - self._start
+        rate = reads / elapsed if elapsed > 0 else 0.0
+        msg = "Processed %s reads (%.0f reads/sec)" % (reads, rate)
+        fraction = self._fraction_done()
+        if fraction:
+            remaining = elapsed * (1 - fraction) / fraction
+            msg += ", %.1f%% of input, ETA %s" % (
+                100 * fraction,
+                datetime.timedelta(seconds=int(remaining)))
+        return msg
+
+
+def demultiplex_instrumented(records, get_barcode, assigner, writer,
+                             profiler=None, progress=None, checkpoint=None):
+    """Demultiplexing loop with optional stage timing and progress.
+
+    Records are tuples of reads; the first two are written out, and
+    get_barcode returns the barcode sequence for each tuple.  If a
+    checkpoint is given, it is updated along with the progress.
+
+    Reading is timed for every record, as the occasional read of a
+    whole input block would make the estimate from sampled reads far
+    off.  Assigning and writing are timed for sampled reads.  Random
+    positions keep the samples from lining up with writer flushes.
+    """
+    timer = time.perf_counter
+    records = iter(records)
+    reads = 0
+    read_seconds = 0.0
+    if profiler is None:
+        next_sample = -1
+    else:
+        sample_every = profiler.sample_every
+        window = 0
+        next_sample = 0
+    while True:
+        if profiler is None:
+            rec = next(records, None)
+        else:
+            t0 = timer()
+            rec = next(records, None)
+            read_seconds += timer() - t0
+        if rec is None:
+            break
+        if reads == next_sample:
+            t1 = timer()
+            sample = assigner.assign(get_barcode(*rec))
+            t2 = timer()
+            writer.write(rec[:2], sample)
+            t3 = timer()
+            profiler.add_sample([("assign", t2 - t1), ("write", t3 - t2)])
+            window += sample_every
+            next_sample = window + random.randrange(sample_every)
+        else:
+            sample = assigner.assign(get_barcode(*rec))
+            writer.write(rec[:2], sample)
+        reads += 1
+        if reads % PROGRESS_CHECK_READS == 0:
+            if progress is not None:
+                progress.update(reads)
+            if checkpoint is not None:
+                checkpoint.update(reads, assigner, writer)
+    if profiler is not None:
+        profiler.add_total("read", read_seconds)
+        profiler.reads += reads
+    return assigner.read_counts
@@ -0,0 +1,181 @@
+"""Quality and length statistics for each output file.
+
+Statistics are gathered from the formatted output as the writer
+flushes it.  Output is collected into blocks, and each block is
+treated as one array of bytes: line boundaries are found with NumPy,
+and the quality lines are copied into a matrix with one row per
+read, so the Phred scores of a block are summed at once, with no work
+per base in Python.
+
+NumPy is needed for statistics; numpy is None if it is not installed.
+"""
+from .twobit import numpy
+
+if numpy is not None:
+    from numpy.lib.stride_tricks import as_strided
+
+PHRED_OFFSET = 33
+
+# Bases with at least this quality are counted as Q30 bases
+Q30 = 30
+
+# Amount of output collected before statistics are counted
+STATS_BLOCK_SIZE = 1 << 18
+
+
+class ReadStats(object):
+    """Read lengths and qualities for one output file.
+
+    Data is added as blocks of FASTQ text, or of FASTA text if quality
+    is not set.  For FASTQ, the quality lines give the read lengths,
+    the total quality at each position, and the number of Q30 bases.
+    For FASTA, only read lengths are counted.
+    """
+    def __init__(self, quality=True, block_size=STATS_BLOCK_SIZE):
+        if numpy is None:
+            raise ValueError("NumPy is required for read statistics")
+        self.quality = quality
+        self.block_size = block_size
+        self.length_counts = numpy.zeros(0, dtype=numpy.int64)
+        self.quality_sums = numpy.zeros(0, dtype=numpy.int64)
+        self.q30_bases = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, data):
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        else:
+            # Copy, in case the caller reuses its buffer
+            data = bytes(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """Count the data added since the last block."""
+        if not self._pending:
+            return
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        if self.quality:
+            self._count_fastq(data)
+        else:
+            self._count_fasta(data)
+
+    def _count_fastq(self, data):
+        starts, lengths = _line_spans(data, 4, 3)
+        self.length_counts = _add_arrays(
+            self.length_counts, numpy.bincount(lengths))
+        width = int(lengths.max()) if len(lengths) else 0
+        if not width:
+            return
+        # One row of quality bytes for each read, taken from a view of
+        # the data with a window of width bytes at every offset.  Rows
+        # of short reads are padded with a quality of 0.
+        a = _as_array(data)
+        if starts[-1] + width > len(a):
+            a = numpy.append(a, numpy.zeros(width, dtype=numpy.uint8))
+        windows = as_strided(a, (len(a) - width + 1, width), (1, 1))
+        quals = windows[starts]
+        if (lengths < width).any():
+            quals[numpy.arange(width) >= lengths[:, None]] = PHRED_OFFSET
+        sums = _column_sums(quals) - PHRED_OFFSET * len(lengths)
+        self.quality_sums = _add_arrays(self.quality_sums, sums)
+        self.q30_bases += int(
+            numpy.count_nonzero(quals >= PHRED_OFFSET + Q30))
+
+    def _count_fasta(self, data):
+        _, lengths = _line_spans(data, 2, 1)
+        self.length_counts = _add_arrays(
+            self.length_counts, numpy.bincount(lengths))
+
+    def add_summary(self, summary):
+        """Add the counts from the summary of another ReadStats."""
+        length_counts = numpy.zeros(
+            max([int(k) for k in summary["length_distribution"]] + [-1]) + 1,
+            dtype=numpy.int64)
+        for length, n in summary["length_distribution"].items():
+            length_counts[int(length)] = n
+        self.length_counts = _add_arrays(self.length_counts, length_counts)
+        if self.quality:
+            counts = _position_counts(length_counts)
+            sums = numpy.rint(numpy.array(
+                summary["mean_quality"], dtype=float) * counts)
+            self.quality_sums = _add_arrays(
+                self.quality_sums, sums.astype(numpy.int64))
+            self.q30_bases += summary["q30_bases"]
+
+    def summary(self):
+        self.flush()
+        reads = int(self.length_counts.sum())
+        bases = int(
+            (self.length_counts * numpy.arange(len(self.length_counts))).sum())
+        result = {
+            "reads": reads,
+            "bases": bases,
+            "length_distribution": dict(
+                (str(length), int(n))
+                for length, n in enumerate(self.length_counts.tolist())
+                if n),
+            }
+        if self.quality:
+            counts = _position_counts(self.length_counts)
+            n = len(self.quality_sums)
+            result["mean_quality"] = (
+                self.quality_sums / counts[:n].clip(1)).tolist()
+            result["q30_bases"] = self.q30_bases
+            result["q30_fraction"] = (
+                self.q30_bases / float(bases) if bases else 0.0)
+        return result
+
+
+def merge_summaries(summaries):
+    """Combine summaries of ReadStats for the same output file."""
+    stats = ReadStats(quality=all("mean_quality" in s for s in summaries))
+    for summary in summaries:
+        stats.add_summary(summary)
+    return stats.summary()
+
+
+def _as_array(data):
+    return numpy.frombuffer(data, dtype=numpy.uint8)
+
+
+def _line_spans(data, lines_per_record, line):
+    # Start and length of one line of every record, after the first
+    a = _as_array(data)
+    ends = numpy.flatnonzero(a == 10)
+    starts = ends[line - 1::lines_per_record] + 1
+    ends = ends[line::lines_per_record]
+    # Line ends may include a carriage return
+    if len(ends) and b"\r" in data:
+        ends = ends - (a[ends - 1] == 13)
+    return starts, ends - starts
+
+
+def _column_sums(a):
+    # Rows are added in groups of 256 with 16-bit sums, which can not
+    # overflow, and the sums of the groups are then added up
+    n = len(a) // 256 * 256
+    sums = a[n:].sum(axis=0, dtype=numpy.int64)
+    if n:
+        groups = a[:n].reshape(-1, 256, a.shape[1])
+        sums += groups.sum(axis=1, dtype=numpy.uint16).sum(
+            axis=0, dtype=numpy.int64)
+    return sums
+
+
+def _add_arrays(a, b):
+    if len(b) > len(a):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+
+def _position_counts(length_counts):
+    # Number of reads covering each position
+    return length_counts[::-1].cumsum()[::-1][1:]
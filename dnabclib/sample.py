@@ -1,20 +1,44 @@
+import collections
+import csv
+
+
 class Sample(object):
     """Class representing one demultiplexable unit."""
-    def __init__(self, name, barcode):
+    def __init__(self, name, barcode, barcode2=None):
         self.name = name
         self.barcode = barcode
         if self.barcode is not None:
             self.barcode = self.barcode.upper()
+        # Second (i5) index for dual-indexed samples
+        self.barcode2 = barcode2
+        if self.barcode2 is not None:
+            self.barcode2 = self.barcode2.upper()
+
+    @property
+    def is_dual_indexed(self):
+        return self.barcode2 is not None
 
     @classmethod
     def load(cls, f):
-        records = list(parse_barcode_file(f))
-        names, bcs = zip(*records)
+        return cls.from_records(list(parse_barcode_file(f)))
+
+    @classmethod
+    def from_records(cls, records):
+        """Create samples from (name, barcode, barcode2) tuples."""
+        names, bcs, bc2s = zip(*records)
 
         dup_names = duplicates(names)
         if dup_names:
             raise ValueError("Duplicate sample names: %s" % dup_names)
 
+        n_dual = sum(1 for bc2 in bc2s if bc2 is not None)
+        if n_dual not in (0, len(records)):
+            raise ValueError(
+                "Either all or none of the samples must have a second index")
+
+        # With dual indexes, only the combination must be unique
+        if n_dual:
+            bcs = ["%s+%s" % (bc, bc2) for bc, bc2 in zip(bcs, bc2s)]
         dup_bcs = duplicates(bcs)
         if dup_bcs:
             raise ValueError("Duplicate barcodes: %s" % dup_bcs)
@@ -22,7 +46,21 @@ class Sample(object):
         if "unassigned" in names:
             raise ValueError("A sample can not be called unassigned")
 
-        return [cls(name, bc) for name, bc in records]
+        return [cls(name, bc, bc2) for name, bc, bc2 in records]
+
+
+def load_sample_sheet(f):
+    """Load the samples for every lane in an Illumina sample sheet.
+
+    Returns a dict of sample lists, keyed by lane.  Sample names and
+    barcodes are taken from the sample sheet as in split_samplelanes.py.
+    """
+    records = collections.OrderedDict()
+    for lane, sample_id, barcode in parse_sample_sheet(f):
+        records.setdefault(lane, []).append((sample_id, barcode, None))
+    return collections.OrderedDict(
+        (lane, Sample.from_records(lane_records))
+        for lane, lane_records in records.items())
 
 
 def duplicates(xs):
@@ -35,6 +73,10 @@ def duplicates(xs):
     return list(seen_twice)
 
 
+# Bases allowed in the second (i5) index
+INDEX_BASES = frozenset("ACGT")
+
+
 def parse_barcode_file(f):
     for n, line in enumerate(f):
         if line.startswith("#"):
@@ -50,4 +92,22 @@ def parse_barcode_file(f):
                     line_num, toks))
         sample_id = toks[0]
         barcode = toks[1]
-        yield sample_id, barcode
+        # An optional third field holds the second (i5) index
+        barcode2 = toks[2] if len(toks) > 2 and toks[2] else None
+        if barcode2 is not None and not set(barcode2.upper()) <= INDEX_BASES:
+            line_num = n + 1
+            raise ValueError(
+                "Third field in barcode file is not an i5 index "
+                "(line %s): %s" % (line_num, toks))
+        yield sample_id, barcode, barcode2
+
+
+def parse_sample_sheet(f):
+    for row in csv.reader(f, delimiter=","):
+        # Header lines and sections do not have a lane number
+        if len(row) < 5 or not row[1].strip().isdigit():
+            continue
+        lane = row[1].strip()
+        sample_id = row[2].replace(" ", "")
+        barcode = row[4].replace("-", "")
+        yield lane, sample_id, barcode
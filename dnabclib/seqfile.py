@@ -1,4 +1,24 @@
+import functools
+import gzip
+import io
 import itertools
+import queue
+import threading
+
+from .checkpoint import skip_records
+from .parallel import CHUNK_SIZE, demultiplex_parallel
+from .profiling import demultiplex_instrumented
+from .stream import demultiplex_batches
+from .twobit import numpy
+
+# Size of the blocks read by the block-based FASTQ parser
+BLOCK_SIZE = 1 << 20
+
+# Number of decompressed blocks to read ahead of the parser
+READAHEAD_BLOCKS = 4
+
+GZIP_MAGIC = b"\x1f\x8b"
+
 
 class IndexFastqSequenceFile(object):
     """Illumina data, 3 file format: forward, reverse, index.
@@ -6,20 +26,71 @@ class IndexFastqSequenceFile(object):
     This format is used by the MiSeq but not supported by newer HiSeq
     machines.
     """
-    def __init__(self, fwd, rev, idx):
-        self.forward_file = fwd
-        self.reverse_file = rev
-        self.index_file = idx
+    def __init__(self, fwd, rev, idx, parser="block", prefetch=False,
+                 readahead_blocks=READAHEAD_BLOCKS):
+        kwargs = {"prefetch": prefetch, "readahead_blocks": readahead_blocks}
+        self.forward_file = _open_optional_input(fwd, **kwargs)
+        self.reverse_file = _open_optional_input(rev, **kwargs)
+        self.index_file = open_input(idx, **kwargs)
+        self._parse = fastq_parsers[parser]
 
-    def demultiplex(self, assigner, writer):
-        idxs = (FastqRead(x) for x in parse_fastq(self.index_file))
-        fwds = (FastqRead(x) for x in parse_fastq(self.forward_file))
-        revs = (FastqRead(x) for x in parse_fastq(self.reverse_file))
+    def demultiplex(self, assigner, writer, processes=1,
+                    chunk_size=CHUNK_SIZE, profiler=None, progress=None,
+                    checkpoint=None):
+        files = [self.forward_file, self.reverse_file, self.index_file]
+        if checkpoint is not None and checkpoint.start_reads:
+            for f in files:
+                skip_records(f, checkpoint.start_reads)
+        if processes > 1:
+            return demultiplex_parallel(
+                files, self._get_barcode, self._parse, assigner, writer,
+                processes, chunk_size, profiler, progress, checkpoint)
+        if _demultiplex_in_chunks(
+                self._parse, writer, profiler, progress, checkpoint):
+            return demultiplex_raw(
+                files, self._chunk_barcodes, assigner, writer)
+        idxs = self._parse(self.index_file)
+        fwds = self._parse(self.forward_file)
+        revs = self._parse(self.reverse_file)
+        if profiler or progress or checkpoint:
+            return demultiplex_instrumented(
+                zip(fwds, revs, idxs), self._get_barcode, assigner, writer,
+                profiler, progress, checkpoint)
         for idx, fwd, rev in zip(idxs, fwds, revs):
             sample = assigner.assign(idx.seq)
             writer.write((fwd, rev), sample)
         return assigner.read_counts
 
+    def iter_batches(self, assigner, **kwargs):
+        """Yield (sample, reads) batches; see stream.demultiplex_batches."""
+        records = zip(
+            self._parse(self.forward_file), self._parse(self.reverse_file),
+            self._parse(self.index_file))
+        return demultiplex_batches(
+            records, self._get_barcode, assigner, **kwargs)
+
+    def count(self, assigner, progress=None):
+        """Assign reads to samples without writing them.
+
+        Only the sequences of the index reads are parsed; the forward
+        and reverse reads files are never read.
+        """
+        reads = 0
+        for lines in fastq_line_blocks(self.index_file):
+            assigner.assign_batch(lines[1::4])
+            reads += len(lines) // 4
+            if progress is not None:
+                progress.update(reads)
+        return assigner.read_counts
+
+    @staticmethod
+    def _get_barcode(fwd, rev, idx):
+        return idx.seq
+
+    @staticmethod
+    def _chunk_barcodes(chunk):
+        return raw_lines(chunk[2])[1::4]
+
 
 class NoIndexFastqSequenceFile(object):
     """Illumina data, 2 file format: forward, reverse.
@@ -27,19 +98,72 @@ class NoIndexFastqSequenceFile(object):
     This format is used by the newer HiSeq machines.  Barcodes are
     found in the description lines of each read.
     """
-    def __init__(self, fwd, rev):
-        self.forward_file = fwd
-        self.reverse_file = rev
+    def __init__(self, fwd, rev, parser="block", prefetch=False,
+                 readahead_blocks=READAHEAD_BLOCKS):
+        kwargs = {"prefetch": prefetch, "readahead_blocks": readahead_blocks}
+        self.forward_file = open_input(fwd, **kwargs)
+        self.reverse_file = _open_optional_input(rev, **kwargs)
+        self._parse = fastq_parsers[parser]
 
-    def demultiplex(self, assigner, writer):
-        fwds = (FastqRead(x) for x in parse_fastq(self.forward_file))
-        revs = (FastqRead(x) for x in parse_fastq(self.reverse_file))
+    def demultiplex(self, assigner, writer, processes=1,
+                    chunk_size=CHUNK_SIZE, profiler=None, progress=None,
+                    checkpoint=None):
+        files = [self.forward_file, self.reverse_file]
+        if checkpoint is not None and checkpoint.start_reads:
+            for f in files:
+                skip_records(f, checkpoint.start_reads)
+        if processes > 1:
+            return demultiplex_parallel(
+                files, self._get_barcode, self._parse, assigner, writer,
+                processes, chunk_size, profiler, progress, checkpoint)
+        if _demultiplex_in_chunks(
+                self._parse, writer, profiler, progress, checkpoint):
+            return demultiplex_raw(
+                files, self._chunk_barcodes, assigner, writer)
+        fwds = self._parse(self.forward_file)
+        revs = self._parse(self.reverse_file)
+        if profiler or progress or checkpoint:
+            return demultiplex_instrumented(
+                zip(fwds, revs), self._get_barcode, assigner, writer,
+                profiler, progress, checkpoint)
         for fwd, rev in zip(fwds, revs):
             barcode_seq = self._parse_barcode(fwd.desc)
             sample = assigner.assign(barcode_seq)
             writer.write((fwd, rev), sample)
         return assigner.read_counts
 
+    def iter_batches(self, assigner, **kwargs):
+        """Yield (sample, reads) batches; see stream.demultiplex_batches."""
+        records = zip(
+            self._parse(self.forward_file), self._parse(self.reverse_file))
+        return demultiplex_batches(
+            records, self._get_barcode, assigner, **kwargs)
+
+    def count(self, assigner, progress=None):
+        """Assign reads to samples without writing them.
+
+        Only the description lines of the forward reads are parsed; the
+        reverse reads file is never read.
+        """
+        reads = 0
+        for lines in fastq_line_blocks(self.forward_file):
+            assigner.assign_batch(
+                [self._parse_barcode(desc) for desc in fastq_descs(lines)])
+            reads += len(lines) // 4
+            if progress is not None:
+                progress.update(reads)
+        return assigner.read_counts
+
+    @staticmethod
+    def _get_barcode(fwd, rev):
+        return NoIndexFastqSequenceFile._parse_barcode(fwd.desc)
+
+    @staticmethod
+    def _chunk_barcodes(chunk):
+        parse_barcode = NoIndexFastqSequenceFile._parse_barcode
+        return [
+            parse_barcode(desc) for desc in fastq_descs(raw_lines(chunk[0]))]
+
     @staticmethod
     def _parse_barcode(desc):
         """Parse barcode sequence from description line.
@@ -58,6 +182,68 @@ class NoIndexFastqSequenceFile(object):
         return barcode_seq
 
 
+class InlineBarcodeFastqSequenceFile(NoIndexFastqSequenceFile):
+    """Illumina data, 2 file format, with the barcode inline at the
+    start of each forward read.
+
+    The barcode is cut from the forward read as it is assigned, and
+    the rest of the read is written out.
+    """
+    def __init__(self, fwd, rev, barcode_length, parser="block",
+                 prefetch=False, readahead_blocks=READAHEAD_BLOCKS):
+        if parser == "raw":
+            raise ValueError("Inline barcodes can not be cut from raw records")
+        super(InlineBarcodeFastqSequenceFile, self).__init__(
+            fwd, rev, parser=parser, prefetch=prefetch,
+            readahead_blocks=readahead_blocks)
+        self.barcode_length = barcode_length
+        # Used by the parallel, instrumented and streaming modes
+        self._get_barcode = functools.partial(
+            cut_inline_barcode, barcode_length)
+
+    def demultiplex(self, assigner, writer, processes=1,
+                    chunk_size=CHUNK_SIZE, profiler=None, progress=None,
+                    checkpoint=None):
+        if processes > 1 or profiler or progress or checkpoint:
+            return super(InlineBarcodeFastqSequenceFile, self).demultiplex(
+                assigner, writer, processes, chunk_size, profiler, progress,
+                checkpoint)
+        n = self.barcode_length
+        fwds = self._parse(self.forward_file)
+        revs = self._parse(self.reverse_file)
+        for fwd, rev in zip(fwds, revs):
+            seq = fwd.seq
+            sample = assigner.assign(seq[:n])
+            # Records are trimmed in place rather than copied
+            fwd.seq = seq[n:]
+            fwd.qual = fwd.qual[n:]
+            writer.write((fwd, rev), sample)
+        return assigner.read_counts
+
+    def count(self, assigner, progress=None):
+        """Assign reads to samples without writing them.
+
+        Only the sequences of the forward reads are parsed; the reverse
+        reads file is never read.
+        """
+        n = self.barcode_length
+        reads = 0
+        for lines in fastq_line_blocks(self.forward_file):
+            assigner.assign_batch([seq[:n] for seq in lines[1::4]])
+            reads += len(lines) // 4
+            if progress is not None:
+                progress.update(reads)
+        return assigner.read_counts
+
+
+def cut_inline_barcode(barcode_length, fwd, rev):
+    """Cut the barcode from the start of a forward read and return it."""
+    seq = fwd.seq
+    fwd.seq = seq[barcode_length:]
+    fwd.qual = fwd.qual[barcode_length:]
+    return seq[:barcode_length]
+
+
 class FastqRead(object):
     def __init__(self, read):
         self.desc, self.seq, self.qual = read
@@ -76,3 +262,548 @@ def parse_fastq(f):
         seq = seq.rstrip()
         qual = qual.rstrip()
         yield desc, seq, qual
+
+
+class FastqRecord(object):
+    """Compact FASTQ record produced by the block parser."""
+    __slots__ = ("desc", "seq", "qual")
+
+    def __init__(self, desc, seq, qual):
+        self.desc = desc
+        self.seq = seq
+        self.qual = qual
+
+
+def fastq_line_blocks(f, block_size=BLOCK_SIZE):
+    """Read the lines of whole FASTQ records in large blocks.
+
+    The input may be opened in text or binary mode.  Record boundaries
+    are found for a whole block at once, and any partial record at the
+    end of a block is carried over to the next one.  Each list of lines
+    yielded holds a whole number of records, four lines per record.
+    """
+    leftover = ""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        if isinstance(block, bytes):
+            block = block.decode("ascii")
+        if "\r" in block:
+            block = block.replace("\r", "")
+        lines = (leftover + block).split("\n")
+        n = (len(lines) - 1) // 4 * 4
+        leftover = "\n".join(lines[n:])
+        if n:
+            del lines[n:]
+            yield lines
+
+    # The last record may lack a final newline
+    if leftover.strip():
+        lines = leftover.rstrip("\n").split("\n")
+        if len(lines) != 4:
+            raise ValueError("Incomplete FASTQ record: %r" % leftover)
+        yield lines
+
+
+def fastq_descs(lines):
+    # Strip the leading "@" from all description lines at once
+    return "\n".join(lines[0::4])[1:].replace("\n@", "\n").split("\n")
+
+
+def parse_fastq_blocks(f, block_size=BLOCK_SIZE):
+    """Parse FASTQ records from large blocks of input."""
+    for lines in fastq_line_blocks(f, block_size):
+        for record in map(
+                FastqRecord, fastq_descs(lines), lines[1::4], lines[3::4]):
+            yield record
+
+
+class RawFastqRecord(object):
+    """FASTQ record kept as a view into the block it was read from.
+
+    The original bytes of the record are available as a memoryview in
+    `raw`.  Fields are decoded only when they are accessed.
+    """
+    __slots__ = ("_view", "_start", "_end")
+
+    def __init__(self, view, start, end):
+        self._view = view
+        self._start = start
+        self._end = end
+
+    def __reduce__(self):
+        # Only the bytes of the record are sent to other processes
+        return (_raw_record_from_bytes, (bytes(self.raw),))
+
+    @property
+    def raw(self):
+        return self._view[self._start:self._end]
+
+    def _field(self, n):
+        line = bytes(self.raw).split(b"\n")[n]
+        return line.rstrip(b"\r").decode("ascii")
+
+    @property
+    def desc(self):
+        return self._field(0)[1:]
+
+    @property
+    def seq(self):
+        return self._field(1)
+
+    @property
+    def qual(self):
+        return self._field(3)
+
+
+def _raw_record_from_bytes(data):
+    return next(parse_fastq_raw(io.BytesIO(data)))
+
+
+def raw_record_blocks(f, block_size=BLOCK_SIZE):
+    """Read whole FASTQ records from binary input in large blocks.
+
+    Yields (block, ends) pairs, where ends holds the offset in the
+    block just past each record.  The records of a block are found all
+    at once, and any partial record at the end of a block is carried
+    over to the next one.
+    """
+    leftover = b""
+    eof = False
+    while not eof:
+        block = f.read(block_size)
+        if isinstance(block, str):
+            raise ValueError("Raw FASTQ parsing requires binary input")
+        if not block:
+            eof = True
+            if not leftover:
+                break
+            # The last record may lack a final newline
+            block = b"" if leftover.endswith(b"\n") else b"\n"
+        block = leftover + block
+        ends = _record_ends(block)
+        end = int(ends[-1]) if len(ends) else 0
+        leftover = block[end:]
+        if eof and leftover:
+            raise ValueError("Incomplete FASTQ record: %r" % leftover)
+        if len(leftover) > block_size + (1 << 16):
+            _malformed(leftover, 0)
+        if len(ends):
+            yield block, ends
+
+
+def _record_ends(block):
+    # End of each whole record in a block, checking that records start
+    # with "@" and have a "+" line.  With NumPy, the ends are found
+    # from the positions of all newlines at once.
+    if numpy is None:
+        return _record_ends_python(block)
+    a = numpy.frombuffer(block, dtype=numpy.uint8)
+    newlines = numpy.flatnonzero(a == 10)
+    n = len(newlines) // 4 * 4
+    ends = newlines[3:n:4] + 1
+    if not n:
+        return ends
+    starts = numpy.concatenate(([0], ends[:-1]))
+    bad = (a[starts] != 64) | (a[newlines[1:n:4] + 1] != 43)
+    if bad.any():
+        _malformed(block, int(starts[bad.argmax()]))
+    return ends
+
+
+def _record_ends_python(block):
+    ends = []
+    start = 0
+    find = block.find
+    while True:
+        newlines = []
+        pos = start
+        for _ in range(4):
+            pos = find(b"\n", pos) + 1
+            if not pos:
+                return ends
+            newlines.append(pos)
+        if block[start:start + 1] != b"@" or block[
+                newlines[1]:newlines[1] + 1] != b"+":
+            _malformed(block, start)
+        ends.append(pos)
+        start = pos
+
+
+def _malformed(block, start):
+    raise ValueError(
+        "Malformed FASTQ data near: %r" % block[start:start + 200])
+
+
+def parse_fastq_raw(f, block_size=BLOCK_SIZE):
+    """Parse FASTQ records without copying or decoding them.
+
+    Records are found in large blocks of binary input, and are yielded
+    as RawFastqRecord views into those blocks.
+    """
+    for block, ends in raw_record_blocks(f, block_size):
+        view = memoryview(block)
+        if numpy is not None:
+            ends = ends.tolist()
+        start = 0
+        for end in ends:
+            yield RawFastqRecord(view, start, end)
+            start = end
+
+
+def _demultiplex_in_chunks(parse, writer, profiler, progress, checkpoint):
+    # Raw records copied unchanged to the output need not be handled one
+    # at a time, unless each read must be seen
+    return (parse is parse_fastq_raw and numpy is not None
+            and getattr(writer, "raw_records", False)
+            and not (profiler or progress or checkpoint))
+
+
+def aligned_record_blocks(files, block_size=BLOCK_SIZE):
+    """Read the records of several FASTQ files in matching chunks.
+
+    Each chunk is a list with a (block, starts, ends) tuple for every
+    file, holding the same number of records from each.  Reading stops
+    at the end of the shortest file.  Needs NumPy.
+    """
+    readers = [raw_record_blocks(f, block_size) for f in files]
+    pending = [None] * len(files)
+    while True:
+        for i, chunk in enumerate(pending):
+            if chunk is None or not len(chunk[2]):
+                block_ends = next(readers[i], None)
+                if block_ends is None:
+                    return
+                block, ends = block_ends
+                starts = numpy.concatenate(([0], ends[:-1]))
+                pending[i] = (block, starts, ends)
+        n = min(len(ends) for _, _, ends in pending)
+        yield [(block, starts[:n], ends[:n])
+               for block, starts, ends in pending]
+        pending = [(block, starts[n:], ends[n:])
+                   for block, starts, ends in pending]
+
+
+def raw_lines(chunk):
+    """Decoded lines of the records in a (block, starts, ends) chunk."""
+    block, starts, ends = chunk
+    data = block[int(starts[0]):int(ends[-1])].decode("ascii")
+    lines = data.replace("\r", "").split("\n")
+    lines.pop()
+    return lines
+
+
+def demultiplex_raw(files, get_barcodes, assigner, writer,
+                    block_size=BLOCK_SIZE):
+    """Demultiplex raw FASTQ records a chunk at a time.
+
+    The first two files hold the forward and reverse reads.  The
+    barcodes of a chunk, given by get_barcodes from the list of
+    (block, starts, ends) tuples, are assigned together.  The records
+    of a chunk are then put in sample order, and the bytes of each
+    sample are passed to the writer in one call.  Needs NumPy.
+    """
+    samples = list(assigner.samples) + [None]
+    for chunk in aligned_record_blocks(files, block_size):
+        idxs = assigner.assign_indexes(get_barcodes(chunk))
+        order = numpy.argsort(idxs, kind="stable")
+        bounds = numpy.concatenate(
+            ([0], numpy.cumsum(numpy.bincount(idxs, minlength=len(samples)))))
+        bounds = bounds.tolist()
+        records = [
+            _sorted_records(block, starts, ends, order)
+            for block, starts, ends in chunk[:2]]
+        for k, sample in enumerate(samples):
+            first, last = bounds[k], bounds[k + 1]
+            if first < last:
+                writer.write_formatted(
+                    [b"".join(r[first:last]) for r in records], sample)
+    return assigner.read_counts
+
+
+def _sorted_records(block, starts, ends, order):
+    # Views of the records of a block, in the given order
+    view = memoryview(block)
+    return [
+        view[start:end] for start, end
+        in zip(starts[order].tolist(), ends[order].tolist())]
+
+
+def _parse_fastq_lines(f):
+    if not isinstance(f, io.TextIOBase):
+        f = io.TextIOWrapper(f, encoding="ascii")
+    return (FastqRead(x) for x in parse_fastq(f))
+
+
+fastq_parsers = {
+    "line": _parse_fastq_lines,
+    "block": parse_fastq_blocks,
+    "raw": parse_fastq_raw,
+}
+
+
+def open_input(f, prefetch=False, readahead_blocks=READAHEAD_BLOCKS):
+    """Prepare an input stream for parsing.
+
+    Gzip input, including bgzip files made of many gzip members, is
+    detected from the first bytes of a binary stream.  The data is
+    decompressed in a background thread while the main thread parses
+    and assigns reads.  If prefetch is set, uncompressed binary input
+    is also read in a background thread.  Text streams are returned
+    unchanged.
+    """
+    if isinstance(f, io.TextIOBase):
+        return f
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f)
+    if f.peek(2)[:2] == GZIP_MAGIC:
+        f = gzip.GzipFile(fileobj=f, mode="rb")
+    elif not prefetch:
+        return f
+    return io.BufferedReader(
+        BackgroundReader(f, max_blocks=readahead_blocks), BLOCK_SIZE)
+
+
+def _open_optional_input(f, **kwargs):
+    # Files not needed to count reads may be left out
+    if f is None:
+        return None
+    return open_input(f, **kwargs)
+
+
+class BackgroundReader(io.RawIOBase):
+    """Read ahead from a file object in a background thread.
+
+    Blocks are passed to the reader through a bounded queue, so that
+    slow reads (e.g. decompression, which releases the GIL) overlap
+    with the work done by the consumer.
+    """
+    def __init__(self, f, block_size=BLOCK_SIZE, max_blocks=READAHEAD_BLOCKS):
+        super(BackgroundReader, self).__init__()
+        self._f = f
+        self._blocks = queue.Queue(max_blocks)
+        self._block = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._fill, args=(block_size,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self, block_size):
+        try:
+            while not self._stop.is_set():
+                block = self._f.read(block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._block:
+            if self._eof:
+                return 0
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._block = memoryview(item)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._f.close()
+        super(BackgroundReader, self).close()
+
+
+class FileRange(io.RawIOBase):
+    """Read the bytes of a binary file from start up to end.
+
+    Offsets for seek() and tell() are relative to start.  The file is
+    not closed with the range.
+    """
+    def __init__(self, f, start, end):
+        super(FileRange, self).__init__()
+        self._f = f
+        self.start = start
+        self.end = end
+        self._pos = start
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos - self.start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = self.start + offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.end + offset
+        else:
+            raise ValueError("Invalid whence: %s" % whence)
+        self._pos = min(max(pos, self.start), self.end)
+        return self._pos - self.start
+
+    def readinto(self, b):
+        n = min(len(b), self.end - self._pos)
+        if n <= 0:
+            return 0
+        self._f.seek(self._pos)
+        data = self._f.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def shard_ranges(files, shard, n_shards):
+    """Byte ranges of one shard of uncompressed FASTQ files.
+
+    The first file is cut into n_shards parts of about the same size,
+    each starting at a record boundary.  The other files are cut at
+    the records with the same read IDs, so that the reads stay paired.
+    Shards are numbered from 0.  Returns a (start, end) pair for each
+    file.
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError(
+            "Shard number must be from 0 to %s (got %s)" % (
+                n_shards - 1, shard))
+    sizes = []
+    for f in files:
+        f.seek(0)
+        if f.read(2) == GZIP_MAGIC:
+            raise ValueError("Sharding requires uncompressed input")
+        sizes.append(f.seek(0, io.SEEK_END))
+    starts = _shard_boundary(files, sizes, shard, n_shards)
+    ends = _shard_boundary(files, sizes, shard + 1, n_shards)
+    return list(zip(starts, ends))
+
+
+def open_shard(files, shard, n_shards):
+    """Open one shard of each file; see shard_ranges.
+
+    Files given as None, e.g. those not needed to count reads, are
+    left out.
+    """
+    present = [f for f in files if f is not None]
+    ranges = iter(shard_ranges(present, shard, n_shards))
+    shards = []
+    for f in files:
+        if f is None:
+            shards.append(None)
+        else:
+            start, end = next(ranges)
+            shards.append(
+                io.BufferedReader(FileRange(f, start, end), BLOCK_SIZE))
+    return shards
+
+
+def _shard_boundary(files, sizes, k, n_shards):
+    if k == 0:
+        return [0 for _ in files]
+    if k == n_shards:
+        return list(sizes)
+    f = files[0]
+    pos = find_record_start(f, sizes[0] * k // n_shards)
+    if pos >= sizes[0]:
+        return list(sizes)
+    f.seek(pos)
+    read_id = _read_id(f.readline())
+    boundary = [pos]
+    for f, size in zip(files[1:], sizes[1:]):
+        boundary.append(find_read(f, read_id, pos * size // sizes[0], size))
+    return boundary
+
+
+def find_record_start(f, pos):
+    """Offset of the first FASTQ record starting at or after pos.
+
+    A record is recognized by a line starting with "@", followed two
+    lines later by one starting with "+", with sequence and quality
+    lines of the same length.  A quality line may start with "@", but
+    is then followed by a sequence line, not a "+" line.  Returns the
+    end of the file if no whole record starts after pos.
+    """
+    if pos <= 0:
+        return 0
+    # Start from the line that includes the byte before pos
+    f.seek(pos - 1)
+    offset = pos - 1 + len(f.readline())
+    window = []
+    while True:
+        line = f.readline()
+        if not line:
+            return offset
+        window.append((offset, line))
+        offset += len(line)
+        if len(window) == 4:
+            if _is_record([x for _, x in window]):
+                return window[0][0]
+            del window[0]
+
+
+def _is_record(lines):
+    desc, seq, plus, qual = lines
+    return (
+        desc.startswith(b"@") and plus.startswith(b"+") and
+        len(seq.rstrip(b"\r\n")) == len(qual.rstrip(b"\r\n")))
+
+
+def _read_id(desc):
+    # Read IDs end at the first space, and may end in /1 or /2
+    read_id = desc[1:].split(None, 1)[0]
+    if read_id[-2:-1] == b"/":
+        read_id = read_id[:-2]
+    return read_id
+
+
+def find_read(f, read_id, estimate, size):
+    """Offset of the record with the given read ID.
+
+    The search starts near the estimated offset, and is widened until
+    the whole file has been searched.
+    """
+    window = 1 << 16
+    while True:
+        lo = max(estimate - window, 0)
+        hi = min(estimate + window, size)
+        pos = find_record_start(f, lo)
+        f.seek(pos)
+        while pos <= hi:
+            desc = f.readline()
+            if not desc:
+                break
+            if _read_id(desc) == read_id:
+                return pos
+            pos += len(desc) + sum(len(f.readline()) for _ in range(3))
+        if lo == 0 and hi == size:
+            raise ValueError(
+                "Read %s not found in %s" % (
+                    read_id.decode("ascii"), getattr(f, "name", "input")))
+        window *= 4
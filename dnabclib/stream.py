@@ -0,0 +1,57 @@
+"""Demultiplexing as a stream of per-sample batches.
+
+Instead of writing reads to files, demultiplex_batches yields
+(sample, reads) pairs, so that assigned reads can be passed straight
+to another program.  The file writers can consume the same stream.
+"""
+import collections
+
+# Number of reads collected for a sample before its batch is yielded
+BATCH_SIZE = 1000
+
+# Limit on the number of reads held in batches for all samples together
+MAX_BUFFERED_READS = 100000
+
+
+def demultiplex_batches(records, get_barcode, assigner,
+                        batch_size=BATCH_SIZE,
+                        max_buffered_reads=MAX_BUFFERED_READS,
+                        include_unassigned=False):
+    """Assign reads to samples, yielding batches of reads per sample.
+
+    Records are tuples of reads; the first two are kept in the batch,
+    and get_barcode returns the barcode sequence for each tuple.  A
+    batch is yielded when it holds batch_size reads.  If the batches
+    for all samples together hold max_buffered_reads reads, the largest
+    batches are yielded until half of that number is free.  Within a
+    sample, reads come out in the same order as in the input.
+
+    Unassigned reads are yielded with a sample of None if
+    include_unassigned is set, and are dropped otherwise.
+    """
+    batches = collections.OrderedDict()
+    buffered = 0
+    for rec in records:
+        sample = assigner.assign(get_barcode(*rec))
+        if sample is None and not include_unassigned:
+            continue
+        batch = batches.get(sample)
+        if batch is None:
+            batch = batches[sample] = []
+        batch.append(rec[:2])
+        buffered += 1
+        if len(batch) >= batch_size:
+            del batches[sample]
+            buffered -= len(batch)
+            yield sample, batch
+        elif buffered >= max_buffered_reads:
+            by_size = sorted(batches, key=lambda s: len(batches[s]),
+                             reverse=True)
+            for s in by_size:
+                if buffered < max_buffered_reads // 2:
+                    break
+                batch = batches.pop(s)
+                buffered -= len(batch)
+                yield s, batch
+    for sample, batch in batches.items():
+        yield sample, batch
@@ -0,0 +1,220 @@
+"""Barcode lookup tables, and an on-disk cache for them.
+
+Building a lookup table with mismatches means generating and checking
+every error barcode, which is slow for large sample sheets.  A built
+table can be saved as one compact file: a header, then the 2-bit keys
+of the sequences in sorted order, then an array with the index of the
+barcode each sequence belongs to.  The few sequences that can not be
+packed into a key are kept in the header.
+
+A saved table is memory-mapped, and the arrays are used in place, so
+loading reads only the header.  Sequences are found with
+numpy.searchsorted, and a chunk of reads is looked up with the mapped
+arrays directly.  Only the header is checked against its checksum;
+the barcodes themselves are then looked up, as a check of the data.
+
+The file name is a hash of the barcodes, their labels, and the number
+of mismatches.  Barcodes are given in the orientation used for lookup,
+so the hash also covers orientation.
+
+NumPy is needed to save and load tables.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from .twobit import EncodedTable, encode, encode_seq, numpy
+
+CACHE_VERSION = 2
+
+CACHE_MAGIC = b"DNABCTBL"
+
+# Magic, version, header length, header checksum
+_PREFIX = struct.Struct("<8sIII")
+
+# Arrays are aligned to this many bytes in the file
+_ALIGNMENT = 8
+
+if numpy is not None:
+    _KEY_DTYPE = numpy.dtype("<u8")
+    _INDEX_DTYPE = numpy.dtype("<u4")
+
+# Number of sequences not in a memory-mapped table that are remembered
+MAX_REMEMBERED_MISSES = 100000
+
+
+class BarcodeTable(dict):
+    """Lookup table of barcode sequences.
+
+    Looking up a missing sequence with table[seq] gives None.
+    """
+    def __missing__(self, seq):
+        return None
+
+    def encoded(self, values):
+        """EncodedTable giving the position of each value in a list."""
+        indexes = dict((id(v), k) for k, v in enumerate(values))
+        return EncodedTable(
+            ((seq, indexes[id(v)]) for seq, v in self.items()),
+            len(values))
+
+
+class MappedBarcodeTable(BarcodeTable):
+    """Lookup table saved by save_table, searched in a memory map.
+
+    Raises ValueError if the file does not have a valid header for
+    the same key and items.
+    """
+    def __init__(self, fp, key, items):
+        super(MappedBarcodeTable, self).__init__()
+        self.fp = fp
+        self.key = key
+        self.table_items = items
+        self._values = [value for _, value, _ in items]
+        self._misses = 0
+        with open(fp, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+            found = self._find([bc for bc, _, _ in items]).tolist()
+            for (bc, value, _), index in zip(items, found):
+                if index < 0 or self._values[index] is not value:
+                    raise ValueError("wrong value for %s" % bc)
+        except (ValueError, KeyError, struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise ValueError("Invalid table file %s: %s" % (fp, e))
+
+    def __reduce__(self):
+        # Other processes map the file again
+        return (MappedBarcodeTable, (self.fp, self.key, self.table_items))
+
+    def close(self):
+        # Arrays must be released before the map is closed
+        self._keys = self._indexes = None
+        self._mm.close()
+
+    def _read_header(self):
+        mm = self._mm
+        magic, version, header_size, header_crc32 = _PREFIX.unpack(
+            mm[:_PREFIX.size])
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError("unknown format")
+        pos = _PREFIX.size
+        header_data = mm[pos:pos + header_size]
+        if zlib.crc32(header_data) != header_crc32:
+            raise ValueError("wrong header checksum")
+        header = json.loads(header_data.decode("ascii"))
+        if header["key"] != self.key:
+            raise ValueError("wrong key")
+        pos += header_size
+        count = header["count"]
+        index_pos = pos + count * _KEY_DTYPE.itemsize
+        if len(mm) != index_pos + count * _INDEX_DTYPE.itemsize:
+            raise ValueError("wrong size")
+        self._other = header["other"]
+        self._keys = numpy.frombuffer(
+            mm, dtype=_KEY_DTYPE, count=count, offset=pos)
+        self._indexes = numpy.frombuffer(
+            mm, dtype=_INDEX_DTYPE, count=count, offset=index_pos)
+
+    def _find(self, seqs):
+        # Position in the items of the value for each sequence, or -1
+        keys = encode(seqs)
+        result = numpy.full(len(seqs), -1, dtype=numpy.int64)
+        if len(self._keys):
+            pos = numpy.searchsorted(self._keys, keys)
+            pos = numpy.minimum(pos, len(self._keys) - 1)
+            found = self._keys[pos] == keys
+            result[found] = self._indexes[pos[found]]
+        if self._other:
+            for i in numpy.flatnonzero(keys == 0).tolist():
+                result[i] = self._other.get(seqs[i], -1)
+        return result
+
+    def _find_one(self, seq):
+        key = encode_seq(seq)
+        if not key:
+            return self._other.get(seq, -1)
+        pos = int(self._keys.searchsorted(numpy.uint64(key)))
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return int(self._indexes[pos])
+        return -1
+
+    def __missing__(self, seq):
+        index = self._find_one(seq)
+        value = self._values[index] if index >= 0 else None
+        if value is not None:
+            self[seq] = value
+        elif self._misses < MAX_REMEMBERED_MISSES:
+            self[seq] = None
+            self._misses += 1
+        return value
+
+    def get(self, seq, default=None):
+        value = self[seq]
+        return default if value is None else value
+
+    def encoded(self, values):
+        indexes = dict((id(v), k) for k, v in enumerate(values))
+        # Position in values of each item's value
+        remap = numpy.array(
+            [indexes[id(v)] for v in self._values], dtype=numpy.intp)
+        other = dict(
+            (seq, remap[index]) for seq, index in self._other.items())
+        return EncodedTable.from_sorted_keys(
+            self._keys, remap.take(self._indexes), other, len(values))
+
+
+def cache_key(items, mismatches):
+    h = hashlib.sha256()
+    h.update(json.dumps([
+        CACHE_VERSION, mismatches,
+        [(bc, label) for bc, _, label in items]]).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_fp(cache_dir, key):
+    return os.path.join(cache_dir, "%s.dnabc-table" % key)
+
+
+def save_table(fp, key, table, items):
+    """Save a lookup table built from the given items."""
+    indexes = dict((id(value), n) for n, (_, value, _) in enumerate(items))
+    seqs = list(table)
+    keys = encode(seqs)
+    values = numpy.array(
+        [indexes[id(table[seq])] for seq in seqs], dtype=_INDEX_DTYPE)
+    other = dict(
+        (seqs[i], int(values[i])) for i in numpy.flatnonzero(keys == 0))
+    encoded = keys != 0
+    keys = keys[encoded]
+    values = values[encoded]
+    order = numpy.argsort(keys)
+    header = json.dumps({
+        "key": key,
+        "count": len(keys),
+        "other": other,
+        }).encode("ascii")
+    # Pad the header so that the arrays are aligned
+    header += b" " * (-(_PREFIX.size + len(header)) % _ALIGNMENT)
+
+    # Replace any old file only once the new one is complete
+    tmp_fp = "%s.%s.tmp" % (fp, os.getpid())
+    with open(tmp_fp, "wb") as f:
+        f.write(_PREFIX.pack(
+            CACHE_MAGIC, CACHE_VERSION, len(header), zlib.crc32(header)))
+        f.write(header)
+        f.write(keys[order].astype(_KEY_DTYPE).tobytes())
+        f.write(values[order].tobytes())
+    os.replace(tmp_fp, fp)
+
+
+def load_table(fp, key, items):
+    """Map a saved lookup table, or return None if it is not valid."""
+    try:
+        return MappedBarcodeTable(fp, key, items)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,153 @@
+"""Barcode lookup for whole chunks of reads, using 2-bit integer keys.
+
+Each base of a sequence is packed into two bits, below a leading 1 bit
+that marks the length, so a sequence of up to 31 bases becomes one
+64-bit key.  A lookup table is kept as a sorted array of keys, which
+is searched for a whole chunk of reads at once.  For short barcodes,
+the table is instead an array indexed directly by key.
+
+NumPy is needed for this module; numpy is None if it is not installed.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Longest sequence that fits in a key
+MAX_LENGTH = 31
+
+# Largest array used for direct lookup by key; enough for barcodes of
+# up to 10 bases
+MAX_DIRECT_KEYS = 1 << 22
+
+if numpy is not None:
+    # Code of each ASCII character, with 255 for anything but ACGT
+    _BASE_CODES = numpy.full(256, 255, dtype=numpy.uint8)
+    for _code, _base in enumerate(b"ACGT"):
+        _BASE_CODES[_base] = _code
+
+
+def encode(seqs):
+    """Pack a list of sequences into an array of 2-bit keys.
+
+    Sequences with other bases than A, C, G and T, or longer than
+    MAX_LENGTH, get a key of 0.
+    """
+    if not seqs:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    # Usually all sequences have the same length, which is seen from
+    # the positions of the separators
+    length = len(seqs[0])
+    data = numpy.frombuffer(
+        "\n".join(seqs).encode("ascii", "replace"), dtype=numpy.uint8)
+    if (len(data) == len(seqs) * (length + 1) - 1 and
+            (data[length::length + 1] == 10).all()):
+        if not 0 < length <= MAX_LENGTH:
+            return numpy.zeros(len(seqs), dtype=numpy.uint64)
+        data = numpy.append(data, numpy.uint8(10))
+        return _encode_rows(data.reshape(len(seqs), length + 1)[:, :length])
+
+    keys = numpy.zeros(len(seqs), dtype=numpy.uint64)
+    lengths = numpy.fromiter(map(len, seqs), dtype=numpy.int64,
+                             count=len(seqs))
+    for length in numpy.unique(lengths):
+        if 0 < length <= MAX_LENGTH:
+            rows = numpy.flatnonzero(lengths == length)
+            data = numpy.frombuffer(
+                "".join([seqs[i] for i in rows]).encode("ascii", "replace"),
+                dtype=numpy.uint8)
+            keys[rows] = _encode_rows(data.reshape(len(rows), length))
+    return keys
+
+
+def encode_seq(seq):
+    """Key of one sequence, without NumPy, or 0 if it can not be encoded."""
+    if not 0 < len(seq) <= MAX_LENGTH or not _BASES.issuperset(seq):
+        return 0
+    return int(seq.translate(_BASE_DIGITS), 4) | 1 << 2 * len(seq)
+
+
+_BASES = frozenset("ACGT")
+
+_BASE_DIGITS = str.maketrans("ACGT", "0123")
+
+
+def _encode_rows(data):
+    # Encode the sequence in each row of a 2-d array of ASCII codes
+    keys = numpy.ones(len(data), dtype=numpy.uint64)
+    invalid = numpy.zeros(len(data), dtype=bool)
+    two = numpy.uint64(2)
+    for column in data.T:
+        codes = _BASE_CODES.take(column)
+        invalid |= codes > 3
+        keys <<= two
+        keys |= codes
+    keys[invalid] = 0
+    return keys
+
+
+class EncodedTable(object):
+    """Barcode lookup table searched for many sequences at once.
+
+    Items are (sequence, index) pairs.  Looking up a list of sequences
+    gives an array with the index for each, or missing for sequences
+    not in the table.  Sequences that can not be encoded are kept in
+    a dict and looked up one by one.
+    """
+    def __init__(self, items, missing):
+        seqs = []
+        indexes = []
+        for seq, index in items:
+            seqs.append(seq)
+            indexes.append(index)
+        keys = encode(seqs)
+        encoded = keys != 0
+        indexes = numpy.array(indexes, dtype=numpy.intp)
+        other = dict(
+            (seqs[i], indexes[i]) for i in numpy.flatnonzero(~encoded))
+        keys = keys[encoded]
+        indexes = indexes[encoded]
+        order = numpy.argsort(keys)
+        self._set_keys(keys[order], indexes[order], other, missing)
+
+    @classmethod
+    def from_sorted_keys(cls, keys, indexes, other, missing):
+        """Table from a sorted array of keys and the index for each.
+
+        Sequences that can not be encoded are given in the dict other.
+        The arrays are used as they are, so they may be memory-mapped.
+        """
+        table = cls.__new__(cls)
+        table._set_keys(keys, indexes, other, missing)
+        return table
+
+    def _set_keys(self, keys, indexes, other, missing):
+        self.other = other
+        self.missing = missing
+        n_direct = int(keys[-1]) + 2 if len(keys) else 1
+        if n_direct <= MAX_DIRECT_KEYS:
+            # The last entry is for all keys too large to be in the table
+            self.direct = numpy.full(n_direct, missing, dtype=numpy.int32)
+            self.direct[keys] = indexes
+        else:
+            self.direct = None
+            self.keys = keys
+            self.indexes = indexes
+
+    def lookup(self, seqs):
+        keys = encode(seqs)
+        if self.direct is not None:
+            keys = numpy.minimum(keys, len(self.direct) - 1)
+            # Key 0 is never in the table
+            result = self.direct.take(keys.astype(numpy.intp))
+        else:
+            result = numpy.full(len(seqs), self.missing, dtype=numpy.int32)
+            pos = numpy.searchsorted(self.keys, keys)
+            pos[pos == len(self.keys)] = 0
+            found = self.keys[pos] == keys
+            result[found] = self.indexes[pos[found]]
+        if self.other:
+            other = numpy.flatnonzero(keys == 0).tolist()
+            result[other] = [
+                self.other.get(seqs[i], self.missing) for i in other]
+        return result
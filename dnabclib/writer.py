@@ -1,6 +1,47 @@
+import collections
+import concurrent.futures
+import gzip
 import os.path
+import queue
+import threading
+
+from .readstats import ReadStats, numpy
+from .sample import Sample
+
+# Amount of uncompressed data collected before a block is handed to the
+# compression pool
+COMPRESS_BLOCK_SIZE = 1 << 20
+
+# Smallest compression block used when many files are open; blocks
+# smaller than the 32 KiB gzip window compress poorly
+MIN_COMPRESS_BLOCK_SIZE = 1 << 15
+
+# Maximum number of blocks per file waiting to be compressed
+MAX_PENDING_BLOCKS = 4
+
+# Amount of formatted output collected for a sample before it is
+# written to the sample's file
+BUFFER_SIZE = 1 << 16
+
+# Limit on the output collected for all samples together
+MAX_BUFFER_MEMORY = 1 << 28
+
+# Limit on the number of output files open at the same time
+MAX_OPEN_FILES = 512
+
+# Number of batches waiting for each writer thread
+WRITE_QUEUE_SIZE = 8
+
+# Stands in for the sample of unassigned reads.  No real sample can be
+# called "unassigned".
+UNASSIGNED = Sample("unassigned", None)
+
+compressions = {
+    None: "",
+    "gzip": ".gz",
+}
+
 
- 
 def _get_sample_fp(self, sample):
     fn = "PCMP%s%s" % (sample.name, self.ext)
     return os.path.join(self.output_dir, fn)
@@ -15,73 +56,559 @@ def _get_sample_paired_fp(self, sample):
 
 
 class _SequenceWriter(object):
-    """Base class for writers"""
+    """Base class for writers
+
+    Formatted reads are collected in a batch for each sample, and a
+    batch is written out in one call when it grows past buffer_size.
+    If the batches for all samples together grow past
+    max_buffer_memory, the largest batches are written out first until
+    half of that memory is free.
+
+    With gzip compression, every open file also holds a block being
+    filled and up to MAX_PENDING_BLOCKS blocks being compressed.  The
+    block size is chosen so that these buffers take at most half of
+    max_buffer_memory when max_open_files files are open, and the
+    limit on the batches is lowered by the same amount.
 
-    def __init__(self, output_dir):
+    If write_unassigned is set, reads without a sample are written to
+    the output files of a sample named "unassigned".
+
+    At most max_open_files output files are kept open.  When the limit
+    is reached, the files of the least recently written sample are
+    closed, and are later reopened in append mode if needed.
+
+    If write_threads is given, batches are written and files closed by
+    that many threads, so the caller does not wait on the disk.  All
+    files of a sample are handled by the same thread, in order.  Each
+    thread has a queue of at most write_queue_size batches.
+
+    If read_stats is set, read lengths and qualities are counted for
+    each output file as its batches are written.  Only reads that are
+    written out are counted.
+
+    Reads can also be formatted elsewhere, such as in a worker
+    process, with the class method format_batch, and the data is then
+    added with write_formatted.
+    """
+    _files_per_sample = 1
+
+    # Whether write_formatted takes the original bytes of raw records
+    raw_records = False
+
+    def __init__(self, output_dir, compression=None, compression_level=6,
+                 compression_threads=None, buffer_size=BUFFER_SIZE,
+                 max_buffer_memory=MAX_BUFFER_MEMORY,
+                 max_open_files=MAX_OPEN_FILES, write_unassigned=False,
+                 write_threads=0, write_queue_size=WRITE_QUEUE_SIZE,
+                 read_stats=False):
         self.output_dir = output_dir
-        self._open_files = {}
+        self.write_unassigned = write_unassigned
+        self._open_files = collections.OrderedDict()
+        self._max_open_samples = max(
+            1, max_open_files // self._files_per_sample)
+        self._opened_samples = set()
+        self.handle_stats = {"opens": 0, "reopens": 0, "evictions": 0}
+        if compression not in compressions:
+            raise ValueError("Unknown compression: %s" % compression)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.ext = self.ext + compressions[compression]
+        if compression is None:
+            self._pool = None
+            self._compress_block_size = None
+            gzip_memory = 0
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                compression_threads)
+            max_files = self._max_open_samples * self._files_per_sample
+            blocks = max_files * (MAX_PENDING_BLOCKS + 1)
+            self._compress_block_size = max(
+                MIN_COMPRESS_BLOCK_SIZE,
+                min(COMPRESS_BLOCK_SIZE, max_buffer_memory // 2 // blocks))
+            gzip_memory = self._compress_block_size * blocks
+        self.buffer_size = buffer_size
+        self.max_buffer_memory = max_buffer_memory
+        # Limit on the batches, after the gzip buffers are counted
+        self._batch_memory = max(
+            max_buffer_memory // 2, max_buffer_memory - gzip_memory)
+        self._batches = {}
+        self._batch_sizes = {}
+        self._buffered = 0
+        self.flush_stats = {
+            "threshold_flushes": 0,
+            "memory_cap_flushes": 0,
+            "final_flushes": 0,
+            "checkpoint_flushes": 0,
+            "bytes_written": 0,
+            }
+        self._write_threads = [
+            _WriteThread(write_queue_size) for _ in range(write_threads)]
+        self._sample_threads = {}
+        if read_stats and numpy is None:
+            raise ValueError("NumPy is required for read statistics")
+        # Statistics for each output file, keyed by sample name
+        self.read_stats = {} if read_stats else None
 
     def set_sff_header(self, header):
         pass
 
     def _get_output_file(self, sample):
         f = self._open_files.get(sample)
-        if f is None:
-            fp = self._get_output_fp(sample)
+        if f is not None:
+            self._open_files.move_to_end(sample)
+            return f
+
+        if len(self._open_files) >= self._max_open_samples:
+            lru_sample, lru_file = self._open_files.popitem(last=False)
+            self._run(lru_sample, self._close_file, lru_file)
+            self.handle_stats["evictions"] += 1
+
+        fp = self._get_output_fp(sample)
+        if sample in self._opened_samples:
+            f = self._open_filepath(fp, append=True)
+            self.handle_stats["reopens"] += 1
+        else:
             f = self._open_filepath(fp)
-            self._open_files[sample] = f
+            self._opened_samples.add(sample)
+            self.handle_stats["opens"] += 1
+        self._open_files[sample] = f
         return f
 
-    def _open_filepath(self, fp):
-        return open(fp, "w")
+    def _open_filepath(self, fp, append=False):
+        mode = "a" if append else "w"
+        if self._pool is not None:
+            return ParallelGzipFile(
+                fp, self._pool, self.compression_level,
+                self._compress_block_size, mode=mode + "b")
+        return open(fp, mode)
 
     def write(self, read, sample):
-        if sample is not None:
-            f = self._get_output_file(sample)
-            self._write_to_file(f, read)
+        if sample is None and not self.write_unassigned:
+            return
+        data = self._format(read)
+        self._add(sample, data, self._data_size(data))
 
-    def close(self):
+    def write_batch(self, reads, sample):
+        """Write a batch of reads that all belong to one sample."""
+        if sample is None and not self.write_unassigned:
+            return
+        self.write_formatted(self.format_batch(reads), sample)
+
+    def write_formatted(self, data, sample):
+        """Write data given by format_batch for reads of one sample."""
+        if sample is None and not self.write_unassigned:
+            return
+        item = self._batch_item(data)
+        self._add(sample, item, self._data_size(item))
+
+    @classmethod
+    def format_batch(cls, reads):
+        """Formatted data of a batch of reads, for each output file."""
+        return cls._file_data([cls._format(read) for read in reads])
+
+    @staticmethod
+    def _batch_item(data):
+        # Batch entry holding the data for each output file
+        return data[0]
+
+    def _add(self, sample, item, size):
+        # Add an entry to the batch of a sample, and write out batches
+        # that are over the limits
+        if sample is None:
+            sample = UNASSIGNED
+        batch = self._batches.get(sample)
+        if batch is None:
+            self._batches[sample] = self._new_batch(item)
+            batch_size = size
+        else:
+            self._extend_batch(batch, item)
+            batch_size = self._batch_sizes[sample] + size
+        self._batch_sizes[sample] = batch_size
+        self._buffered += size
+        if batch_size >= self.buffer_size:
+            self._flush(sample, "threshold_flushes")
+        elif self._buffered >= self._batch_memory:
+            self._flush_largest()
+
+    @staticmethod
+    def _new_batch(item):
+        return [item]
+
+    @staticmethod
+    def _extend_batch(batch, item):
+        batch.append(item)
+
+    def consume(self, batches):
+        """Write all (sample, reads) batches from a demultiplexing stream."""
+        for sample, reads in batches:
+            self.write_batch(reads, sample)
+
+    def _data_size(self, data):
+        return len(data)
+
+    @staticmethod
+    def _file_data(batch):
+        # Data of a batch for each output file
+        return ["".join(batch)]
+
+    def _write_to_file(self, f, data):
+        f.write(data[0])
+
+    def _write_batch(self, sample, f, batch):
+        data = self._file_data(batch)
+        self._write_to_file(f, data)
+        if self.read_stats is not None:
+            self._add_read_stats(sample, data)
+
+    def _flush(self, sample, reason):
+        batch = self._batches.pop(sample)
+        size = self._batch_sizes.pop(sample)
+        self._buffered -= size
+        f = self._get_output_file(sample)
+        self._run(sample, self._write_batch, sample, f, batch)
+        self.flush_stats[reason] += 1
+        self.flush_stats["bytes_written"] += size
+
+    def _add_read_stats(self, sample, data):
+        stats = self.read_stats.get(sample.name)
+        if stats is None:
+            stats = self.read_stats[sample.name] = [
+                ReadStats(self._stats_quality)
+                for _ in range(self._files_per_sample)]
+        for s, d in zip(stats, data):
+            s.add(d)
+
+    def read_stats_summary(self):
+        """Read statistics for each output file, keyed by sample name."""
+        for t in self._write_threads:
+            t.wait()
+        return dict(
+            (name, [s.summary() for s in stats])
+            for name, stats in self.read_stats.items())
+
+    def restore_read_stats(self, summaries):
+        """Start counting from statistics given by read_stats_summary()."""
+        for name, file_summaries in summaries.items():
+            stats = self.read_stats[name] = []
+            for summary in file_summaries:
+                s = ReadStats(self._stats_quality)
+                s.add_summary(summary)
+                stats.append(s)
+
+    def _flush_largest(self):
+        by_size = sorted(
+            self._batch_sizes, key=self._batch_sizes.get, reverse=True)
+        for sample in by_size:
+            if self._buffered < self._batch_memory // 2:
+                break
+            self._flush(sample, "memory_cap_flushes")
+
+    def flush(self):
+        for sample in list(self._batches):
+            self._flush(sample, "final_flushes")
+
+    def checkpoint(self):
+        """Write out all data, returning the size of each output file.
+
+        Sizes are given as lists, keyed by sample name.  Every file
+        is complete on disk up to its size, so the output can later
+        be truncated back to this point with restore().
+        """
+        for sample in list(self._batches):
+            self._flush(sample, "checkpoint_flushes")
+        for t in self._write_threads:
+            t.wait()
         for f in self._open_files.values():
-            f.close()
+            self._sync_file(f)
+        return dict(
+            (sample.name, [os.path.getsize(fp) for fp in self._fps(sample)])
+            for sample in self._opened_samples)
+
+    def restore(self, sizes, samples):
+        """Truncate output files to sizes returned by checkpoint().
+
+        Later reads for these samples are appended to the files.
+        """
+        samples = dict((s.name, s) for s in samples)
+        samples[UNASSIGNED.name] = UNASSIGNED
+        for name, file_sizes in sizes.items():
+            sample = samples[name]
+            for fp, size in zip(self._fps(sample), file_sizes):
+                with open(fp, "ab") as f:
+                    f.truncate(size)
+            self._opened_samples.add(sample)
+
+    def _fps(self, sample):
+        fps = self._get_output_fp(sample)
+        if isinstance(fps, tuple):
+            return fps
+        return (fps,)
+
+    def close(self):
+        self.flush()
+        for sample, f in self._open_files.items():
+            self._run(sample, self._close_file, f)
+        for t in self._write_threads:
+            t.stop()
+        self._shutdown_pool()
+
+    def _run(self, sample, fn, *args):
+        if not self._write_threads:
+            return fn(*args)
+        t = self._sample_threads.get(sample)
+        if t is None:
+            # Samples are given to the threads in turn
+            n = len(self._sample_threads) % len(self._write_threads)
+            t = self._sample_threads[sample] = self._write_threads[n]
+        t.submit(fn, *args)
+
+    def _sync_file(self, f):
+        f.flush()
+
+    def _close_file(self, f):
+        f.close()
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class _WriteThread(object):
+    """Thread that makes write and close calls from a bounded queue.
+
+    If a call fails, later calls are skipped, and the error is raised
+    in the calling thread at the next submit, wait, or stop.
+    """
+    def __init__(self, max_queued=WRITE_QUEUE_SIZE):
+        self._queue = queue.Queue(max_queued)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    fn, args = item
+                    fn(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn, *args):
+        self._check()
+        self._queue.put((fn, args))
+
+    def wait(self):
+        self._queue.join()
+        self._check()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._check()
 
 
 class FastaWriter(_SequenceWriter):
     ext = ".fasta"
+    _stats_quality = False
     _get_output_fp = _get_sample_fp
 
-    def _write_to_file(self, f, read):
-        f.write(">%s\n%s\n" % (read.desc, read.seq))
+    @staticmethod
+    def _format(read):
+        return ">%s\n%s\n" % (read.desc, read.seq)
 
 
 class FastqWriter(_SequenceWriter):
     ext = ".fastq"
+    _stats_quality = True
     _get_output_fp = _get_sample_fp
 
-    def _open_filepath(self, fp):
-        return open(fp, "w")
-
-    def _write_to_file(self, f, read):
-        f.write("@%s\n%s\n+\n%s\n" % (read.desc, read.seq, read.qual))
+    @staticmethod
+    def _format(read):
+        return "@%s\n%s\n+\n%s\n" % (read.desc, read.seq, read.qual)
 
 
 class PairedFastqWriter(FastqWriter):
     _get_output_fp = _get_sample_paired_fp
+    _files_per_sample = 2
 
-    def _open_filepath(self, fps):
+    def _open_filepath(self, fps, append=False):
         fp1, fp2 = fps
-        f1 = super(PairedFastqWriter, self)._open_filepath(fp1)
-        f2 = super(PairedFastqWriter, self)._open_filepath(fp2)
+        f1 = super(PairedFastqWriter, self)._open_filepath(fp1, append)
+        f2 = super(PairedFastqWriter, self)._open_filepath(fp2, append)
         return (f1, f2)
-    
-    def _write_to_file(self, filepair, readpair):
-        f1, f2 = filepair
+
+    @staticmethod
+    def _format(readpair):
         r1, r2 = readpair
-        super(PairedFastqWriter, self)._write_to_file(f1, r1)
-        super(PairedFastqWriter, self)._write_to_file(f2, r2)
+        fmt = FastqWriter._format
+        return (fmt(r1), fmt(r2))
+
+    def _data_size(self, data):
+        return len(data[0]) + len(data[1])
+
+    @staticmethod
+    def _file_data(batch):
+        return [
+            "".join(d1 for d1, _ in batch),
+            "".join(d2 for _, d2 in batch)]
+
+    @staticmethod
+    def _batch_item(data):
+        return tuple(data)
+
+    def _write_to_file(self, filepair, data):
+        f1, f2 = filepair
+        f1.write(data[0])
+        f2.write(data[1])
+
+    def _close_file(self, filepair):
+        f1, f2 = filepair
+        f1.close()
+        f2.close()
+
+    def _sync_file(self, filepair):
+        f1, f2 = filepair
+        f1.flush()
+        f2.flush()
+
+
+def _open_binary_filepath(self, fp, append=False):
+    mode = "ab" if append else "wb"
+    if self._pool is not None:
+        return ParallelGzipFile(
+            fp, self._pool, self.compression_level,
+            self._compress_block_size, mode=mode)
+    return open(fp, mode)
 
-    def close(self):
-        for f1, f2 in self._open_files.values():
-            f1.close()
-            f2.close()
 
+class PassthroughFastqWriter(FastqWriter):
+    """Writes the original bytes of each FASTQ record.
 
+    Reads must come from the raw FASTQ parser.  Their bytes are copied
+    straight from the input buffers into one bytearray per sample, with
+    no decoding or formatting.
+    """
+    _open_filepath = _open_binary_filepath
+    raw_records = True
+
+    def write(self, read, sample):
+        if sample is None and not self.write_unassigned:
+            return
+        raw = read.raw
+        self._add(sample, raw, len(raw))
+
+    @classmethod
+    def format_batch(cls, reads):
+        return [b"".join([read.raw for read in reads])]
+
+    @staticmethod
+    def _new_batch(raw):
+        return bytearray(raw)
+
+    @staticmethod
+    def _extend_batch(batch, raw):
+        batch += raw
+
+    @staticmethod
+    def _file_data(batch):
+        return [batch]
+
+
+class PassthroughPairedFastqWriter(PairedFastqWriter):
+    """Writes the original bytes of each FASTQ record pair.
+
+    The bytes of many pairs can be added at once with write_formatted,
+    as the forward and reverse records joined together.
+    """
+    raw_records = True
+
+    def _open_filepath(self, fps, append=False):
+        fp1, fp2 = fps
+        return (
+            _open_binary_filepath(self, fp1, append),
+            _open_binary_filepath(self, fp2, append))
+
+    def write(self, readpair, sample):
+        self.write_formatted((readpair[0].raw, readpair[1].raw), sample)
+
+    @classmethod
+    def format_batch(cls, readpairs):
+        return [
+            b"".join([r1.raw for r1, _ in readpairs]),
+            b"".join([r2.raw for _, r2 in readpairs])]
+
+    @staticmethod
+    def _new_batch(data):
+        return [bytearray(data[0]), bytearray(data[1])]
+
+    @staticmethod
+    def _extend_batch(batch, data):
+        batch[0] += data[0]
+        batch[1] += data[1]
+
+    @staticmethod
+    def _file_data(batch):
+        return batch
+
+
+class ParallelGzipFile(object):
+    """Write-only gzip file with blocks compressed by a worker pool.
+
+    Data written to the file is collected into blocks, and each block
+    is compressed as a separate gzip member.  A series of concatenated
+    gzip members is itself a valid gzip file.  Compressed blocks are
+    written in the order they were submitted.
+    """
+    def __init__(self, fp, pool, level=6, block_size=COMPRESS_BLOCK_SIZE,
+                 mode="wb"):
+        self._f = open(fp, mode)
+        self._pool = pool
+        self.level = level
+        self.block_size = block_size
+        self._buf = []
+        self._buf_size = 0
+        self._pending = collections.deque()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        else:
+            # Copy, in case the caller reuses its buffer
+            data = bytes(data)
+        self._buf.append(data)
+        self._buf_size += len(data)
+        if self._buf_size >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        data = b"".join(self._buf)
+        self._buf = []
+        self._buf_size = 0
+        self._pending.append(
+            self._pool.submit(gzip.compress, data, self.level))
+        while self._pending and (
+                self._pending[0].done() or
+                len(self._pending) > MAX_PENDING_BLOCKS):
+            self._f.write(self._pending.popleft().result())
+
+    def flush(self):
+        if self._buf:
+            self._submit()
+        while self._pending:
+            self._f.write(self._pending.popleft().result())
+        self._f.flush()
+
+    def close(self):
+        self.flush()
+        self._f.close()
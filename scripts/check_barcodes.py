@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+from dnabclib.main import check_barcodes_main
+check_barcodes_main()
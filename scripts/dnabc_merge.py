@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+from dnabclib.merge import main
+main()
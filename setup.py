@@ -15,7 +15,10 @@ setup(
     packages=['dnabclib'],
     scripts=[
         'scripts/dnabc.py',
+        'scripts/dnabc_batch.py',
+        'scripts/dnabc_merge.py',
         'scripts/split_samplelanes.py',
         'scripts/make_index.py',
-        'scripts/get_sample_names.py'],
+        'scripts/get_sample_names.py',
+        'scripts/check_barcodes.py'],
     )
@@ -6,12 +6,14 @@ import tempfile
 import unittest
 
 from dnabclib.assigner import (
-    BarcodeAssigner, deambiguate, reverse_complement,
+    BarcodeAssigner, DualBarcodeAssigner, deambiguate, reverse_complement,
+    neighborhood_size,
     )
 
 
 MockRead = namedtuple("Read", "seq")
 MockSample = namedtuple("Sample", "name barcode")
+MockDualSample = namedtuple("Sample", "name barcode barcode2")
 
 
 class BarcodeAssignerTests(unittest.TestCase):
@@ -42,6 +44,152 @@ class BarcodeAssignerTests(unittest.TestCase):
         self.assertEqual(a.assign("GTCAAAT"), None)
         self.assertEqual(a.read_counts, {"Abc": 2, 'unassigned':1})
 
+    def test_two_mismatches(self):
+        s = MockSample("Abc", "ACCTGAC")
+        a = BarcodeAssigner([s], mismatches=2, revcomp=False)
+        self.assertEqual(a.assign("ACCTGAC"), s)
+        self.assertEqual(a.assign("ACCTGAA"), s)
+        self.assertEqual(a.assign("TCCTGAA"), s)
+        self.assertEqual(a.assign("TCCAGAA"), None)
+        self.assertEqual(len(a._barcodes), neighborhood_size(7, 2))
+
+    def test_error_barcodes_two_mismatches(self):
+        a = BarcodeAssigner([], mismatches=2)
+        obs = list(a._error_barcodes("ACGTA"))
+        self.assertEqual(len(obs), len(set(obs)))
+        self.assertEqual(len(obs), neighborhood_size(5, 2) - 1)
+
+    def test_mismatch_collision(self):
+        s1 = MockSample("S1", "AAAAAA")
+        s2 = MockSample("S2", "AAAATT")
+        # Distance 2 is fine for exact matches
+        BarcodeAssigner([s1, s2], mismatches=0)
+        # AAAAAT is within 1 mismatch of both
+        self.assertRaises(
+            ValueError, BarcodeAssigner, [s1, s2], mismatches=1)
+        # Collisions are found in either order
+        self.assertRaises(
+            ValueError, BarcodeAssigner, [s2, s1], mismatches=1)
+
+    def test_unassigned_barcodes(self):
+        s = MockSample("Abc", "ACCTGAC")
+        a = BarcodeAssigner([s], revcomp=False, unassigned_capacity=10)
+        for seq in ["ACCTGAC", "GGGGGGG", "GGGGGGG", "NNNNNNN"]:
+            a.assign(seq)
+        self.assertEqual(a.top_unassigned(1), [
+            {"barcode": "GGGGGGG", "count": 2, "max_error": 0}])
+
+        counts = a.reset_counts()
+        self.assertEqual(a.top_unassigned(5), [])
+        a.add_counts(counts)
+        a.add_counts(counts)
+        self.assertEqual(a.top_unassigned(5)[0]["count"], 4)
+
+    def test_unassigned_barcodes_off(self):
+        a = BarcodeAssigner([], revcomp=False)
+        a.assign("GGGGGGG")
+        self.assertEqual(a.top_unassigned(5), [])
+
+    def test_unsupported_mismatches(self):
+        self.assertRaises(ValueError, BarcodeAssigner, [], mismatches=3)
+
+    def test_max_table_size(self):
+        s = MockSample("Abc", "ACCTGAC")
+        self.assertRaises(
+            ValueError, BarcodeAssigner, [s], mismatches=2,
+            max_table_size=100)
+
+    def test_assign_batch(self):
+        s1 = MockSample("Abc", "ACCTGAC")
+        s2 = MockSample("Def", "TTNAAGG")
+        seqs = [
+            "ACCTGAC", "ACCTGAA", "TTNAAGG", "TTAAAGG", "GGGGGGG", "ACCTGA",
+            "ACCTGACA", "", "ACCNGAC", "ACCTGAC"]
+        a = BarcodeAssigner(
+            [s1, s2], mismatches=1, revcomp=False, unassigned_capacity=10)
+        b = BarcodeAssigner(
+            [s1, s2], mismatches=1, revcomp=False, unassigned_capacity=10)
+        self.assertEqual(
+            a.assign_batch(seqs), [b.assign(seq) for seq in seqs])
+        self.assertEqual(a.read_counts, b.read_counts)
+        self.assertEqual(a.read_counts, {"Abc": 3, "Def": 2, "unassigned": 5})
+        self.assertEqual(a.top_unassigned(10), b.top_unassigned(10))
+
+
+class DualBarcodeAssignerTests(unittest.TestCase):
+    def setUp(self):
+        # Combinatorial design: i7 and i5 indexes are reused
+        self.s1 = MockDualSample("S1", "AAAAAA", "CCCCCC")
+        self.s2 = MockDualSample("S2", "AAAAAA", "GGGGGG")
+        self.s3 = MockDualSample("S3", "TTTTTT", "GGGGGG")
+
+    def test_assign(self):
+        a = DualBarcodeAssigner(
+            [self.s1, self.s2, self.s3], revcomp=False)
+        self.assertEqual(a.assign("AAAAAACCCCCC"), self.s1)
+        self.assertEqual(a.assign("AAAAAAGGGGGG"), self.s2)
+        self.assertEqual(a.assign("TTTTTTGGGGGG"), self.s3)
+        self.assertEqual(a.assign("AAAAAACCCCCA"), None)
+        self.assertEqual(a.read_counts, {
+            "S1": 1, "S2": 1, "S3": 1, "unassigned": 1})
+
+    def test_per_index_mismatches(self):
+        a = DualBarcodeAssigner(
+            [self.s1, self.s2, self.s3], mismatches=(1, 0), revcomp=False)
+        self.assertEqual(a.assign("AAACAACCCCCC"), self.s1)
+        self.assertEqual(a.assign("AAAAAACCCACC"), None)
+
+    def test_per_index_options(self):
+        a = DualBarcodeAssigner([self.s1], mismatches=[1, 0], revcomp=False)
+        self.assertEqual(a.mismatches, (1, 0))
+        self.assertEqual(a.revcomp, (False, False))
+        self.assertRaises(
+            ValueError, DualBarcodeAssigner, [self.s1], mismatches=(0, 3))
+
+    def test_revcomp(self):
+        a = DualBarcodeAssigner([self.s1], revcomp=True)
+        self.assertEqual(a.assign("TTTTTTGGGGGG"), self.s1)
+
+    def test_index_hopping(self):
+        a = DualBarcodeAssigner(
+            [self.s1, self.s2, self.s3], mismatches=1, revcomp=False)
+        # Valid i7 for S3 with valid i5 for S1
+        self.assertEqual(a.assign("TTTTTTCCCCCC"), None)
+        self.assertEqual(a.assign("TTTATTCCCCCC"), None)
+        self.assertEqual(a.index_hopping, {"TTTTTT+CCCCCC": 2})
+        self.assertEqual(a.read_counts["unassigned"], 2)
+
+    def test_assign_batch(self):
+        a = DualBarcodeAssigner(
+            [self.s1, self.s2, self.s3], mismatches=1, revcomp=False)
+        seqs = [
+            "AAAAAACCCCCC", "AAAAAAGGGGGC", "TTTTTTGGGGGG", "TTTTTTCCCCCC",
+            "TTTATTCCCCCC", "AAAAAACCCCC", "NNNNNNNNNNNN"]
+        self.assertEqual(
+            a.assign_batch(seqs),
+            [self.s1, self.s2, self.s3, None, None, None, None])
+        self.assertEqual(a.index_hopping, {"TTTTTT+CCCCCC": 2})
+        self.assertEqual(a.read_counts, {
+            "S1": 1, "S2": 1, "S3": 1, "unassigned": 4})
+
+    def test_reset_and_add_counts(self):
+        a = DualBarcodeAssigner([self.s1, self.s3], revcomp=False)
+        a.assign("AAAAAACCCCCC")
+        a.assign("AAAAAAGGGGGG")
+        counts = a.reset_counts()
+        self.assertEqual(a.read_counts["S1"], 0)
+        self.assertEqual(a.index_hopping, {})
+        a.add_counts(counts)
+        a.add_counts(counts)
+        self.assertEqual(a.read_counts["S1"], 2)
+        self.assertEqual(a.index_hopping, {"AAAAAA+GGGGGG": 2})
+
+    def test_index_collision(self):
+        s4 = MockDualSample("S4", "AAAAAT", "CCCCCC")
+        self.assertRaises(
+            ValueError, DualBarcodeAssigner, [self.s1, s4], mismatches=1)
+        DualBarcodeAssigner([self.s1, s4], mismatches=(0, 1))
+
 
 class FunctionTests(unittest.TestCase):
     def test_deambiguate(self):
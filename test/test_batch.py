@@ -0,0 +1,85 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.batch import find_lane_files, main
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.temp_dir, "input")
+        os.mkdir(self.input_dir)
+        lane_barcodes = {1: ["ACGTACGT", "GGGGCGCT"], 2: ["AAGGAAGG"]}
+        for lane, barcodes in lane_barcodes.items():
+            for read in ["R1", "R2", "I1"]:
+                fp = os.path.join(
+                    self.input_dir,
+                    "Undetermined_S0_L%03d_%s_001.fastq.gz" % (lane, read))
+                with gzip.open(fp, "wt") as f:
+                    for n, bc in enumerate(barcodes):
+                        seq = bc if read == "I1" else "ACGT"
+                        f.write("@r%s\n%s\n+\n%s\n" % (n, seq, "#" * len(seq)))
+
+        self.sample_sheet_fp = os.path.join(self.temp_dir, "SampleSheet.csv")
+        with open(self.sample_sheet_fp, "w") as f:
+            f.write(
+                "FCID,Lane,SampleID,SampleRef,Index,Description\n"
+                "FC1,1,SampleA,,ACGT-ACGT,\n"
+                "FC1,2,SampleB,,CCTTCCTT,\n")
+        self.output_dir = os.path.join(self.temp_dir, "output")
+        self.summary_fp = os.path.join(self.temp_dir, "summary.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_main(self, lane_processes, **config):
+        config["lane_processes"] = lane_processes
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump(config, f)
+        main([
+            "--sample-sheet", self.sample_sheet_fp,
+            "--input-dir", self.input_dir,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            return json.load(f)
+
+    def test_main(self):
+        for lane_processes in [1, 2]:
+            res = self.run_main(lane_processes)
+            self.assertEqual(res["data"], {
+                "1": {"SampleA": 1, "unassigned": 1},
+                "2": {"SampleB": 1, "unassigned": 0},
+                })
+            self.assertEqual(
+                res["lanes"]["1"]["top_unassigned_barcodes"],
+                [{"barcode": "GGGGCGCT", "count": 1, "max_error": 0}])
+            fp = os.path.join(self.output_dir, "L002", "SampleB_R1.fastq")
+            with open(fp) as f:
+                self.assertEqual(f.read(), "@r0\nACGT\n+\n####\n")
+
+    def test_bad_mismatches(self):
+        # A mismatch count for each index needs dual-indexed samples
+        for lane_processes in [1, 2]:
+            self.assertRaises(
+                SystemExit, self.run_main, lane_processes,
+                barcode_mismatches=[1, 0])
+
+    def test_find_lane_files(self):
+        os.remove(os.path.join(
+            self.input_dir, "Undetermined_S0_L002_I1_001.fastq.gz"))
+        fwd_fp, rev_fp, idx_fp = find_lane_files(self.input_dir, "2")
+        self.assertTrue(fwd_fp.endswith("L002_R1_001.fastq.gz"))
+        self.assertIsNone(idx_fp)
+        self.assertRaises(ValueError, find_lane_files, self.input_dir, "3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.run_benchmarks import compare_results
+from benchmarks.synthetic import make_barcodes, write_dataset
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.sample import Sample
+from dnabclib.seqfile import parse_fastq_blocks
+
+
+class SyntheticDataTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_make_barcodes(self):
+        barcodes = make_barcodes(20, 6, random.Random(0))
+        self.assertEqual(len(set(barcodes)), 20)
+        for a, b in itertools.combinations(barcodes, 2):
+            self.assertTrue(sum(x != y for x, y in zip(a, b)) >= 3)
+
+    def test_write_dataset(self):
+        paths = write_dataset(
+            self.temp_dir, n_reads=50, n_samples=4, read_length=20,
+            error_rate=0, unassigned_fraction=0)
+        with open(paths["barcodes"]) as f:
+            samples = Sample.load(f)
+        a = BarcodeAssigner(samples, revcomp=True)
+        with open(paths["index"]) as f:
+            for r in parse_fastq_blocks(f):
+                a.assign(r.seq)
+        self.assertEqual(a.read_counts["unassigned"], 0)
+        self.assertEqual(sum(a.read_counts.values()), 50)
+
+    def test_reproducible(self):
+        d1 = os.path.join(self.temp_dir, "1")
+        d2 = os.path.join(self.temp_dir, "2")
+        os.mkdir(d1)
+        os.mkdir(d2)
+        p1 = write_dataset(d1, n_reads=10, index_reads=False, seed=3)
+        p2 = write_dataset(d2, n_reads=10, index_reads=False, seed=3)
+        for key in ["forward", "reverse", "barcodes"]:
+            with open(p1[key]) as f1, open(p2[key]) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+
+class CompareResultsTests(unittest.TestCase):
+    def test_compare_results(self):
+        baseline = {"results": [
+            {"stage": "parse", "variant": "block", "reads_per_sec": 100.0},
+            {"stage": "write", "variant": "plain", "reads_per_sec": 100.0},
+            ]}
+        results = [
+            {"stage": "parse", "variant": "block", "reads_per_sec": 90.0},
+            {"stage": "write", "variant": "plain", "reads_per_sec": 80.0},
+            {"stage": "write", "variant": "gzip", "reads_per_sec": 1.0},
+            ]
+        self.assertEqual(
+            compare_results(results, baseline, 0.15),
+            [("write", "plain", 100.0, 80.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+from io import StringIO
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.checkpoint import (
+    Checkpointer, load_checkpoint, restore_checkpoint, skip_records,
+    )
+from dnabclib.sample import Sample
+from dnabclib.seqfile import IndexFastqSequenceFile
+from dnabclib.writer import PairedFastqWriter
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedWriter(PairedFastqWriter):
+    """Fails after a number of reads, as if the run was killed."""
+    def __init__(self, output_dir, fail_after, **kwargs):
+        super(InterruptedWriter, self).__init__(output_dir, **kwargs)
+        self.fail_after = fail_after
+
+    def write(self, read, sample):
+        self.fail_after -= 1
+        if self.fail_after < 0:
+            raise Interrupted()
+        super(InterruptedWriter, self).write(read, sample)
+
+    def write_formatted(self, data, sample):
+        self.fail_after -= data[0].count("\n") // 4
+        if self.fail_after < 0:
+            raise Interrupted()
+        super(InterruptedWriter, self).write_formatted(data, sample)
+
+
+def make_fastq(seqs):
+    return "".join(
+        "@r%s\n%s\n+\n%s\n" % (n, seq, "#" * len(seq))
+        for n, seq in enumerate(seqs))
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.samples = [Sample("S1", "AAAA"), Sample("S2", "CCCC")]
+        barcodes = ["TTTT", "GGGG", "ACGT"]
+        self.n_reads = 10000
+        self.idx = make_fastq(barcodes[n % 3] for n in range(self.n_reads))
+        self.fwd = make_fastq("ACG%04d" % n for n in range(self.n_reads))
+        self.rev = make_fastq("TGC%04d" % n for n in range(self.n_reads))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def seq_file(self):
+        return IndexFastqSequenceFile(
+            StringIO(self.fwd), StringIO(self.rev), StringIO(self.idx))
+
+    def output(self, output_dir):
+        res = {}
+        for fn in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, fn)) as f:
+                res[fn] = f.read()
+        return res
+
+    def run_full(self, **kwargs):
+        output_dir = os.path.join(self.temp_dir, "full")
+        os.mkdir(output_dir)
+        writer = PairedFastqWriter(output_dir, write_unassigned=True)
+        assigner = BarcodeAssigner(self.samples)
+        counts = self.seq_file().demultiplex(assigner, writer, **kwargs)
+        writer.close()
+        return counts, self.output(output_dir)
+
+    def run_resumed(self, **kwargs):
+        output_dir = os.path.join(self.temp_dir, "resumed")
+        os.mkdir(output_dir)
+        checkpoint_fp = os.path.join(output_dir, "checkpoint.json")
+
+        writer = InterruptedWriter(
+            output_dir, 7000, buffer_size=100, write_unassigned=True)
+        checkpoint = Checkpointer(checkpoint_fp, interval=3000)
+        self.assertRaises(
+            Interrupted, self.seq_file().demultiplex,
+            BarcodeAssigner(self.samples), writer, checkpoint=checkpoint,
+            **kwargs)
+
+        state = load_checkpoint(checkpoint_fp)
+        self.assertTrue(3000 <= state["reads"] <= 7000)
+        writer = PairedFastqWriter(output_dir, write_unassigned=True)
+        assigner = BarcodeAssigner(self.samples)
+        restore_checkpoint(state, assigner, writer)
+        checkpoint = Checkpointer(
+            checkpoint_fp, interval=3000, start_reads=state["reads"])
+        counts = self.seq_file().demultiplex(
+            assigner, writer, checkpoint=checkpoint, **kwargs)
+        writer.close()
+        checkpoint.remove()
+        return counts, self.output(output_dir)
+
+    def test_resume(self):
+        self.assertEqual(self.run_resumed(), self.run_full())
+
+    def test_resume_parallel(self):
+        self.assertEqual(
+            self.run_resumed(processes=2, chunk_size=1000),
+            self.run_full(processes=2, chunk_size=1000))
+
+    def test_skip_records(self):
+        f = StringIO(make_fastq(["AAAA", "CCCC"]))
+        skip_records(f, 1)
+        self.assertEqual(f.read(), "@r1\nCCCC\n+\n####\n")
+        self.assertRaises(ValueError, skip_records, f, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
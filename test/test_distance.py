@@ -0,0 +1,94 @@
+from collections import namedtuple
+import unittest
+
+from dnabclib import distance
+from dnabclib.distance import analyze_barcodes, close_pairs, safe_mismatches
+
+
+MockSample = namedtuple("Sample", "name barcode")
+MockDualSample = namedtuple("Sample", "name barcode barcode2")
+MockSample.is_dual_indexed = False
+MockDualSample.is_dual_indexed = True
+
+
+class DistanceTests(unittest.TestCase):
+    barcodes = ["AAAAAAAA", "AAAAAAAC", "AAAAACCC", "GGGGGGGG", "TTTTTTTT"]
+
+    def test_close_pairs(self):
+        min_distance, pairs = close_pairs(self.barcodes, 3)
+        self.assertEqual(min_distance, 1)
+        self.assertEqual(sorted(pairs), [(0, 1, 1), (0, 2, 3), (1, 2, 2)])
+
+    def test_close_pairs_other_bases(self):
+        min_distance, pairs = close_pairs(["AANA", "AAAA", "NNNN"], 2)
+        self.assertEqual(min_distance, 1)
+        self.assertEqual(sorted(pairs), [(0, 1, 1)])
+
+    def test_close_pairs_blocks(self):
+        # Results must not depend on the size of the blocks
+        expected = close_pairs(self.barcodes, 8)
+        old_block_elements = distance.BLOCK_ELEMENTS
+        distance.BLOCK_ELEMENTS = 4
+        try:
+            obs = close_pairs(self.barcodes, 8)
+        finally:
+            distance.BLOCK_ELEMENTS = old_block_elements
+        self.assertEqual(obs[0], expected[0])
+        self.assertEqual(sorted(obs[1]), sorted(expected[1]))
+        self.assertEqual(len(obs[1]), 10)
+
+    def test_close_pairs_python(self):
+        self.assertEqual(
+            distance._close_pairs_python(self.barcodes, 3),
+            (1, [(0, 1, 1), (0, 2, 3), (1, 2, 2)]))
+
+    def test_close_pairs_lengths(self):
+        self.assertEqual(close_pairs([], 2), (None, []))
+        self.assertEqual(close_pairs(["ACGT"], 2), (None, []))
+        self.assertRaises(ValueError, close_pairs, ["ACGT", "ACG"], 2)
+
+    def test_safe_mismatches(self):
+        self.assertEqual(safe_mismatches(None), 2)
+        self.assertEqual(safe_mismatches(1), 0)
+        self.assertEqual(safe_mismatches(2), 0)
+        self.assertEqual(safe_mismatches(3), 1)
+        self.assertEqual(safe_mismatches(5), 2)
+        self.assertEqual(safe_mismatches(8), 2)
+
+    def test_analyze_barcodes(self):
+        samples = [
+            MockSample("S%s" % n, bc) for n, bc in enumerate(self.barcodes)]
+        samples.append(MockSample("Short", "AAAA"))
+        res, = analyze_barcodes(samples, 1)
+        self.assertEqual(res["barcodes"], 6)
+        self.assertEqual(res["min_distance"], 1)
+        self.assertEqual(res["safe_mismatches"], 0)
+        self.assertEqual(res["conflicts"], [
+            {"barcodes": ["AAAAAAAA", "AAAAAAAC"],
+             "samples": [["S0"], ["S1"]], "distance": 1},
+            {"barcodes": ["AAAAAAAC", "AAAAACCC"],
+             "samples": [["S1"], ["S2"]], "distance": 2},
+            ])
+
+    def test_analyze_dual_barcodes(self):
+        samples = [
+            MockDualSample("S1", "AAAAAA", "CCCCCC"),
+            MockDualSample("S2", "AAAAAA", "GGGGGG"),
+            MockDualSample("S3", "TTTTTT", "GGGGGC"),
+            ]
+        i7, i5 = analyze_barcodes(samples, 2)
+        self.assertEqual(i7["index"], "barcode")
+        self.assertEqual(i7["barcodes"], 2)
+        self.assertEqual(i7["min_distance"], 6)
+        self.assertEqual(i7["conflicts"], [])
+        self.assertEqual(i5["index"], "barcode2")
+        self.assertEqual(i5["barcodes"], 3)
+        self.assertEqual(i5["min_distance"], 1)
+        self.assertEqual(i5["conflicts"], [
+            {"barcodes": ["GGGGGC", "GGGGGG"],
+             "samples": [["S3"], ["S2"]], "distance": 1},
+            ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from dnabclib.heavyhitters import SpaceSaving
+
+
+class SpaceSavingTests(unittest.TestCase):
+    def test_exact_below_capacity(self):
+        s = SpaceSaving(5)
+        for x in "abacabad":
+            s.add(x)
+        self.assertEqual(
+            s.top(), [("a", 4, 0), ("b", 2, 0), ("c", 1, 0), ("d", 1, 0)])
+        self.assertEqual(s.top(1), [("a", 4, 0)])
+
+    def test_eviction(self):
+        s = SpaceSaving(2)
+        for x in "aab":
+            s.add(x)
+        # c replaces b, the item with the lowest count
+        s.add("c")
+        self.assertEqual(s.top(), [("a", 2, 0), ("c", 2, 1)])
+
+    def test_heavy_hitters_found(self):
+        rng = random.Random(0)
+        stream = ["x"] * 300 + ["y"] * 200
+        stream += ["n%s" % rng.randrange(10000) for _ in range(2000)]
+        rng.shuffle(stream)
+        s = SpaceSaving(20)
+        for x in stream:
+            s.add(x)
+        top = s.top(2)
+        self.assertEqual([item for item, _, _ in top], ["x", "y"])
+        for item, count, error in top:
+            self.assertTrue(count - error <= stream.count(item) <= count)
+        self.assertEqual(len(s.counts), 20)
+
+    def test_merge(self):
+        s1 = SpaceSaving(3)
+        s2 = SpaceSaving(3)
+        for x in "aaabbc":
+            s1.add(x)
+        for x in "aadd":
+            s2.add(x)
+        s1.merge(s2)
+        # "d" may have occurred once in the first stream, "b" can not
+        # have occurred in the second
+        self.assertEqual(s1.top(), [("a", 5, 0), ("d", 3, 1), ("b", 2, 0)])
+
+    def test_merge_full(self):
+        s1 = SpaceSaving(1)
+        s2 = SpaceSaving(1)
+        for x in "aab":
+            s1.add(x)
+        for x in "cc":
+            s2.add(x)
+        s1.merge(s2)
+        # Each summary holds one item, and the lowest count of each
+        # summary is added to items it does not hold
+        self.assertEqual(s1.top(), [("b", 5, 4)])
+        self.assertEqual(s1.counts, {"b": 5})
+
+    def test_capacity(self):
+        self.assertRaises(ValueError, SpaceSaving, 0)
+
+    def test_from_top(self):
+        s = SpaceSaving(2)
+        for x in "aabc":
+            s.add(x)
+        s2 = SpaceSaving.from_top(2, s.top())
+        self.assertEqual(s2.top(), s.top())
+        s.add("d")
+        s2.add("d")
+        self.assertEqual(s2.top(), s.top())
+
+
+if __name__ == "__main__":
+    unittest.main()
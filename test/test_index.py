@@ -0,0 +1,49 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.index import main, reverse_complement_index
+
+reads = (
+    "@HWI-D00727:9:C6JHHANXX:8:1101:1786:2183 1:N:0:GTTTCGCC\n"
+    "ACGTACGT\n+\nGGGGGGGG\n"
+    "@HWI-D00727:9:C6JHHANXX:8:1101:1787:2183 1:N:0:ACGTNAAA\n"
+    "ACGTACGT\n+\nGGGGGGGG\n")
+
+index = (
+    "@HWI-D00727:9:C6JHHANXX:8:1101:1786:2183 1:N:0:GTTTCGCC\n"
+    "GGCGAAAC\n+\nEEEEEEEE\n"
+    "@HWI-D00727:9:C6JHHANXX:8:1101:1787:2183 1:N:0:ACGTNAAA\n"
+    "TTTNACGT\n+\nEEEEEEEE\n")
+
+
+class MakeIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.reads_fp = os.path.join(self.temp_dir, "R1.fastq.gz")
+        with gzip.open(self.reads_fp, "wt") as f:
+            f.write(reads)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_reverse_complement_index(self):
+        self.assertEqual(reverse_complement_index("AACGN T"), "ANCGTT")
+
+    def test_main(self):
+        output_fp = os.path.join(self.temp_dir, "I1.fastq")
+        main(["--reads", self.reads_fp, "--output", output_fp])
+        with open(output_fp) as f:
+            self.assertEqual(f.read(), index)
+
+    def test_main_gzip(self):
+        output_fp = os.path.join(self.temp_dir, "I1.fastq.gz")
+        main(["--reads", self.reads_fp, "--output", output_fp])
+        with gzip.open(output_fp, "rt") as f:
+            self.assertEqual(f.read(), index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 import shutil
@@ -5,8 +6,9 @@ import tempfile
 import unittest
 
 from dnabclib.main import (
-    main, get_config, get_sample_names_main,
+    main, get_config, get_sample_names_main, check_barcodes_main,
 )
+from dnabclib.twobit import numpy
 
 
 class ConfigTests(unittest.TestCase):
@@ -79,6 +81,386 @@ class FastqDemultiplexTests(unittest.TestCase):
         with open(self.summary_fp) as f:
             res = json.load(f)
             self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+            self.assertEqual(
+                res["barcode_orientation"]["orientation"],
+                "reverse_complement")
+
+    def test_forward_orientation_detected(self):
+        # Barcodes given as they appear in the index reads
+        with open(self.barcode_fp, "w") as f:
+            f.write(
+                "SampleA\tCCTTCCTT\n"
+                "SampleB\tACGTACGT\n")
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        self.assertEqual(
+            res["barcode_orientation"]["orientation"], "forward")
+
+    def test_orientation_threshold(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"orientation_min_match_rate": 0.9}, f)
+        self.assertRaises(SystemExit, main, [
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_barcode_file_extra_column(self):
+        with open(self.barcode_fp, "w") as f:
+            f.write(
+                "SampleA\tAAGGAAGG\tplate1\n"
+                "SampleB\tACGTACGT\tplate1\n")
+        self.assertRaises(SystemExit, main, [
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            ])
+
+    def test_barcodes_too_close(self):
+        with open(self.barcode_fp, "w") as f:
+            f.write(
+                "SampleA\tAAGGAAGG\n"
+                "SampleB\tAAGGAAGC\n")
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        # Two mismatches per index need a dual-indexed barcode file
+        for mismatches in [1, [1, 0]]:
+            with open(config_fp, "w") as f:
+                json.dump({"barcode_mismatches": mismatches}, f)
+            self.assertRaises(SystemExit, main, [
+                "--forward-reads", self.forward_fp,
+                "--reverse-reads", self.reverse_fp,
+                "--index-reads", self.index_fp,
+                "--barcode-file", self.barcode_fp,
+                "--output-dir", self.output_dir,
+                "--summary-file", self.summary_fp,
+                "--config-file", config_fp,
+                ])
+            self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_unassigned(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"write_unassigned": True}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["top_unassigned_barcodes"], [
+            {"barcode": "GGGGCGCT", "count": 1, "max_error": 0}])
+        fp = os.path.join(self.output_dir, "unassigned_R2.fastq")
+        with open(fp) as f:
+            self.assertEqual(
+                f.read(), "@b\nGTNNNNNNNNNNNNNNNNNNN\n+\n#####################\n")
+
+    def test_profile(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"profile": True}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["timing"]["reads"], 3)
+        self.assertEqual(
+            sorted(res["timing"]["stage_seconds"]),
+            ["assign", "close", "read", "write"])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_read_stats(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"read_stats": True, "checkpoint_interval": 1}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(sorted(res["read_stats"]), ["SampleA", "SampleB"])
+        r1, r2 = res["read_stats"]["SampleA"]
+        self.assertEqual(r2["length_distribution"], {"21": 1})
+        qual = "kjafd;;;hjfasd82AHG99"
+        self.assertEqual(
+            r2["mean_quality"], [ord(c) - 33.0 for c in qual])
+        self.assertEqual(r2["q30_bases"], 14)
+
+    def test_passthrough(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"passthrough": True, "processes": 2}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        fp = os.path.join(self.output_dir, "SampleB_R1.fastq")
+        with open(fp) as f:
+            self.assertEqual(
+                f.read(), "@a\nGACTGCAGACGACTACGACGT\n+\n8A7T4C2G3CkAjThCeArG;\n")
+
+    def test_passthrough_several_reads(self):
+        # Each read appears three times, so samples get several reads
+        for fp in [self.forward_fp, self.reverse_fp, self.index_fp]:
+            with open(fp) as f:
+                contents = f.read()
+            with open(fp, "w") as f:
+                f.write(contents * 3)
+        for processes in [1, 2]:
+            config_fp = os.path.join(self.temp_dir, "config.json")
+            with open(config_fp, "w") as f:
+                json.dump({"passthrough": True, "processes": processes}, f)
+            main([
+                "--forward-reads", self.forward_fp,
+                "--reverse-reads", self.reverse_fp,
+                "--index-reads", self.index_fp,
+                "--barcode-file", self.barcode_fp,
+                "--output-dir", self.output_dir,
+                "--summary-file", self.summary_fp,
+                "--config-file", config_fp,
+                ])
+            with open(self.summary_fp) as f:
+                res = json.load(f)
+            self.assertEqual(
+                res["data"], {"SampleA": 3, "SampleB": 3, "unassigned": 3})
+            fp = os.path.join(self.output_dir, "SampleB_R2.fastq")
+            with open(fp) as f:
+                self.assertEqual(
+                    f.read(),
+                    "@a\nCATACGACGACTACGACTCAG\n+\nkjfhda987123GA;,.;,..\n" * 3)
+
+    def test_count_only(self):
+        main([
+            "--forward-reads", self.forward_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--summary-file", self.summary_fp,
+            "--count-only",
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        self.assertEqual(res["top_unassigned_barcodes"], [
+            {"barcode": "GGGGCGCT", "count": 1, "max_error": 0}])
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_inline_barcodes(self):
+        with open(self.barcode_fp, "w") as f:
+            f.write(
+                "SampleA\tGACTG\n"
+                "SampleB\tTCAGT\n")
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--inline-barcode-length", "5",
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        self.assertEqual(
+            res["barcode_orientation"]["orientation"], "forward")
+        with open(os.path.join(self.output_dir, "SampleA_R1.fastq")) as f:
+            self.assertEqual(
+                f.read(), "@a\nCAGACGACTACGACGT\n+\nC2G3CkAjThCeArG;\n")
+
+        # Index reads and inline barcodes can not be used together
+        self.assertRaises(SystemExit, main, [
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--inline-barcode-length", "5",
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            ])
+
+    def test_output_dir_required(self):
+        self.assertRaises(SystemExit, main, [
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--summary-file", self.summary_fp,
+            ])
+
+    def test_checkpoints(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"checkpoint_interval": 1}, f)
+        args = [
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ]
+        # Nothing to resume before the first run
+        self.assertRaises(SystemExit, main, args + ["--resume"])
+        main(args)
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        # The checkpoint is removed after a complete run
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["SampleA_R1.fastq", "SampleA_R2.fastq",
+             "SampleB_R1.fastq", "SampleB_R2.fastq"])
+
+    def test_pipeline(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"pipeline": True, "write_threads": 2}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+        fp = os.path.join(self.output_dir, "SampleB_R1.fastq")
+        with open(fp) as f:
+            self.assertEqual(
+                f.read(), "@a\nGACTGCAGACGACTACGACGT\n+\n8A7T4C2G3CkAjThCeArG;\n")
+
+    def test_gzipped_output(self):
+        config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(config_fp, "w") as f:
+            json.dump({"output_compression": "gzip"}, f)
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--index-reads", self.index_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            "--config-file", config_fp,
+            ])
+        fp = os.path.join(self.output_dir, "SampleB_R1.fastq.gz")
+        with gzip.open(fp, "rt") as f:
+            self.assertEqual(
+                f.read(), "@a\nGACTGCAGACGACTACGACGT\n+\n8A7T4C2G3CkAjThCeArG;\n")
+
+    def test_gzipped_input(self):
+        for fp in [self.forward_fp, self.reverse_fp, self.index_fp]:
+            with open(fp, "rb") as f, gzip.open(fp + ".gz", "wb") as g:
+                g.write(f.read())
+        main([
+            "--forward-reads", self.forward_fp + ".gz",
+            "--reverse-reads", self.reverse_fp + ".gz",
+            "--index-reads", self.index_fp + ".gz",
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+            self.assertEqual(res["data"], {"SampleA": 1, "SampleB": 1, "unassigned":1})
+
+
+class DualIndexDemultiplexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        barcodes = ["AAAA+CCCC", "AAAA+GGGG", "TTTT+CCCC", "TTTT+GGGG"]
+        self.forward_fp = os.path.join(self.temp_dir, "R1.fastq")
+        self.reverse_fp = os.path.join(self.temp_dir, "R2.fastq")
+        for read, fp in [("1", self.forward_fp), ("2", self.reverse_fp)]:
+            with open(fp, "w") as f:
+                for n, bc in enumerate(barcodes):
+                    f.write("@r%s %s:N:0:%s\nACGT\n+\n####\n" % (n, read, bc))
+
+        self.barcode_fp = os.path.join(self.temp_dir, "manifest.txt")
+        with open(self.barcode_fp, "w") as f:
+            f.write(
+                "SampleA\tAAAA\tCCCC\n"
+                "SampleB\tTTTT\tGGGG\n")
+
+        self.output_dir = os.path.join(self.temp_dir, "output")
+        self.summary_fp = os.path.join(self.temp_dir, "summary.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_dual_index(self):
+        main([
+            "--forward-reads", self.forward_fp,
+            "--reverse-reads", self.reverse_fp,
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", self.output_dir,
+            "--summary-file", self.summary_fp,
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(
+            res["data"], {"SampleA": 1, "SampleB": 1, "unassigned": 2})
+        self.assertEqual(
+            res["index_hopping"], {"AAAA+GGGG": 1, "TTTT+CCCC": 1})
+
+    def test_dual_index_count_only(self):
+        main([
+            "--forward-reads", self.forward_fp,
+            "--barcode-file", self.barcode_fp,
+            "--summary-file", self.summary_fp,
+            "--count-only",
+            ])
+        with open(self.summary_fp) as f:
+            res = json.load(f)
+        self.assertEqual(
+            res["data"], {"SampleA": 1, "SampleB": 1, "unassigned": 2})
+        self.assertEqual(
+            res["index_hopping"], {"AAAA+GGGG": 1, "TTTT+CCCC": 1})
+        self.assertNotIn("flush_stats", res)
 
 
 class SampleNameTests(unittest.TestCase):
@@ -101,5 +483,31 @@ class SampleNameTests(unittest.TestCase):
 
         self.assertEqual(observed_sample_names, b"SampleA\nSampleB\n")
 
+
+class CheckBarcodesTests(unittest.TestCase):
+    def test_check_barcodes_main(self):
+        barcode_file = tempfile.NamedTemporaryFile()
+        barcode_file.write(
+            b"SampleA\tAAGGAAGG\n"
+            b"SampleB\tAAGGAACC\n"
+            b"SampleC\tTTTTTTTT\n")
+        barcode_file.seek(0)
+
+        output_file = tempfile.NamedTemporaryFile()
+        check_barcodes_main([
+            "--barcode-file", barcode_file.name,
+            "--mismatches", "1",
+            "--output-file", output_file.name,
+        ])
+
+        output_file.seek(0)
+        self.assertEqual(output_file.read(), (
+            b"Index: barcode\n"
+            b"Distinct barcodes: 3\n"
+            b"Minimum distance: 2\n"
+            b"Largest safe mismatches: 0\n"
+            b"Pairs colliding with 1 mismatches: 1\n"
+            b"AAGGAACC\tAAGGAAGG\t2\tSampleB\tSampleA\n"))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.main import main as dnabc_main
+from dnabclib.merge import main, merge_summaries, order_shards
+from dnabclib.twobit import numpy
+
+
+class MergeTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        barcodes = ["ACGTACGT", "GGGGCGCT", "CCTTCCTT", "TTTTTTTT"]
+        self.files = {}
+        for read in ["R1", "R2", "I1"]:
+            fp = os.path.join(self.temp_dir, "%s.fastq" % read)
+            with open(fp, "w") as f:
+                for n in range(200):
+                    if read == "I1":
+                        seq = barcodes[n % 7 % 4]
+                    else:
+                        seq = "ACGT" * (n % 5 + 1)
+                    f.write("@r%s\n%s\n+\n%s\n" % (n, seq, "@" * len(seq)))
+            self.files[read] = fp
+
+        self.barcode_fp = os.path.join(self.temp_dir, "manifest.txt")
+        with open(self.barcode_fp, "w") as f:
+            f.write("SampleA\tAAGGAAGG\nSampleB\tACGTACGT\n")
+        self.config_fp = os.path.join(self.temp_dir, "config.json")
+        with open(self.config_fp, "w") as f:
+            json.dump({
+                "barcode_orientation": "reverse_complement",
+                "write_unassigned": True,
+                }, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_dnabc(self, name, shard=None):
+        output_dir = os.path.join(self.temp_dir, name)
+        summary_fp = os.path.join(self.temp_dir, "%s.json" % name)
+        args = [
+            "--forward-reads", self.files["R1"],
+            "--reverse-reads", self.files["R2"],
+            "--index-reads", self.files["I1"],
+            "--barcode-file", self.barcode_fp,
+            "--output-dir", output_dir,
+            "--summary-file", summary_fp,
+            "--config-file", self.config_fp,
+            ]
+        if shard is not None:
+            args.extend(["--shard", shard])
+        dnabc_main(args)
+        return output_dir, summary_fp
+
+    def read_outputs(self, output_dir):
+        outputs = {}
+        for fn in os.listdir(output_dir):
+            with open(os.path.join(output_dir, fn)) as f:
+                outputs[fn] = f.read()
+        return outputs
+
+    def test_merge(self):
+        single_dir, single_summary_fp = self.run_dnabc("single")
+        shards = [self.run_dnabc("shard%s" % k, "%s/3" % k) for k in [3, 1, 2]]
+        merged_dir = os.path.join(self.temp_dir, "merged")
+        merged_summary_fp = os.path.join(self.temp_dir, "merged.json")
+        main(
+            ["--shard-summaries"] + [s for _, s in shards] +
+            ["--shard-dirs"] + [d for d, _ in shards] +
+            ["--output-dir", merged_dir,
+             "--summary-file", merged_summary_fp])
+
+        self.assertEqual(
+            self.read_outputs(merged_dir), self.read_outputs(single_dir))
+        with open(single_summary_fp) as f:
+            single = json.load(f)
+        with open(merged_summary_fp) as f:
+            merged = json.load(f)
+        self.assertEqual(merged["data"], single["data"])
+        self.assertEqual(
+            merged["data"], {"SampleA": 57, "SampleB": 57, "unassigned": 86})
+        self.assertEqual(
+            merged["top_unassigned_barcodes"],
+            single["top_unassigned_barcodes"])
+        self.assertEqual(
+            [s["shard"] for s in merged["shards"]], [1, 2, 3])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_merge_read_stats(self):
+        with open(self.config_fp, "w") as f:
+            json.dump({
+                "barcode_orientation": "reverse_complement",
+                "read_stats": True,
+                }, f)
+        _, single_summary_fp = self.run_dnabc("single")
+        shards = [self.run_dnabc("shard%s" % k, "%s/2" % k) for k in [1, 2]]
+        merged_summary_fp = os.path.join(self.temp_dir, "merged.json")
+        main(
+            ["--shard-summaries"] + [s for _, s in shards] +
+            ["--summary-file", merged_summary_fp])
+        with open(single_summary_fp) as f:
+            single = json.load(f)
+        with open(merged_summary_fp) as f:
+            merged = json.load(f)
+        self.assertEqual(merged["read_stats"], single["read_stats"])
+        self.assertEqual(
+            single["read_stats"]["SampleB"][0]["length_distribution"],
+            {"4": 11, "8": 12, "12": 11, "16": 11, "20": 12})
+
+    def test_missing_shard(self):
+        summaries = [
+            {"shard": {"shard": 1, "shards": 3}},
+            {"shard": {"shard": 3, "shards": 3}},
+            ]
+        self.assertRaises(ValueError, order_shards, summaries)
+        self.assertRaises(ValueError, merge_summaries, summaries[:1])
+
+    def test_different_orientations(self):
+        summaries = [
+            {"shard": {"shard": k, "shards": 2}, "data": {"A": 1},
+             "barcode_orientation": {"orientation": orientation}}
+            for k, orientation in [(1, "forward"), (2, "reverse_complement")]]
+        self.assertRaises(ValueError, merge_summaries, summaries)
+
+
+if __name__ == "__main__":
+    unittest.main()
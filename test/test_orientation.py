@@ -0,0 +1,62 @@
+import gzip
+from io import BytesIO
+import unittest
+
+from dnabclib.orientation import detect_orientation, read_barcode_sample
+from dnabclib.sample import Sample
+
+
+class ReadBarcodeSampleTests(unittest.TestCase):
+    def setUp(self):
+        self.data = (
+            b"@a 1:N:0:AAAA+CCCC\nACGT\n+\n####\n"
+            b"@b 1:N:0:TTTT+GGGG\nGGGG\n+\n####\n")
+
+    def test_index_reads(self):
+        f = BytesIO(self.data)
+        self.assertEqual(read_barcode_sample(f), ["ACGT", "GGGG"])
+        self.assertEqual(f.tell(), 0)
+
+    def test_description_gzip(self):
+        f = BytesIO(gzip.compress(self.data))
+        self.assertEqual(
+            read_barcode_sample(f, n=1, from_description=True),
+            ["AAAACCCC"])
+        self.assertEqual(f.read(2), b"\x1f\x8b")
+
+
+class DetectOrientationTests(unittest.TestCase):
+    def test_single_index(self):
+        samples = [Sample("S1", "AACC"), Sample("S2", "AAGG")]
+        barcodes = ["GGTT", "CCTT", "GGTT", "ACGT"]
+        revcomp, info = detect_orientation(
+            barcodes, samples, default=False)
+        self.assertTrue(revcomp)
+        self.assertEqual(info["orientation"], "reverse_complement")
+        self.assertEqual(
+            info["match_rates"], {"forward": 0.0, "reverse_complement": 0.75})
+
+    def test_tie(self):
+        samples = [Sample("S1", "ACGT")]
+        revcomp, _ = detect_orientation(
+            ["ACGT"], samples, default=True)
+        self.assertTrue(revcomp)
+
+    def test_dual_index(self):
+        samples = [Sample("S1", "AACC", "AAAG"), Sample("S2", "TTCC", "AATG")]
+        # i7 as given, i5 reverse complemented
+        barcodes = ["AACCCTTT", "TTCCCATT"]
+        revcomp, info = detect_orientation(
+            barcodes, samples, default=True)
+        self.assertEqual(revcomp, (False, True))
+        self.assertEqual(info["orientation"], "forward+reverse_complement")
+        self.assertEqual(info["match_rates"]["forward+forward"], 0.0)
+
+    def test_no_match(self):
+        samples = [Sample("S1", "AACC")]
+        self.assertRaises(
+            ValueError, detect_orientation, ["ACGT"] * 10, samples, False)
+
+
+if __name__ == "__main__":
+    unittest.main()
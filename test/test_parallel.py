@@ -0,0 +1,136 @@
+import collections
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.parallel import read_chunks
+from dnabclib.seqfile import (
+    IndexFastqSequenceFile, NoIndexFastqSequenceFile,
+    )
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.writer import PairedFastqWriter, PassthroughPairedFastqWriter
+
+
+class MockWriter(object):
+    write_unassigned = True
+
+    def __init__(self):
+        self.written = collections.defaultdict(list)
+
+    def write(self, x, sample):
+        name = None if sample is None else sample.name
+        self.written[name].append(tuple((r.desc, r.seq, r.qual) for r in x))
+
+    @classmethod
+    def format_batch(cls, reads):
+        return [[tuple((r.desc, r.seq, r.qual) for r in x) for x in reads]]
+
+    def write_formatted(self, data, sample):
+        name = None if sample is None else sample.name
+        self.written[name].extend(data[0])
+
+MockSample = collections.namedtuple("MockSample", "name barcode")
+
+
+def make_fastq(prefix, seqs):
+    return "".join(
+        "@%s%s\n%s\n+\n%s\n" % (prefix, n, seq, "#" * len(seq))
+        for n, seq in enumerate(seqs))
+
+
+class ReadChunksTests(unittest.TestCase):
+    def test_read_chunks(self):
+        f1 = BytesIO(make_fastq("a", ["A", "C", "G"]).encode("ascii"))
+        f2 = BytesIO(make_fastq("b", ["T", "T", "T"]).encode("ascii"))
+        obs = list(read_chunks([f1, f2], chunk_size=2))
+        self.assertEqual(len(obs), 2)
+        self.assertEqual(obs[1], (b"@a2\nG\n+\n#\n", b"@b2\nT\n+\n#\n"))
+
+    def test_read_chunks_text(self):
+        f = StringIO(make_fastq("a", ["A"]))
+        self.assertEqual(list(read_chunks([f])), [("@a0\nA\n+\n#\n",)])
+
+
+class DemultiplexParallelTests(unittest.TestCase):
+    def setUp(self):
+        barcodes = ["AAAA", "CCCC", "GGGG", "TTTT", "ACGT"] * 7
+        self.idx = make_fastq("r", barcodes)
+        self.fwd = make_fastq("r", ["ACGTAC%s" % b for b in barcodes])
+        self.rev = make_fastq("r", ["TTGCAA%s" % b for b in barcodes])
+        self.samples = [
+            MockSample("S1", "AAAA"), MockSample("S2", "GGGG"),
+            MockSample("S3", "ACGT")]
+
+    def demultiplex(self, **kwargs):
+        x = IndexFastqSequenceFile(
+            BytesIO(self.fwd.encode("ascii")),
+            BytesIO(self.rev.encode("ascii")),
+            BytesIO(self.idx.encode("ascii")))
+        a = BarcodeAssigner(self.samples, revcomp=False)
+        w = MockWriter()
+        x.demultiplex(a, w, **kwargs)
+        return a.read_counts, w.written
+
+    def test_matches_serial(self):
+        serial_counts, serial_written = self.demultiplex()
+        counts, written = self.demultiplex(processes=2, chunk_size=3)
+        self.assertEqual(counts, serial_counts)
+        self.assertEqual(counts["S1"], 7)
+        self.assertEqual(counts["unassigned"], 14)
+        self.assertEqual(written, serial_written)
+
+    def test_writer_output_matches_serial(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for writer_cls, parser in [
+                    (PairedFastqWriter, "block"),
+                    (PassthroughPairedFastqWriter, "raw")]:
+                for write_unassigned in [False, True]:
+                    output = []
+                    for kwargs in [{}, {"processes": 2, "chunk_size": 4}]:
+                        output_dir = tempfile.mkdtemp(dir=temp_dir)
+                        x = IndexFastqSequenceFile(
+                            BytesIO(self.fwd.encode("ascii")),
+                            BytesIO(self.rev.encode("ascii")),
+                            BytesIO(self.idx.encode("ascii")), parser=parser)
+                        a = BarcodeAssigner(self.samples, revcomp=False)
+                        w = writer_cls(
+                            output_dir, buffer_size=100,
+                            write_unassigned=write_unassigned)
+                        x.demultiplex(a, w, **kwargs)
+                        w.close()
+                        files = {}
+                        for fn in os.listdir(output_dir):
+                            with open(os.path.join(output_dir, fn)) as f:
+                                files[fn] = f.read()
+                        output.append(files)
+                    self.assertEqual(output[0], output[1])
+                    self.assertEqual(
+                        "unassigned_R1.fastq" in output[1], write_unassigned)
+                    self.assertEqual(
+                        output[1]["S1_R2.fastq"].count("\n"), 4 * 7)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_no_index(self):
+        barcodes = ["ACGT", "GGGG", "ACGT", "CCCC"]
+        fwd = "".join(
+            "@r%s 1:N:0:%s\nAAAA\n+\n####\n" % (n, b)
+            for n, b in enumerate(barcodes))
+        rev = "".join(
+            "@r%s 2:N:0:%s\nCCCC\n+\n####\n" % (n, b)
+            for n, b in enumerate(barcodes))
+        x = NoIndexFastqSequenceFile(StringIO(fwd), StringIO(rev))
+        a = BarcodeAssigner(self.samples, revcomp=False)
+        w = MockWriter()
+        x.demultiplex(a, w, processes=2, chunk_size=1)
+        self.assertEqual(a.read_counts, {
+            "S1": 0, "S2": 1, "S3": 2, "unassigned": 1})
+        self.assertEqual(
+            [r1[0] for r1, r2 in w.written["S3"]],
+            ["r0 1:N:0:ACGT", "r2 1:N:0:ACGT"])
+
+if __name__ == "__main__":
+    unittest.main()
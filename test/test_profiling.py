@@ -0,0 +1,150 @@
+import collections
+from io import StringIO
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.profiling import (
+    StageProfiler, ProgressReporter, demultiplex_instrumented,
+    )
+from dnabclib.seqfile import IndexFastqSequenceFile
+
+
+MockRead = collections.namedtuple("MockRead", "desc seq qual")
+MockSample = collections.namedtuple("MockSample", "name barcode")
+
+
+class MockWriter(object):
+    write_unassigned = True
+
+    def __init__(self):
+        self.written = collections.defaultdict(list)
+
+    def write(self, x, sample):
+        name = None if sample is None else sample.name
+        self.written[name].append(x)
+
+    @classmethod
+    def format_batch(cls, reads):
+        return [list(reads)]
+
+    def write_formatted(self, data, sample):
+        name = None if sample is None else sample.name
+        self.written[name].extend(data[0])
+
+
+class StageProfilerTests(unittest.TestCase):
+    def test_summary(self):
+        p = StageProfiler(sample_every=10)
+        p.add_sample([("read", 1.0), ("assign", 0.5)])
+        p.add_sample([("read", 1.0), ("assign", 0.5)])
+        p.add_total("close", 3.0)
+        p.reads = 20
+        # Started long enough ago for the estimates to fit
+        p._start -= 100
+        obs = p.summary()
+        self.assertEqual(obs["reads"], 20)
+        self.assertEqual(obs["sampled_reads"], 2)
+        self.assertEqual(
+            dict(obs["stage_seconds"]),
+            {"read": 20.0, "assign": 10.0, "close": 3.0})
+
+    def test_estimates_scaled_to_wall_time(self):
+        p = StageProfiler(sample_every=10)
+        p.add_sample([("assign", 3.0), ("write", 1.0)])
+        p.add_total("read", 2.0)
+        p.reads = 10
+        p._start -= 4
+        obs = p.summary()
+        stages = obs["stage_seconds"]
+        self.assertEqual(stages["read"], 2.0)
+        self.assertAlmostEqual(stages["assign"] / stages["write"], 3.0)
+        self.assertLessEqual(sum(stages.values()), obs["wall_seconds"])
+        self.assertGreater(stages["assign"] + stages["write"], 1.9)
+
+
+class ProgressReporterTests(unittest.TestCase):
+    def test_message_with_eta(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"x" * 100)
+            f.seek(25)
+            out = StringIO()
+            p = ProgressReporter(f, interval=0, out=out)
+            p._start -= 10
+            p.update(50)
+        self.assertTrue(out.getvalue().startswith("Processed 50 reads"))
+        self.assertIn("25.0% of input, ETA 0:00:30", out.getvalue())
+
+    def test_message_without_file(self):
+        p = ProgressReporter(StringIO(), interval=3600)
+        self.assertNotIn("ETA", p.message(10))
+        out = StringIO()
+        p.out = out
+        p.update(10)
+        self.assertEqual(out.getvalue(), "")
+
+
+class DemultiplexInstrumentedTests(unittest.TestCase):
+    def test_demultiplex_instrumented(self):
+        s1 = MockSample("S1", "AAAA")
+        records = [
+            (MockRead("a", "C", "#"), MockRead("a", "G", "#"),
+             MockRead("a", bc, "####"))
+            for bc in ["AAAA", "CCCC", "AAAA"]]
+        a = BarcodeAssigner([s1], revcomp=False)
+        w = MockWriter()
+        p = StageProfiler(sample_every=1)
+        demultiplex_instrumented(
+            records, lambda fwd, rev, idx: idx.seq, a, w, profiler=p)
+        self.assertEqual(a.read_counts, {"S1": 2, "unassigned": 1})
+        self.assertEqual(len(w.written["S1"]), 2)
+        self.assertEqual(len(w.written["S1"][0]), 2)
+        self.assertEqual(p.reads, 3)
+        self.assertEqual(p.sampled_reads, 3)
+        self.assertEqual(
+            list(p.summary()["stage_seconds"]), ["assign", "write", "read"])
+
+    def test_stage_totals_within_wall_time(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fps = []
+            for name, seq in [("R1", "ACGT" * 25), ("R2", "TGCA" * 25),
+                              ("I1", "AAAA")]:
+                fp = os.path.join(temp_dir, "%s.fastq" % name)
+                with open(fp, "w") as f:
+                    for n in range(20000):
+                        f.write("@r%s\n%s\n+\n%s\n" % (
+                            n, seq, "#" * len(seq)))
+                fps.append(fp)
+            a = BarcodeAssigner([MockSample("S1", "AAAA")], revcomp=False)
+            p = StageProfiler()
+            fs = [open(fp, "rb") for fp in fps]
+            x = IndexFastqSequenceFile(*fs, parser="block")
+            x.demultiplex(a, MockWriter(), profiler=p)
+            for f in fs:
+                f.close()
+        finally:
+            shutil.rmtree(temp_dir)
+        obs = p.summary()
+        self.assertEqual(obs["reads"], 20000)
+        self.assertLessEqual(
+            sum(obs["stage_seconds"].values()), obs["wall_seconds"])
+
+    def test_parallel_profiler(self):
+        idx = "".join("@r\n%s\n+\n####\n" % bc for bc in ["AAAA", "CCCC"])
+        fwd = "@r\nACGT\n+\n####\n" * 2
+        x = IndexFastqSequenceFile(StringIO(fwd), StringIO(fwd), StringIO(idx))
+        a = BarcodeAssigner([MockSample("S1", "AAAA")], revcomp=False)
+        p = StageProfiler()
+        x.demultiplex(
+            a, MockWriter(), processes=2, chunk_size=1, profiler=p)
+        self.assertEqual(p.reads, 2)
+        self.assertEqual(
+            set(p.summary()["stage_seconds"]),
+            set(["read_chunks", "wait_workers", "write"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from collections import namedtuple
+from io import BytesIO
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.readstats import ReadStats, merge_summaries, numpy
+from dnabclib.seqfile import parse_fastq_raw
+from dnabclib.writer import (
+    FastaWriter, PairedFastqWriter, PassthroughPairedFastqWriter,
+    )
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class ReadStatsTests(unittest.TestCase):
+    def test_fastq(self):
+        s = ReadStats(block_size=0)
+        s.add("@a\nACGT\n+\nI?5#\n@b\nAC\n+a\n?I\n")
+        s.add(bytearray(b"@c\r\nACG\r\n+\r\n###\r\n"))
+        self.assertEqual(s.summary(), {
+            "reads": 3,
+            "bases": 9,
+            "length_distribution": {"2": 1, "3": 1, "4": 1},
+            "mean_quality": [24.0, 24.0, 11.0, 2.0],
+            "q30_bases": 4,
+            "q30_fraction": 4 / 9.0,
+            })
+
+    def test_fasta(self):
+        s = ReadStats(quality=False)
+        s.add(">a\nACGT\n>b\nAC\n")
+        s.add(">c\nAC\n")
+        self.assertEqual(s.summary(), {
+            "reads": 3,
+            "bases": 8,
+            "length_distribution": {"2": 2, "4": 1},
+            })
+
+    def test_empty(self):
+        s = ReadStats()
+        s.add("")
+        self.assertEqual(s.summary(), {
+            "reads": 0, "bases": 0, "length_distribution": {},
+            "mean_quality": [], "q30_bases": 0, "q30_fraction": 0.0})
+
+    def test_merge_summaries(self):
+        blocks = [
+            "@a\nACGT\n+\nI?5#\n@b\nAC\n+\n?I\n",
+            "@c\nACGTA\n+\n?????\n",
+            ]
+        whole = ReadStats()
+        summaries = []
+        for block in blocks:
+            whole.add(block)
+            s = ReadStats()
+            s.add(block)
+            summaries.append(s.summary())
+        self.assertEqual(merge_summaries(summaries), whole.summary())
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class WriterReadStatsTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.Sample = namedtuple("Sample", "name")
+        self.Read = namedtuple("Read", "desc seq qual")
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_paired_write_threads(self):
+        samples = [self.Sample("a"), self.Sample("b")]
+        w = PairedFastqWriter(
+            self.output_dir, buffer_size=30, write_threads=2,
+            write_unassigned=True, read_stats=True)
+        for n in range(10):
+            readpair = (
+                self.Read("r%s" % n, "A" * (n + 1), "I" * (n + 1)),
+                self.Read("r%s" % n, "C", "#"),
+                )
+            w.write(readpair, samples[n % 2] if n < 8 else None)
+        w.close()
+        stats = w.read_stats_summary()
+        self.assertEqual(sorted(stats), ["a", "b", "unassigned"])
+        r1, r2 = stats["b"]
+        self.assertEqual(
+            r1["length_distribution"], {"2": 1, "4": 1, "6": 1, "8": 1})
+        self.assertEqual(r1["q30_fraction"], 1.0)
+        self.assertEqual(r2["mean_quality"], [2.0])
+        self.assertEqual(r2["q30_bases"], 0)
+
+    def test_passthrough(self):
+        s1 = self.Sample("a")
+        w = PassthroughPairedFastqWriter(
+            self.output_dir, buffer_size=0, read_stats=True)
+        readpairs = zip(
+            parse_fastq_raw(BytesIO(b"@r0\nACGT\n+\nIIII\n@r1\nG\n+\n#\n")),
+            parse_fastq_raw(BytesIO(b"@r0\nTT\n+\nII\n@r1\nC\n+\n#\n")))
+        for readpair in readpairs:
+            w.write(readpair, s1)
+        w.close()
+        r1, r2 = w.read_stats_summary()["a"]
+        self.assertEqual(r1["mean_quality"], [21.0, 40.0, 40.0, 40.0])
+        self.assertEqual(r2["length_distribution"], {"1": 1, "2": 1})
+
+    def test_fasta(self):
+        s1 = self.Sample("a")
+        w = FastaWriter(self.output_dir, read_stats=True)
+        w.write(namedtuple("Read", "desc seq")("r0", "ACG"), s1)
+        w.close()
+        self.assertEqual(
+            w.read_stats_summary(),
+            {"a": [{"reads": 1, "bases": 3,
+                    "length_distribution": {"3": 1}}]})
+
+    def test_restore(self):
+        s1 = self.Sample("a")
+        w = FastaWriter(self.output_dir, read_stats=True)
+        w.write(namedtuple("Read", "desc seq")("r0", "ACG"), s1)
+        w.close()
+        w2 = FastaWriter(self.output_dir, read_stats=True)
+        w2.restore_read_stats(w.read_stats_summary())
+        w2.write(namedtuple("Read", "desc seq")("r1", "AC"), s1)
+        w2.close()
+        self.assertEqual(
+            w2.read_stats_summary()["a"][0]["length_distribution"],
+            {"2": 1, "3": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,55 @@
+from io import StringIO
 import unittest
 
-from dnabclib.sample import Sample
+from dnabclib.sample import Sample, load_sample_sheet
 
 
 class SampleTests(unittest.TestCase):
     def test_prefixes(self):
         s = Sample("a", "agct")
         self.assertEqual(s.barcode, "AGCT")
+        self.assertFalse(s.is_dual_indexed)
+
+    def test_load_dual_index(self):
+        f = StringIO(
+            "S1\tAAAA\tcccc\n"
+            "S2\tAAAA\tGGGG\n")
+        s1, s2 = Sample.load(f)
+        self.assertTrue(s1.is_dual_indexed)
+        self.assertEqual(s1.barcode2, "CCCC")
+        self.assertEqual(s2.barcode, "AAAA")
+
+    def test_load_duplicate_dual_index(self):
+        f = StringIO(
+            "S1\tAAAA\tCCCC\n"
+            "S2\tAAAA\tCCCC\n")
+        self.assertRaises(ValueError, Sample.load, f)
+
+    def test_load_mixed_index(self):
+        f = StringIO(
+            "S1\tAAAA\tCCCC\n"
+            "S2\tGGGG\n")
+        self.assertRaises(ValueError, Sample.load, f)
+
+    def test_load_extra_column(self):
+        f = StringIO(
+            "S1\tAAAACCCC\tplate1\n"
+            "S2\tGGGGTTTT\tplate1\n")
+        with self.assertRaisesRegex(ValueError, "line 1"):
+            Sample.load(f)
+
+    def test_load_sample_sheet(self):
+        f = StringIO(
+            "FCID,Lane,SampleID,SampleRef,Index,Description\n"
+            "FC1,1,Sample A,,AAAA-CCCC,\n"
+            "FC1,2,SampleB,,GGGG,\n"
+            "FC1,1,SampleC,,TTTT-GGGG,\n")
+        lanes = load_sample_sheet(f)
+        self.assertEqual(list(lanes), ["1", "2"])
+        self.assertEqual(
+            [(s.name, s.barcode) for s in lanes["1"]],
+            [("SampleA", "AAAACCCC"), ("SampleC", "TTTTGGGG")])
+        self.assertEqual(lanes["2"][0].name, "SampleB")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,27 @@
 import collections
-from io import StringIO
+import gzip
+import pickle
+from io import BytesIO, StringIO
 import os.path
 import shutil
 import tempfile
 import unittest
 
 from dnabclib.seqfile import (
-    IndexFastqSequenceFile, NoIndexFastqSequenceFile, parse_fastq,
+    IndexFastqSequenceFile, NoIndexFastqSequenceFile,
+    InlineBarcodeFastqSequenceFile, parse_fastq,
+    parse_fastq_blocks, parse_fastq_raw, open_input, find_record_start,
+    open_shard, shard_ranges, aligned_record_blocks, demultiplex_raw,
+    _record_ends, _record_ends_python,
     )
 from dnabclib.assigner import BarcodeAssigner
+from dnabclib.twobit import numpy
+from dnabclib.writer import PassthroughPairedFastqWriter
 
 
 class MockWriter(object):
+    write_unassigned = True
+
     def __init__(self):
         self.written = collections.defaultdict(list)
 
@@ -21,6 +31,14 @@ class MockWriter(object):
         else:
             self.written[sample.name].append(x)
 
+    @classmethod
+    def format_batch(cls, reads):
+        return [list(reads)]
+
+    def write_formatted(self, data, sample):
+        name = None if sample is None else sample.name
+        self.written[name].extend(data[0])
+
 MockSample = collections.namedtuple("MockSample", "name barcode")
 
 
@@ -56,6 +74,17 @@ class IndexFastqSequenceFileTests(unittest.TestCase):
         self.assertEqual(r2.seq, "GTNNNNNNNNNNNNNNNNNNN")
         self.assertEqual(r2.qual, "#####################")
 
+    def test_count(self):
+        idx = StringIO(
+            "@a\nACGTACGT\n+\n9812734[\n"
+            "@b\nGGGGCGCT\n+\n78154987\n"
+            "@c\nCCTTCCTT\n+\nkjafd;;;\n")
+        x = IndexFastqSequenceFile(None, None, idx)
+        s1 = MockSample("SampleS1", "GGGGCGCT")
+        a = BarcodeAssigner([s1], mismatches=0, revcomp=False)
+        self.assertEqual(
+            x.count(a), {"SampleS1": 1, "unassigned": 2})
+
 
 class NoIndexFastqSequenceFileTests(unittest.TestCase):
     def test_demultiplex(self):
@@ -95,6 +124,102 @@ class NoIndexFastqSequenceFileTests(unittest.TestCase):
             "33:A?11;@/;/;0//////001>11>111111111?10:E0=/1:/1/1111111=11111>"
             "11?:=FDEGBGGGG/EB<==@DDFGBEGC00C:>>D.FCG<CDGGGBGGBGGE=E..DGGE/C")
 
+    def test_count(self):
+        fwd = StringIO(fastq_with_barcode_fwd)
+        x = NoIndexFastqSequenceFile(fwd, None)
+        s1 = MockSample("SampleS1", "GTTTCGCCCTAGTACA")
+        a = BarcodeAssigner([s1], mismatches=0, revcomp=False)
+        counts = x.count(a)
+        self.assertEqual(counts["SampleS1"], 1)
+        self.assertEqual(
+            counts["unassigned"], fastq_with_barcode_fwd.count("\n") // 4 - 1)
+
+
+class InlineBarcodeFastqSequenceFileTests(unittest.TestCase):
+    fwd = (
+        "@a 1\nACGTTTGCA\n+\nABCDEFGHI\n"
+        "@b 1\nGGGGCCCCC\n+\n#########\n"
+        "@c 1\nACGACCCAA\n+\nIHGFEDCBA\n")
+    rev = (
+        "@a 2\nTTTTT\n+\n;;;;;\n"
+        "@b 2\nCCCCC\n+\n;;;;;\n"
+        "@c 2\nGGGGG\n+\n;;;;;\n")
+
+    def demultiplex(self, **kwargs):
+        x = InlineBarcodeFastqSequenceFile(
+            StringIO(self.fwd), StringIO(self.rev), 4)
+        w = MockWriter()
+        s1 = MockSample("S1", "ACGT")
+        a = BarcodeAssigner([s1], mismatches=1, revcomp=False)
+        counts = x.demultiplex(a, w, **kwargs)
+        self.assertEqual(counts, {"S1": 2, "unassigned": 1})
+        return w
+
+    def test_demultiplex(self):
+        for kwargs in [{}, {"processes": 2, "chunk_size": 1}]:
+            w = self.demultiplex(**kwargs)
+            obs = [
+                (r1.desc, r1.seq, r1.qual, r2.seq)
+                for r1, r2 in w.written["S1"]]
+            self.assertEqual(obs, [
+                ("a 1", "TTGCA", "EFGHI", "TTTTT"),
+                ("c 1", "CCCAA", "EDCBA", "GGGGG"),
+                ])
+            (r1, r2), = w.written[None]
+            self.assertEqual((r1.seq, r1.qual), ("CCCCC", "#####"))
+
+    def test_count(self):
+        x = InlineBarcodeFastqSequenceFile(StringIO(self.fwd), None, 4)
+        a = BarcodeAssigner([MockSample("S1", "ACGT")], revcomp=False)
+        self.assertEqual(x.count(a), {"S1": 1, "unassigned": 2})
+
+    def test_raw_parser(self):
+        self.assertRaises(
+            ValueError, InlineBarcodeFastqSequenceFile,
+            BytesIO(b""), BytesIO(b""), 4, parser="raw")
+
+
+class OpenInputTests(unittest.TestCase):
+    def test_text_passthrough(self):
+        f = StringIO(fastq1)
+        self.assertIs(open_input(f), f)
+
+    def test_uncompressed_binary(self):
+        f = open_input(BytesIO(fastq1.encode("ascii")))
+        self.assertEqual(f.read(), fastq1.encode("ascii"))
+
+    def test_prefetch(self):
+        f = open_input(
+            BytesIO(fastq1.encode("ascii")), prefetch=True,
+            readahead_blocks=1)
+        self.assertEqual(f.read(), fastq1.encode("ascii"))
+        f.close()
+
+    def test_gzip(self):
+        f = open_input(BytesIO(gzip.compress(fastq1.encode("ascii"))))
+        self.assertEqual(f.read(), fastq1.encode("ascii"))
+        f.close()
+
+    def test_bgzip_members(self):
+        # bgzip files are a series of concatenated gzip members
+        data = fastq1.encode("ascii")
+        members = gzip.compress(data[:20]) + gzip.compress(data[20:])
+        f = open_input(BytesIO(members))
+        obs = [r.seq for r in parse_fastq_blocks(f, block_size=5)]
+        self.assertEqual(obs, ["AGGGCCTTGGTGGTTAG", "GCTNNNNNNNNNNNNNNN"])
+
+    def test_demultiplex_gzip(self):
+        fwd = gzip.compress(fastq_with_barcode_fwd.encode("ascii"))
+        rev = gzip.compress(fastq_with_barcode_rev.encode("ascii"))
+        for parser in ["block", "line"]:
+            x = NoIndexFastqSequenceFile(
+                BytesIO(fwd), BytesIO(rev), parser=parser)
+            w = MockWriter()
+            s1 = MockSample("SampleS1", "GTTTCGCCCTAGTACA")
+            a = BarcodeAssigner([s1], mismatches=0, revcomp=False)
+            x.demultiplex(a, w)
+            self.assertEqual(a.read_counts, {"SampleS1": 1, "unassigned": 4})
+
 
 class FunctionTests(unittest.TestCase):
     def test_parse_fastq(self):
@@ -105,6 +230,204 @@ class FunctionTests(unittest.TestCase):
             "Seq2:with spaces", "GCTNNNNNNNNNNNNNNN", "##################"))
         self.assertRaises(StopIteration, next, obs)
 
+    def test_parse_fastq_blocks(self):
+        # Small blocks force records to span block boundaries
+        for f in [StringIO(fastq1), BytesIO(fastq1.encode("ascii"))]:
+            obs = [
+                (r.desc, r.seq, r.qual)
+                for r in parse_fastq_blocks(f, block_size=7)]
+            self.assertEqual(obs, list(parse_fastq(StringIO(fastq1))))
+
+    def test_parse_fastq_blocks_no_final_newline(self):
+        obs = list(parse_fastq_blocks(StringIO(fastq1.rstrip())))
+        self.assertEqual(obs[-1].qual, "##################")
+
+    def test_parse_fastq_blocks_incomplete(self):
+        obs = parse_fastq_blocks(StringIO("@a\nACGT\n+\n"))
+        self.assertRaises(ValueError, list, obs)
+
+    def test_parse_fastq_raw(self):
+        data = fastq1.encode("ascii")
+        for block_size in [7, 1000]:
+            obs = list(parse_fastq_raw(BytesIO(data), block_size=block_size))
+            self.assertEqual(
+                [(r.desc, r.seq, r.qual) for r in obs],
+                list(parse_fastq(StringIO(fastq1))))
+            self.assertEqual(b"".join(r.raw for r in obs), data)
+
+    def test_parse_fastq_raw_no_final_newline(self):
+        data = fastq1.rstrip().encode("ascii")
+        obs = list(parse_fastq_raw(BytesIO(data)))
+        self.assertEqual(obs[-1].qual, "##################")
+        # The missing newline is added to the last record
+        self.assertEqual(
+            bytes(obs[-1].raw),
+            b"@Seq2:with spaces\nGCTNNNNNNNNNNNNNNN\n+\n##################\n")
+
+    def test_parse_fastq_raw_errors(self):
+        obs = parse_fastq_raw(BytesIO(b"@a\nACGT\n+\n"))
+        self.assertRaises(ValueError, list, obs)
+        obs = parse_fastq_raw(BytesIO(b"@a\nACGT\n-\nIIII\n"))
+        self.assertRaises(ValueError, list, obs)
+        obs = parse_fastq_raw(StringIO(fastq1))
+        self.assertRaises(ValueError, list, obs)
+
+    def test_raw_record_pickle(self):
+        r = next(parse_fastq_raw(BytesIO(fastq1.encode("ascii"))))
+        r2 = pickle.loads(pickle.dumps(r))
+        self.assertEqual(bytes(r2.raw), bytes(r.raw))
+        self.assertEqual(r2.desc, "YesYes")
+
+    def test_demultiplex_line_parser(self):
+        fwd = StringIO(fastq_with_barcode_fwd)
+        rev = StringIO(fastq_with_barcode_rev)
+        x = NoIndexFastqSequenceFile(fwd, rev, parser="line")
+        w = MockWriter()
+        s1 = MockSample("SampleS1", "GTTTCGCCCTAGTACA")
+        a = BarcodeAssigner([s1], mismatches=0, revcomp=False)
+        x.demultiplex(a, w)
+        self.assertEqual(len(w.written["SampleS1"]), 1)
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class RawChunkTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        # Windows line endings are kept in the output
+        self.fwd = fastq_with_barcode_fwd.replace("\n", "\r\n").encode()
+        self.rev = fastq_with_barcode_rev.encode()
+        self.s1 = MockSample("SampleS1", "GTTTCGCCCTAGTACA")
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def make_writer(self, subdir):
+        output_dir = os.path.join(self.output_dir, subdir)
+        os.mkdir(output_dir)
+        return PassthroughPairedFastqWriter(output_dir, write_unassigned=True)
+
+    def read_output(self, subdir):
+        output_dir = os.path.join(self.output_dir, subdir)
+        result = {}
+        for filename in os.listdir(output_dir):
+            with open(os.path.join(output_dir, filename), "rb") as f:
+                result[filename] = f.read()
+        return result
+
+    def test_demultiplex_raw(self):
+        a = BarcodeAssigner([self.s1], mismatches=0, revcomp=False)
+        w = self.make_writer("records")
+        readpairs = zip(
+            parse_fastq_raw(BytesIO(self.fwd)),
+            parse_fastq_raw(BytesIO(self.rev)))
+        for fwd, rev in readpairs:
+            barcode = NoIndexFastqSequenceFile._get_barcode(fwd, rev)
+            w.write((fwd, rev), a.assign(barcode))
+        w.close()
+        expected_counts = dict(a.read_counts)
+
+        for block_size in [50, 1000]:
+            subdir = "chunks%s" % block_size
+            a = BarcodeAssigner([self.s1], mismatches=0, revcomp=False)
+            w = self.make_writer(subdir)
+            counts = demultiplex_raw(
+                [BytesIO(self.fwd), BytesIO(self.rev)],
+                NoIndexFastqSequenceFile._chunk_barcodes, a, w, block_size)
+            w.close()
+            self.assertEqual(counts, expected_counts)
+            self.assertEqual(
+                self.read_output(subdir), self.read_output("records"))
+
+    def test_demultiplex(self):
+        x = NoIndexFastqSequenceFile(
+            BytesIO(self.fwd), BytesIO(self.rev), parser="raw")
+        a = BarcodeAssigner([self.s1], mismatches=0, revcomp=False)
+        w = PassthroughPairedFastqWriter(self.output_dir)
+        self.assertEqual(x.demultiplex(a, w)["SampleS1"], 1)
+        w.close()
+        with open(w._get_output_fp(self.s1)[0], "rb") as f:
+            self.assertEqual(
+                f.read().split(b"\r\n")[0],
+                b"@HWI-D00727:9:C6JHHANXX:8:1101:1786:2183 "
+                b"1:N:0:GTTTCGCCCTAGTACA")
+
+    def test_aligned_record_blocks(self):
+        files = [BytesIO(self.fwd), BytesIO(fastq1.encode())]
+        chunks = list(aligned_record_blocks(files, block_size=100))
+        # Stops at the end of the shorter file
+        self.assertEqual(
+            sum(len(ends) for _, _, ends in (c[0] for c in chunks)),
+            fastq1.count("\n") // 4)
+        for chunk in chunks:
+            self.assertEqual(len(set(len(c[1]) for c in chunk)), 1)
+            for block, starts, ends in chunk:
+                for start, end in zip(starts, ends):
+                    self.assertEqual(block[start:start + 1], b"@")
+                    self.assertEqual(block[end - 1:end], b"\n")
+
+    def test_record_ends_python(self):
+        block = self.fwd + b"@partial\nACGT\n"
+        self.assertEqual(
+            _record_ends_python(block), _record_ends(block).tolist())
+        block = b"@a\nACGT\n-\nIIII\n"
+        self.assertRaises(ValueError, _record_ends_python, block)
+        self.assertRaises(ValueError, _record_ends, block)
+
+
+class ShardTests(unittest.TestCase):
+    def make_files(self, n=50):
+        # Quality lines that start with "@" must not be taken as records
+        fwd = "".join(
+            "@r%s/1\nACGT\n+\n@@@#\n" % i for i in range(n))
+        rev = "".join(
+            "@r%s/2 x\n%s\n+\n%s\n" % (i, "A" * (i % 7 + 1),
+                                       "@" * (i % 7 + 1))
+            for i in range(n))
+        return BytesIO(fwd.encode("ascii")), BytesIO(rev.encode("ascii"))
+
+    def test_find_record_start(self):
+        f = BytesIO(b"@a\nAC\n+\n@@\n@b\nGT\n+\n@#\n")
+        self.assertEqual(find_record_start(f, 0), 0)
+        self.assertEqual(find_record_start(f, 1), 11)
+        self.assertEqual(find_record_start(f, 8), 11)
+        self.assertEqual(find_record_start(f, 11), 11)
+        # No whole record after this, so the end of the file
+        self.assertEqual(find_record_start(f, 12), 22)
+
+    def test_shards(self):
+        for n_shards in [1, 2, 3, 7, 60]:
+            fwd_reads = []
+            rev_reads = []
+            for k in range(n_shards):
+                fwd, rev = open_shard(self.make_files(), k, n_shards)
+                fwd_reads.extend(parse_fastq_blocks(fwd))
+                rev_reads.extend(parse_fastq_blocks(rev))
+            self.assertEqual(
+                [r.desc for r in fwd_reads],
+                ["r%s/1" % i for i in range(50)])
+            self.assertEqual(
+                [r.desc for r in rev_reads],
+                ["r%s/2 x" % i for i in range(50)])
+
+    def test_shard_ranges(self):
+        fwd, rev = self.make_files()
+        ranges = [shard_ranges([fwd, rev], k, 2) for k in range(2)]
+        self.assertEqual(ranges[0][0][0], 0)
+        self.assertEqual(ranges[0][0][1], ranges[1][0][0])
+        self.assertEqual(ranges[0][1][1], ranges[1][1][0])
+        rev.seek(ranges[1][1][0])
+        self.assertEqual(rev.readline(), b"@r26/2 x\n")
+        self.assertRaises(ValueError, shard_ranges, [fwd, rev], 2, 2)
+
+    def test_shard_gzip(self):
+        f = BytesIO(gzip.compress(fastq1.encode("ascii")))
+        self.assertRaises(ValueError, shard_ranges, [f], 0, 2)
+
+    def test_missing_read(self):
+        fwd, _ = self.make_files()
+        rev = BytesIO(b"@other\nA\n+\n#\n")
+        self.assertRaises(ValueError, shard_ranges, [fwd, rev], 0, 2)
+
 
 fastq1 = """\
 @YesYes
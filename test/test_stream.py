@@ -0,0 +1,73 @@
+import collections
+from io import StringIO
+import unittest
+
+from dnabclib.assigner import BarcodeAssigner
+from dnabclib.seqfile import IndexFastqSequenceFile
+from dnabclib.stream import demultiplex_batches
+
+MockSample = collections.namedtuple("MockSample", "name barcode")
+
+
+def get_barcode(fwd, rev, bc):
+    return bc
+
+
+class DemultiplexBatchesTests(unittest.TestCase):
+    def setUp(self):
+        self.s1 = MockSample("S1", "AAAA")
+        self.s2 = MockSample("S2", "CCCC")
+        self.assigner = BarcodeAssigner(
+            [self.s1, self.s2], mismatches=0, revcomp=False)
+
+    def records(self, barcodes):
+        return [("f%s" % n, "r%s" % n, bc) for n, bc in enumerate(barcodes)]
+
+    def test_batch_size(self):
+        records = self.records(["AAAA", "CCCC", "AAAA", "GGGG", "AAAA"])
+        obs = list(demultiplex_batches(
+            records, get_barcode, self.assigner, batch_size=2))
+        self.assertEqual(obs, [
+            (self.s1, [("f0", "r0"), ("f2", "r2")]),
+            (self.s2, [("f1", "r1")]),
+            (self.s1, [("f4", "r4")]),
+            ])
+        self.assertEqual(
+            self.assigner.read_counts, {"S1": 3, "S2": 1, "unassigned": 1})
+
+    def test_include_unassigned(self):
+        records = self.records(["GGGG", "AAAA"])
+        obs = list(demultiplex_batches(
+            records, get_barcode, self.assigner, include_unassigned=True))
+        self.assertEqual(obs, [
+            (None, [("f0", "r0")]),
+            (self.s1, [("f1", "r1")]),
+            ])
+
+    def test_max_buffered_reads(self):
+        records = self.records(["AAAA", "AAAA", "CCCC", "AAAA"])
+        batches = demultiplex_batches(
+            records, get_barcode, self.assigner, batch_size=10,
+            max_buffered_reads=3)
+        # The largest batch is given up when 3 reads are held
+        self.assertEqual(
+            next(batches), (self.s1, [("f0", "r0"), ("f1", "r1")]))
+        self.assertEqual(list(batches), [
+            (self.s2, [("f2", "r2")]),
+            (self.s1, [("f3", "r3")]),
+            ])
+
+    def test_iter_batches(self):
+        idx = StringIO("@a\nAAAA\n+\n####\n@b\nCCCC\n+\n####\n")
+        fwd = StringIO("@a\nACGT\n+\n####\n@b\nTTTT\n+\n####\n")
+        rev = StringIO("@a\nTGCA\n+\n####\n@b\nGGGG\n+\n####\n")
+        x = IndexFastqSequenceFile(fwd, rev, idx)
+        obs = [
+            (sample.name, [(r1.seq, r2.seq) for r1, r2 in reads])
+            for sample, reads in x.iter_batches(self.assigner)]
+        self.assertEqual(obs, [
+            ("S1", [("ACGT", "TGCA")]), ("S2", [("TTTT", "GGGG")])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+from collections import namedtuple
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from dnabclib.assigner import BarcodeAssigner, build_barcode_table
+from dnabclib.tablecache import (
+    MappedBarcodeTable, cache_fp, cache_key, load_table, numpy,
+    )
+
+
+MockSample = namedtuple("Sample", "name barcode")
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TableCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        self.items = [
+            ("AAAAAA", "a", "sample a"),
+            ("CCCCCC", "c", "sample c"),
+            ("GGGTTT", "g", "sample g"),
+            ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def cached_fp(self, mismatches=1):
+        return cache_fp(self.cache_dir, cache_key(self.items, mismatches))
+
+    def test_round_trip(self):
+        built = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        self.assertTrue(os.path.exists(self.cached_fp()))
+        loaded = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        self.assertIsInstance(loaded, MappedBarcodeTable)
+        for seq, value in built.items():
+            self.assertEqual(loaded[seq], value)
+        self.assertEqual(loaded["AAAAAC"], "a")
+        self.assertEqual(loaded.get("GGGTTA"), "g")
+        self.assertEqual(loaded["ACACAC"], None)
+        self.assertEqual(loaded.get("ACACAC", "x"), "x")
+        self.assertEqual(loaded["AAA"], None)
+
+    def test_key_depends_on_mismatches(self):
+        self.assertNotEqual(
+            cache_key(self.items, 0), cache_key(self.items, 1))
+        build_barcode_table(self.items, 0, cache_dir=self.cache_dir)
+        table = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        self.assertEqual(table["AAAAAC"], "a")
+
+    def test_wrong_key(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        fp = self.cached_fp()
+        self.assertIsNone(load_table(fp, cache_key(self.items, 2), self.items))
+
+    def test_corrupted_file(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        fp = self.cached_fp()
+        # The header follows a 20-byte prefix
+        with open(fp, "r+b") as f:
+            f.seek(24)
+            f.write(b"\xff\xff")
+        key = cache_key(self.items, 1)
+        self.assertIsNone(load_table(fp, key, self.items))
+
+        # The table is built and saved again
+        table = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        self.assertEqual(table["AAAAAC"], "a")
+        self.assertIsNotNone(load_table(fp, key, self.items))
+
+    def test_truncated_file(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        fp = self.cached_fp()
+        with open(fp, "r+b") as f:
+            f.truncate(10)
+        key = cache_key(self.items, 1)
+        self.assertIsNone(load_table(fp, key, self.items))
+
+    def test_wrong_values(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        fp = self.cached_fp()
+        items = [self.items[1], self.items[0], self.items[2]]
+        self.assertIsNone(load_table(fp, cache_key(self.items, 1), items))
+
+    def test_unencoded_sequences(self):
+        items = [("AANAAA", "a", "sample a"), ("C" * 40, "c", "sample c")]
+        build_barcode_table(items, 1, cache_dir=self.cache_dir)
+        table = build_barcode_table(items, 1, cache_dir=self.cache_dir)
+        self.assertIsInstance(table, MappedBarcodeTable)
+        self.assertEqual(table["AANAAA"], "a")
+        self.assertEqual(table["ACNAAA"], "a")
+        self.assertEqual(table["C" * 39 + "A"], "c")
+        self.assertEqual(table["AANTTT"], None)
+
+    def test_encoded(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        table = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        encoded = table.encoded(["g", "c", "a"])
+        self.assertEqual(
+            encoded.lookup(["AAAAAC", "GGGTTA", "CCCCCC", "ACACAC"]).tolist(),
+            [2, 0, 1, 3])
+
+    def test_pickle(self):
+        build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        table = build_barcode_table(self.items, 1, cache_dir=self.cache_dir)
+        table2 = pickle.loads(pickle.dumps(table))
+        self.assertIsInstance(table2, MappedBarcodeTable)
+        self.assertEqual(table2["CCCCCA"], "c")
+
+    def test_assigner(self):
+        samples = [MockSample("a", "AAAAAA"), MockSample("c", "CCCCCC")]
+        BarcodeAssigner(
+            samples, mismatches=1, revcomp=False,
+            table_cache_dir=self.cache_dir)
+        a = BarcodeAssigner(
+            samples, mismatches=1, revcomp=False,
+            table_cache_dir=self.cache_dir)
+        self.assertIsInstance(a._barcodes, MappedBarcodeTable)
+        self.assertEqual(a.assign("AAAAAC"), samples[0])
+        self.assertEqual(a.assign("ACACAC"), None)
+        self.assertEqual(a.read_counts, {"a": 1, "c": 0, "unassigned": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from dnabclib.twobit import EncodedTable, encode, encode_seq, numpy
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TwoBitTests(unittest.TestCase):
+    def test_encode(self):
+        keys = encode(["A", "ACGT", "T", "", "ACNT", "AA"]).tolist()
+        self.assertEqual(keys, [4, 256 + 27, 7, 0, 0, 16])
+
+    def test_encode_equal_length(self):
+        self.assertEqual(encode(["AC", "GT", "NA"]).tolist(), [17, 27, 0])
+        self.assertEqual(encode([]).tolist(), [])
+
+    def test_encode_too_long(self):
+        self.assertEqual(encode(["A" * 31, "A" * 32]).tolist(), [1 << 62, 0])
+
+    def test_encode_seq(self):
+        seqs = ["A", "ACGT", "", "ACNT", "A1", "A" * 31, "A" * 32]
+        self.assertEqual(
+            [encode_seq(seq) for seq in seqs], encode(seqs).tolist())
+
+    def test_lookup(self):
+        table = EncodedTable([("ACGT", 0), ("ACGA", 1), ("NCGT", 1)], 2)
+        self.assertEqual(
+            table.lookup(["ACGT", "ACGA", "NCGT", "ACG", "TTTT"]).tolist(),
+            [0, 1, 1, 2, 2])
+
+    def test_lookup_sorted_keys(self):
+        long_bc = "ACGT" * 4
+        table = EncodedTable([(long_bc, 0), ("A", 1)], 2)
+        self.assertIsNone(table.direct)
+        self.assertEqual(
+            table.lookup([long_bc, "A", "C", "T" * 16]).tolist(), [0, 1, 2, 2])
+
+    def test_empty_table(self):
+        table = EncodedTable([], 0)
+        self.assertEqual(table.lookup(["ACGT", ""]).tolist(), [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,17 @@
 from collections import namedtuple
+import concurrent.futures
+import gzip
+from io import BytesIO
 import os.path
 import shutil
 import tempfile
 import unittest
 
-from dnabclib.writer import FastaWriter, FastqWriter, PairedFastqWriter
+from dnabclib.seqfile import parse_fastq_raw
+from dnabclib.writer import (
+    FastaWriter, FastqWriter, PairedFastqWriter, ParallelGzipFile,
+    PassthroughFastqWriter, PassthroughPairedFastqWriter,
+    )
 
 
 class FastaWriterTests(unittest.TestCase):
@@ -57,6 +64,68 @@ class FastqWriterTests(unittest.TestCase):
 
         self.assertFalse(os.path.exists(w._get_output_fp(s2)))
 
+    def test_write_gzip(self):
+        s1 = self.Sample("h56")
+        w = FastqWriter(self.output_dir, compression="gzip")
+        w.write(self.Read("Read0", "ACCTTGG", "#######"), s1)
+        w.close()
+
+        fp = w._get_output_fp(s1)
+        self.assertTrue(fp.endswith(".fastq.gz"))
+        with gzip.open(fp, "rt") as f:
+            obs_output = f.read()
+        self.assertEqual(obs_output, "@Read0\nACCTTGG\n+\n#######\n")
+
+    def test_consume(self):
+        s1 = self.Sample("h56")
+        w = FastqWriter(self.output_dir, buffer_size=40)
+        read = self.Read("Read0", "ACCTTGG", "#######")
+        w.consume([(s1, [read, read]), (None, [read]), (s1, [read])])
+        w.close()
+        with open(w._get_output_fp(s1)) as f:
+            self.assertEqual(f.read(), "@Read0\nACCTTGG\n+\n#######\n" * 3)
+        self.assertEqual(w.flush_stats["threshold_flushes"], 1)
+
+    def test_batched_writes(self):
+        s1 = self.Sample("h56")
+        s2 = self.Sample("123")
+        w = FastqWriter(self.output_dir, buffer_size=40)
+        read = self.Read("Read0", "ACCTTGG", "#######")
+        # Each formatted read is 25 characters
+        w.write(read, s1)
+        self.assertFalse(os.path.exists(w._get_output_fp(s1)))
+        w.write(read, s1)
+        w.write(read, s2)
+        w.close()
+
+        with open(w._get_output_fp(s1)) as f:
+            self.assertEqual(f.read(), "@Read0\nACCTTGG\n+\n#######\n" * 2)
+        self.assertEqual(w.flush_stats, {
+            "threshold_flushes": 1, "memory_cap_flushes": 0,
+            "final_flushes": 1, "checkpoint_flushes": 0,
+            "bytes_written": 75})
+
+    def test_memory_cap(self):
+        s1 = self.Sample("h56")
+        s2 = self.Sample("123")
+        w = FastqWriter(self.output_dir, buffer_size=1000,
+                        max_buffer_memory=100)
+        read = self.Read("Read0", "ACCTTGG", "#######")
+        w.write(read, s1)
+        w.write(read, s2)
+        w.write(read, s1)
+        # 100 characters buffered, the largest batch is written first
+        w.write(read, s2)
+        self.assertEqual(w.flush_stats["memory_cap_flushes"], 2)
+        self.assertEqual(w._batches, {})
+        w.close()
+        with open(w._get_output_fp(s2)) as f:
+            self.assertEqual(f.read(), "@Read0\nACCTTGG\n+\n#######\n" * 2)
+
+    def test_unknown_compression(self):
+        self.assertRaises(
+            ValueError, FastqWriter, self.output_dir, compression="zip")
+
 
 class PairedFastqWriterTests(unittest.TestCase):
     def setUp(self):
@@ -92,6 +161,180 @@ class PairedFastqWriterTests(unittest.TestCase):
         self.assertFalse(any(
             os.path.exists(fp) for fp in w._get_output_fp(s2)))
 
+    def test_write_unassigned(self):
+        readpair = (self.Read("r", "A", "#"), self.Read("r", "C", "#"))
+        w = PairedFastqWriter(self.output_dir)
+        w.write(readpair, None)
+        w.close()
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+        w = PairedFastqWriter(self.output_dir, write_unassigned=True)
+        w.write(readpair, None)
+        w.close()
+        fp1 = os.path.join(self.output_dir, "unassigned_R1.fastq")
+        with open(fp1) as f:
+            self.assertEqual(f.read(), "@r\nA\n+\n#\n")
+
+    def test_file_handle_limit(self):
+        samples = [self.Sample("s%s" % n) for n in range(3)]
+        # Room for one sample's pair of files
+        w = PairedFastqWriter(self.output_dir, buffer_size=0,
+                              max_open_files=3)
+        for n in range(2):
+            for s in samples:
+                readpair = (
+                    self.Read("%s_%s" % (s.name, n), "A", "#"),
+                    self.Read("%s_%s" % (s.name, n), "C", "#"),
+                    )
+                w.write(readpair, s)
+                self.assertEqual(len(w._open_files), 1)
+        w.close()
+        self.assertEqual(
+            w.handle_stats, {"opens": 3, "reopens": 3, "evictions": 5})
+
+        fp1, fp2 = w._get_output_fp(samples[1])
+        with open(fp2) as f:
+            self.assertEqual(f.read(), "@s1_0\nC\n+\n#\n@s1_1\nC\n+\n#\n")
+
+    def test_write_threads(self):
+        samples = [self.Sample("s%s" % n) for n in range(5)]
+        for compression in [None, "gzip"]:
+            w = PairedFastqWriter(
+                self.output_dir, compression=compression, buffer_size=0,
+                max_open_files=4, write_threads=2, write_queue_size=1)
+            for n in range(20):
+                s = samples[n % 5]
+                readpair = (
+                    self.Read("%s_%s" % (s.name, n), "A", "#"),
+                    self.Read("%s_%s" % (s.name, n), "C", "#"),
+                    )
+                w.write(readpair, s)
+            w.close()
+            fp1, _ = w._get_output_fp(samples[3])
+            with gzip.open(fp1, "rt") if compression else open(fp1) as f:
+                self.assertEqual(f.read(), "".join(
+                    "@s3_%s\nA\n+\n#\n" % n for n in [3, 8, 13, 18]))
+
+    def test_write_thread_error(self):
+        s1 = self.Sample("a")
+        w = PairedFastqWriter(
+            self.output_dir, buffer_size=0, write_threads=1)
+        readpair = (self.Read("r", "A", "#"), self.Read("r", "C", "#"))
+        w.write(readpair, s1)
+        f1, f2 = w._open_files[s1]
+        # Closing a file from under the writer makes the next write fail
+        w._write_threads[0].wait()
+        f1.close()
+        w.write(readpair, s1)
+        self.assertRaises(ValueError, w.close)
+
+    def test_gzip_buffers_within_memory_cap(self):
+        s1 = self.Sample("a")
+        readpair = (self.Read("r", "A", "#"), self.Read("r", "C", "#"))
+        memory = 1 << 28
+        for max_open_files, block_size in [(512, 52428), (4, 1 << 20)]:
+            w = PairedFastqWriter(
+                self.output_dir, compression="gzip",
+                max_buffer_memory=memory, max_open_files=max_open_files)
+            w.write(readpair, s1)
+            w.flush()
+            f1, f2 = w._open_files[s1]
+            self.assertEqual(f1.block_size, block_size)
+            # Each file holds one block being filled and the blocks
+            # waiting to be compressed
+            gzip_memory = max_open_files * 5 * block_size
+            self.assertLessEqual(gzip_memory, memory // 2)
+            self.assertLessEqual(w._batch_memory + gzip_memory, memory)
+            w.close()
+
+    def test_file_handle_limit_gzip(self):
+        s1 = self.Sample("a")
+        s2 = self.Sample("b")
+        w = PairedFastqWriter(self.output_dir, compression="gzip",
+                              buffer_size=0, max_open_files=2)
+        readpair = (self.Read("r", "A", "#"), self.Read("r", "C", "#"))
+        for s in [s1, s2, s1]:
+            w.write(readpair, s)
+        w.close()
+        fp1, _ = w._get_output_fp(s1)
+        with gzip.open(fp1, "rt") as f:
+            self.assertEqual(f.read(), "@r\nA\n+\n#\n" * 2)
+
+    def test_write_gzip(self):
+        s1 = self.Sample("ghj")
+        w = PairedFastqWriter(
+            self.output_dir, compression="gzip", compression_level=1)
+        readpair = (
+            self.Read("Read0", "ACCTTGG", "#######"),
+            self.Read("Read1", "GCTAGCT", ";342dfA"),
+            )
+        w.write(readpair, s1)
+        w.close()
+
+        fp1, fp2 = w._get_output_fp(s1)
+        with gzip.open(fp1, "rt") as f:
+            self.assertEqual(f.read(), "@Read0\nACCTTGG\n+\n#######\n")
+        with gzip.open(fp2, "rt") as f:
+            self.assertEqual(f.read(), "@Read1\nGCTAGCT\n+\n;342dfA\n")
+
+
+class PassthroughWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.Sample = namedtuple("Sample", "name")
+        self.data1 = b"@r0\nACGT\n+\nIIII\n@r1\nGG\n+x\n##\n"
+        self.data2 = b"@r0\nTTTT\n+\nIIII\n@r1\nCC\n+\n##\n"
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_write(self):
+        s1 = self.Sample("a")
+        w = PassthroughFastqWriter(self.output_dir, buffer_size=20)
+        for r in parse_fastq_raw(BytesIO(self.data1)):
+            w.write(r, s1)
+        w.close()
+        with open(w._get_output_fp(s1), "rb") as f:
+            self.assertEqual(f.read(), self.data1)
+
+    def test_write_paired_gzip(self):
+        s1 = self.Sample("a")
+        s2 = self.Sample("b")
+        w = PassthroughPairedFastqWriter(
+            self.output_dir, compression="gzip", write_unassigned=True)
+        readpairs = zip(
+            parse_fastq_raw(BytesIO(self.data1)),
+            parse_fastq_raw(BytesIO(self.data2)))
+        for readpair, sample in zip(readpairs, [s1, None]):
+            w.write(readpair, sample)
+        w.close()
+        fp1, fp2 = w._get_output_fp(s1)
+        with gzip.open(fp2) as f:
+            self.assertEqual(f.read(), b"@r0\nTTTT\n+\nIIII\n")
+        fp1 = os.path.join(self.output_dir, "unassigned_R1.fastq.gz")
+        with gzip.open(fp1) as f:
+            self.assertEqual(f.read(), b"@r1\nGG\n+x\n##\n")
+        self.assertFalse(os.path.exists(w._get_output_fp(s2)[0]))
+
+
+class ParallelGzipFileTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_write_many_blocks(self):
+        fp = os.path.join(self.output_dir, "a.gz")
+        lines = ["line %s\n" % i for i in range(1000)]
+        with concurrent.futures.ThreadPoolExecutor(3) as pool:
+            f = ParallelGzipFile(fp, pool, block_size=100)
+            for line in lines:
+                f.write(line)
+            f.close()
+        with gzip.open(fp, "rt") as f:
+            self.assertEqual(f.read(), "".join(lines))
+
 
 if __name__ == '__main__':
     unittest.main()